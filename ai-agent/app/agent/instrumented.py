@@ -0,0 +1,139 @@
+"""
+phi classes that report to app.telemetry
+
+Imports phi, so only import this module where an agent is being built.
+"""
+from phi.model.openai import OpenAIChat
+from phi.tools.duckdb import DuckDbTools
+from app.telemetry import observe, span, count
+from app.data.engine import log_memory
+from app.data.query_cache import query_cache, normalize_query, is_cacheable, fetch_result, format_result
+import functools
+import time
+import re
+
+
+def _record_usage(usage):
+    if usage is not None:
+        count('prompt_tokens', getattr(usage, 'prompt_tokens', 0) or 0)
+        count('completion_tokens', getattr(usage, 'completion_tokens', 0) or 0)
+        details = getattr(usage, 'prompt_tokens_details', None)
+        count('cached_prompt_tokens', getattr(details, 'cached_tokens', 0) or 0)
+
+
+class TracedOpenAIChat(OpenAIChat):
+    """OpenAIChat that times every completion and counts calls and tokens"""
+
+    def invoke(self, messages):
+        count('llm_calls')
+        with span('llm'):
+            response = super().invoke(messages)
+        _record_usage(getattr(response, 'usage', None))
+        return response
+
+    def invoke_stream(self, messages):
+        # Only the time spent waiting for chunks counts, not what the caller does between them
+        count('llm_calls')
+        chunks = super().invoke_stream(messages)
+        start = time.perf_counter()
+        waited = 0.0
+        try:
+            while True:
+                before = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    waited += time.perf_counter() - before
+                    break
+                waited += time.perf_counter() - before
+                _record_usage(getattr(chunk, 'usage', None))
+                yield chunk
+        finally:
+            observe('llm', start, waited)
+
+
+class SalesDuckDbTools(DuckDbTools):
+    """
+    DuckDbTools that times every tool call, estimates the rows each query reads and
+    logs the connection's memory use afterwards
+
+    table_rows maps the tables on the connection to their row counts; a query is
+    charged the rows of every table it mentions, an upper bound on what it scans.
+
+    Given a dataset (a materialized parquet path), read-only queries are answered from
+    app.data.query_cache when an agent whose connection exposes the same views (same
+    names over the same files, so an approximate agent's sales_data over the sample
+    never shares results with an exact one's) has run them before. Once a query
+    changes the connection (e.g. creates a table) the cache is no longer used, since
+    results could then differ from another agent's. Only the first
+    QUERY_RESULT_MAX_ROWS rows of a result are fetched for the agent to see.
+    """
+
+    def __init__(self, table_rows=None, dataset=None, **kwargs):
+        self.table_rows = dict(table_rows or {})
+        self._table_patterns = {name: re.compile(rf'\b{re.escape(name)}\b', re.IGNORECASE)
+                                for name in self.table_rows}
+        self.dataset = dataset
+        self._cache_scope = None
+        super().__init__(**kwargs)
+        if dataset is not None:
+            # Read the views while the agent is built rather than on its first query
+            self.cache_scope()
+
+    def register(self, function, sanitize_arguments=True):
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            count('tool_calls')
+            query = kwargs.get('query') or kwargs.get('table') or (args[0] if args else '')
+            try:
+                with span('tool'):
+                    return function(*args, **kwargs)
+            finally:
+                log_memory(self.connection, f"{function.__name__} {str(query)[:200]!r}")
+
+        super().register(traced, sanitize_arguments=sanitize_arguments)
+
+    def estimate_rows(self, text):
+        return sum(rows for name, rows in self.table_rows.items() if self._table_patterns[name].search(text))
+
+    def cache_scope(self):
+        """The query cache scope of this connection: its dataset and the definitions of its views"""
+        if self._cache_scope is None:
+            views = self.connection.execute(
+                "SELECT view_name, sql FROM duckdb_views() WHERE NOT internal ORDER BY view_name"
+            ).fetchall()
+            self._cache_scope = (self.dataset, tuple(views))
+        return self._cache_scope
+
+    def run_query(self, query: str) -> str:
+        """Function that runs a query and returns the result.
+
+        :param query: SQL query to run
+        :return: Result of the query
+        """
+        sql, key = normalize_query(query)
+        cacheable = self.dataset is not None and is_cacheable(key)
+        cached = query_cache.get(self.cache_scope(), key) if cacheable else None
+        if cached is not None:
+            table, total_rows, seconds = cached
+            count('query_cache_hits')
+            count('query_ms_saved', round(seconds * 1000))
+        else:
+            count('rows_scanned', self.estimate_rows(sql))
+            start = time.perf_counter()
+            try:
+                relation = self.connection.sql(sql)
+                if relation is None:
+                    # The statement may have changed what the connection's tables hold
+                    self.dataset = None
+                    return "No output"
+                table, total_rows = fetch_result(relation)
+            except Exception as e:
+                return str(e)
+            if cacheable:
+                query_cache.put(self.cache_scope(), key, table, total_rows, time.perf_counter() - start)
+        text, truncated = format_result(table, total_rows)
+        if truncated:
+            count('rows_truncated', truncated)
+            query_cache.record_truncated(truncated)
+        return text
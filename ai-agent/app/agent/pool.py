@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import logging
+import time
+import os
+
+AGENT_POOL_MAX_SIZE = int(os.environ.get('AGENT_POOL_MAX_SIZE', '8'))
+AGENT_POOL_IDLE_SECONDS = float(os.environ.get('AGENT_POOL_IDLE_SECONDS', '900'))
+
+logger = logging.getLogger("AgentPool")
+
+
+class AgentPool:
+    """
+    Bounded pool of pre-built agents keyed by dataset
+
+    An agent is only ever lent to one caller at a time, so two concurrent requests
+    never share an agent or its DuckDB connection. Idle agents are kept per key and
+    evicted least-recently-used first, or once they have been idle for too long.
+    evict() drops the agents of given keys at once, e.g. when the files their
+    connections read are about to be removed; agents lent out at the time are closed
+    when they are returned instead of going back into the pool.
+    """
+
+    def __init__(self, max_size=AGENT_POOL_MAX_SIZE, idle_seconds=AGENT_POOL_IDLE_SECONDS):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self._idle = OrderedDict()  # key -> list of (agent, returned_at), least recently used first
+        self._idle_count = 0
+        self._leased = {}  # id(agent) -> key of the agents lent out
+        self._retired = set()  # id(agent) of lent out agents to close when returned
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def checkout(self, key, factory):
+        """Take an idle agent for key out of the pool, or build a new one with factory()"""
+        agent = None
+        with self._lock:
+            expired = self._evict_expired(time.monotonic())
+            agents = self._idle.get(key)
+            if agents:
+                agent, _ = agents.pop()
+                self._idle_count -= 1
+                if not agents:
+                    del self._idle[key]
+                self.hits += 1
+            else:
+                self.misses += 1
+        for old_agent in expired:
+            close_agent(old_agent)
+        if agent is None:
+            logger.info(f"Building new agent for {key}")
+            agent = factory()
+        with self._lock:
+            self._leased[id(agent)] = key
+        return agent
+
+    def checkin(self, key, agent):
+        """Return an agent to the pool once the caller is done with it"""
+        if self._release(agent):
+            close_agent(agent)
+            return
+        reset_agent(agent)
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            self._idle.setdefault(key, []).append((agent, now))
+            self._idle.move_to_end(key)
+            self._idle_count += 1
+            evicted += self._evict_expired(now)
+            while self._idle_count > self.max_size:
+                evicted.append(self._pop_oldest())
+        for old_agent in evicted:
+            close_agent(old_agent)
+
+    @contextmanager
+    def lease(self, key, factory):
+        """Borrow an agent for the duration of a with-block"""
+        agent = self.checkout(key, factory)
+        try:
+            yield agent
+        except BaseException:
+            # Don't put an agent back in the pool after a failed run
+            self._release(agent)
+            close_agent(agent)
+            raise
+        else:
+            self.checkin(key, agent)
+
+    def evict(self, matches):
+        """
+        Close the idle agents of every key for which matches(key) is true, and retire
+        those lent out so they are closed when returned
+
+        Returns:
+            int: the number of agents evicted or retired
+        """
+        evicted = []
+        with self._lock:
+            for key in [key for key in self._idle if matches(key)]:
+                evicted += [agent for agent, _ in self._idle.pop(key)]
+            self._idle_count -= len(evicted)
+            self.evictions += len(evicted)
+            retired = {agent_id for agent_id, key in self._leased.items() if matches(key)}
+            self._retired |= retired
+        for agent in evicted:
+            close_agent(agent)
+        return len(evicted) + len(retired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle": self._idle_count,
+                "leased": len(self._leased),
+                "keys": len(self._idle),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _release(self, agent):
+        """Forget a lent out agent; returns whether it was retired while lent out"""
+        with self._lock:
+            self._leased.pop(id(agent), None)
+            if id(agent) in self._retired:
+                self._retired.discard(id(agent))
+                self.evictions += 1
+                return True
+            return False
+
+    def _pop_oldest(self):
+        key, agents = next(iter(self._idle.items()))
+        agent, _ = agents.pop(0)
+        if not agents:
+            del self._idle[key]
+        self._idle_count -= 1
+        self.evictions += 1
+        return agent
+
+    def _evict_expired(self, now):
+        expired = []
+        for key in list(self._idle):
+            agents = self._idle[key]
+            fresh = [(agent, returned_at) for agent, returned_at in agents if now - returned_at < self.idle_seconds]
+            if len(fresh) == len(agents):
+                continue
+            expired += [agent for agent, returned_at in agents if now - returned_at >= self.idle_seconds]
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+        self._idle_count -= len(expired)
+        self.evictions += len(expired)
+        return expired
+
+
+def reset_agent(agent):
+    """Forget the previous conversation so a pooled agent can serve a new request"""
+    memory = getattr(agent, 'memory', None)
+    if memory is not None:
+        memory.clear()
+
+
+def close_agent(agent):
+    """Close the DuckDB connection owned by an agent, if any"""
+    connection = getattr(agent, 'connection', None)
+    if connection is None:
+        return
+    try:
+        connection.close()
+    except Exception as e:
+        logger.warning(f"Error closing agent connection: {e}")
+
+
+agent_pool = AgentPool()
@@ -0,0 +1,183 @@
+"""
+Analyst instructions assembled from fragments
+
+Every analyst agent gets the same system instructions (analyst_instructions): only
+what any question needs, never varying between requests, plus how to use the rollup
+tables for agents that have them. Followed by the dataset's semantic model, the system
+prompt is then byte-for-byte the same on every call about a dataset, so the provider's
+prompt cache can serve it. The report sections a question touches travel with the
+question instead (scope_question); only a request for a full report gets all of them.
+Lines that name the rollup tables or the analytics tools (app.agent.tools) are only
+given to agents that have them, so no agent is sent looking for what isn't there.
+"""
+from collections import namedtuple
+import re
+
+BASE_INSTRUCTIONS = [
+    "You are an AI-powered sales analytics system that analyzes sales data comprehensively",
+    "Always provide precise numerical answers with calculations explained",
+    "Use visual-friendly formatting like tables and lists for data presentation",
+    "Ensure all percentages are properly calculated and clearly labeled",
+    "Use consistent number formatting (e.g., '$1,234.56' for currency)",
+    "When answering specific questions, focus on the requested metric but include related insights",
+    "When a question lists analyses to cover, cover those rather than writing a full report",
+
+    "NEVER INCLUDE ANY SQL QUERIES IN YOUR RESPONSES",
+    "DO NOT MENTION SQL OR QUERY SYNTAX AT ALL",
+    "Present all findings as if they came from direct data analysis without mentioning database operations",
+
+    "The semantic model already lists every column of sales_data with its type, role and distinct count - use it instead of describing or summarizing the table first",
+    "Adapt your analysis based on available data fields - skip anything that isn't applicable",
+    "When certain data is missing for calculations, clearly explain the limitation",
+    "Use appropriate terminology matching the data (products vs services, customers vs clients, etc.)",
+]
+
+# For agents whose connection exposes the rollup tables (see app.data.rollups)
+ROLLUP_INSTRUCTIONS = [
+    "For trends and breakdowns by day, month, product, region or customer, query the pre-aggregated sales_by_* tables listed in the semantic model instead of scanning sales_data; sum their measures when rolling up further (e.g. months into quarters)",
+]
+
+
+def analyst_instructions(rollups):
+    """The system instructions of an analyst agent, with those about the rollup tables when it has them"""
+    return BASE_INSTRUCTIONS + (ROLLUP_INSTRUCTIONS if rollups else [])
+
+SUMMARY_BULLETS = [
+    "- Provide a concise 2-3 sentence overview highlighting the most significant findings",
+    "- Compare overall performance to previous periods (month-over-month and year-over-year)",
+    "- Include one critical recommendation based on the data",
+]
+
+# pattern: the words in a question that call for the section; tool_bullets: bullets for
+# agents that have the analytics tools only
+ReportSection = namedtuple('ReportSection', ['number', 'title', 'bullets', 'pattern', 'tool_bullets'],
+                           defaults=[()])
+
+REPORT_SECTIONS = [
+    ReportSection(1, "Sales Performance Metrics", [
+        "- Total Sales Revenue = Sum of all invoice totals",
+        "- Total Number of Sales = Count of invoices/orders",
+        "- Average Order Value (AOV) = Total Sales Revenue / Total Number of Sales",
+        "- Sales Growth Rate = (Current Period Sales - Previous Period Sales) / Previous Period Sales",
+    ], re.compile(r'\b(revenue|sales|sold|orders?|invoices?|aov|average order|growth|totals?)\b')),
+    ReportSection(2, "Product Performance & Profitability", [
+        "- Top 5 Selling Products by both revenue and quantity",
+        "- Bottom 5 Selling Products by both revenue and quantity",
+        "- Profit Per Product where possible (if cost data is available)",
+        "- Total Profit across all products (if cost data is available)",
+    ], re.compile(r'\b(products?|items?|skus?|profit\w*|margins?|best[- ]selling|top[- ]selling|'
+                  r'worst[- ]selling|bestsellers?)\b')),
+    ReportSection(3, "Customer Insights (if customer data is available)", [
+        "- Top 5 Customers by Revenue",
+        "- Customer Retention Rate = Percentage of repeat customers",
+        "- Average Purchase Frequency = Total Orders / Unique Customers",
+        "- Customer Lifetime Value (CLV) = (Average Order Value × Purchase Frequency × Retention Rate)",
+    ], re.compile(r'\b(customers?|clients?|buyers?|shoppers?|retention|repeat|loyal\w*|churn\w*|clv|lifetime)\b'), [
+        "- Take these from customer_insights in one call, and say how it defines CLV and retention",
+    ]),
+    ReportSection(4, "Inventory & Stock Analysis", [
+        "- Most Profitable Products = Products with the highest total profit",
+        "- Slow-Moving Inventory = Products with low sales over a period",
+        "- Stock Turnover analysis where possible",
+    ], re.compile(r'\b(inventory|stock\w*|slow[- ]moving|turnover|restock\w*|haven\'t sold|not sold)\b')),
+    ReportSection(5, "Seasonal Trends & Forecasting", [
+        "- Monthly/Quarterly Sales Trends with clear identification of peak periods",
+        "- Demand Forecasting for upcoming months based on historical trends",
+        "- Price Sensitivity Analysis where possible",
+    ], re.compile(r'\b(trends?|trending|seasonal\w*|seasons?|peaks?|busiest|forecast\w*|predict\w*|projections?|'
+                  r'upcoming|next (week|month|quarter|year)|monthly|quarterly|weekly|over time)\b'), [
+        "- For forecasts, call forecast_sales (per product where it matters) and report the model it chose, "
+        "its backtest error and the confidence interval instead of extrapolating by hand",
+    ]),
+    ReportSection(6, "Discount & Pricing Effectiveness (if discount data is available)", [
+        "- Impact of Discounts on Sales = Comparing sales before and after discounts",
+        "- Best-Performing Discount Strategies",
+        "- Markdown Loss analysis if data permits",
+    ], re.compile(r'\b(discount\w*|promo\w*|coupons?|markdowns?|pricing|prices?)\b')),
+    ReportSection(7, "Performance Comparison", [
+        "- Compare with previous month (month-over-month)",
+        "- Compare with same month last year (year-over-year)",
+        "- Highlight significant changes (>10% change)",
+    ], re.compile(r'\b(compare\w*|comparison|versus|vs|month[- ]over[- ]month|year[- ]over[- ]year|mom|yoy|'
+                  r'last (week|month|quarter|year)|previous|prior|drop\w*|fell|fall|declin\w*|change\w*)\b')),
+    ReportSection(8, "Strategic Recommendations", [
+        "- Provide 3-5 specific, actionable recommendations based on the data",
+        "- Prioritize recommendations with highest potential impact",
+        "- Include expected outcomes for each recommendation",
+    ], re.compile(r'\b(recommend\w*|suggest\w*|improve\w*|increase|boost|grow|strateg\w*|advi[cs]e|should (we|i)|'
+                  r'focus|actions?)\b')),
+]
+
+FULL_REPORT_PATTERN = re.compile(
+    r'\b(report|overview|summar(y|ize|ise)|full analysis|complete analysis|analy[sz]e (the|this|my|our) '
+    r'(data|dataset|sales))\b'
+)
+
+
+def wants_full_report(question):
+    return bool(FULL_REPORT_PATTERN.search(question.lower()))
+
+
+def sections_for_question(question):
+    """The report sections a question calls for: all of them for a full report, else those its words match"""
+    if wants_full_report(question):
+        return list(REPORT_SECTIONS)
+    text = question.lower()
+    return [section for section in REPORT_SECTIONS if section.pattern.search(text)]
+
+
+def section_bullets(section, tools):
+    """A section's bullets, with those naming the analytics tools when the agent has them"""
+    return list(section.bullets) + (list(section.tool_bullets) if tools else [])
+
+
+def section_lines(section, tools):
+    return [f"{section.number}. {section.title}:"] + [f"   {bullet}" for bullet in section_bullets(section, tools)]
+
+
+def full_report_lines(tools):
+    """Instructions for a whole report: the executive summary, then every section"""
+    lines = ["When generating performance reports, always include these key sections:", "EXECUTIVE SUMMARY:"]
+    lines += SUMMARY_BULLETS
+    for section in REPORT_SECTIONS:
+        lines += section_lines(section, tools)
+    return lines
+
+
+def scope_question(question, tools):
+    """
+    The question with the report sections it calls for attached, for an agent with or
+    without the analytics tools
+
+    A question that matches no section is returned unchanged; the system instructions
+    already cover it.
+    """
+    if wants_full_report(question):
+        return f"{question}\n\n" + '\n'.join(full_report_lines(tools))
+    sections = sections_for_question(question)
+    if not sections:
+        return question
+    lines = ["Analyses to cover where the data allows:"]
+    for section in sections:
+        lines += section_lines(section, tools)
+    return f"{question}\n\n" + '\n'.join(lines)
+
+
+# Attached to questions answered in approximate mode (see app.data.sample)
+APPROXIMATE_LINES = [
+    "Answer approximately: sales_data holds a stratified sample of the sales data, not every row",
+    "- Estimate totals with sum(column * _sample_weight), row counts with sum(_sample_weight) and averages with sum(column * _sample_weight) / sum(_sample_weight); never scale results up yourself",
+    "- For numbers of customers, products or orders use the estimated_distinct counts of sales_data in the semantic model, not distinct counts over the sample",
+    "- Say that figures from the sample are estimates and round them accordingly",
+]
+
+# Added to APPROXIMATE_LINES for agents whose connection exposes the rollup tables
+APPROXIMATE_ROLLUP_LINES = [
+    "- The pre-aggregated sales_by_* tables are exact and fast; prefer them where they have the figures, "
+    "including numbers of customers, products or orders per period",
+]
+
+
+def approximate_question(question, rollups):
+    """A question (already scoped) with the instructions for answering it from the sample attached"""
+    return f"{question}\n\n" + '\n'.join(APPROXIMATE_LINES + (APPROXIMATE_ROLLUP_LINES if rollups else []))
@@ -0,0 +1,219 @@
+from app.data.kpi import kpi_sections_for_question
+from collections import Counter, namedtuple
+import math
+import re
+
+INTENTS = ('greeting', 'upload', 'kpi', 'analysis', 'web_search')
+
+Route = namedtuple('Route', ['intent', 'confidence', 'reason'])
+
+# Phrases matched on whole words only, so "hi" never fires on "this" or "shipping"
+INTENT_KEYWORDS = {
+    'greeting': ['hi', 'hello', 'hey', 'hiya', 'howdy', 'greetings', 'good morning', 'good afternoon',
+                 'good evening', 'thanks', 'thank you', 'who are you', 'what can you do'],
+    'upload': ['upload', 'uploaded', 'uploading', 'new file', 'csv file', 'new csv', 'new dataset'],
+    'web_search': ['search the web', 'web search', 'search online', 'online', 'internet', 'news',
+                   'industry trends', 'market trends', 'competitors', 'competitor', 'market research',
+                   'latest trends', 'consumer preferences'],
+}
+
+# Words that may accompany a greeting without turning it into a question about the data
+GREETING_FILLERS = {'there', 'again', 'you', 'how', 'are', 'is', 'it', 'going', 'doing', 'so', 'much',
+                    'very', 'ok', 'okay', 'cool', 'great', 'bot', 'assistant', 'team', 'all', 'morning',
+                    'afternoon', 'evening', 'good', 'who', 'what', 'can', 'do', 'a', 'lot'}
+
+# Labeled examples the classifier is trained on when the module is imported
+TRAINING_EXAMPLES = [
+    ('greeting', "hi"), ('greeting', "hello there"), ('greeting', "hey, how are you?"),
+    ('greeting', "good morning"), ('greeting', "thanks a lot"), ('greeting', "thank you so much"),
+    ('greeting', "who are you"), ('greeting', "what can you do"), ('greeting', "howdy"),
+    ('greeting', "hiya bot"),
+    ('analysis', "which products sold best during the holiday season"),
+    ('analysis', "show the monthly sales trend"), ('analysis', "why did sales drop in march"),
+    ('analysis', "compare sales between regions"), ('analysis', "forecast sales for the next three months"),
+    ('analysis', "what is the customer retention rate"), ('analysis', "give me a full performance report"),
+    ('analysis', "which customers buy the most"), ('analysis', "analyze the shipping costs"),
+    ('analysis', "how can we improve revenue"), ('analysis', "what are the slow moving products"),
+    ('analysis', "break down revenue by category"), ('analysis', "what day of the week has the most orders"),
+    ('analysis', "recommend a discount strategy"), ('analysis', "summarize this dataset"),
+    ('analysis', "which product is trending up"), ('analysis', "show me sales by region"),
+    ('analysis', "what were sales this month"), ('analysis', "how much did we sell last week"),
+    ('analysis', "list the orders above 100 dollars"), ('analysis', "average quantity per order"),
+    ('analysis', "total revenue for one product"), ('analysis', "total sales by store"),
+    ('analysis', "top products by profit"), ('analysis', "number of orders in the north region"),
+    ('web_search', "what are the latest industry trends for bakeries"),
+    ('web_search', "search the web for cake market forecasts"),
+    ('web_search', "what are competitors charging for cupcakes"),
+    ('web_search', "any news about consumer preferences for desserts"),
+    ('web_search', "look up current market trends online"),
+    ('web_search', "what is happening in the bakery industry this year"),
+]
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Weight of one keyword hit relative to the classifier's log-probabilities
+KEYWORD_WEIGHT = 2.0
+# Longer messages are questions even when they open with a greeting
+GREETING_MAX_TOKENS = 6
+# Below this confidence a message goes to the analyst, which can handle anything
+MIN_CONFIDENCE = 0.6
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def build_keyword_index(keywords):
+    """Index phrases by their first word: word -> [(intent, remaining words)]"""
+    index = {}
+    for intent, phrases in keywords.items():
+        for phrase in phrases:
+            words = tuple(tokenize(phrase))
+            index.setdefault(words[0], []).append((intent, words[1:]))
+    return index
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over word unigrams and bigrams with add-one smoothing"""
+
+    def __init__(self, examples):
+        self.labels = sorted({label for label, _ in examples})
+        counts = {label: Counter() for label in self.labels}
+        documents = Counter()
+        for label, text in examples:
+            counts[label].update(self.features(tokenize(text)))
+            documents[label] += 1
+        vocabulary = self.vocabulary = set().union(*counts.values())
+        self.priors = {label: math.log(documents[label] / len(examples)) for label in self.labels}
+        self.likelihoods = {}
+        self.unseen = {}
+        for label in self.labels:
+            total = sum(counts[label].values()) + len(vocabulary) + 1
+            self.likelihoods[label] = {feature: math.log((count + 1) / total)
+                                       for feature, count in counts[label].items()}
+            self.unseen[label] = math.log(1 / total)
+
+    @staticmethod
+    def features(tokens):
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def scores(self, tokens):
+        """Log-posterior (up to a constant) for every label; words never seen in training are ignored"""
+        features = [feature for feature in self.features(tokens) if feature in self.vocabulary]
+        return {
+            label: self.priors[label] + sum(self.likelihoods[label].get(feature, self.unseen[label])
+                                            for feature in features)
+            for label in self.labels
+        }
+
+
+def _softmax_top(scores):
+    best = max(scores, key=scores.get)
+    total = sum(math.exp(score - scores[best]) for score in scores.values())
+    return best, 1 / total
+
+
+class IntentRouter:
+    """
+    Decide how to answer a chat message without calling a model
+
+    Upload notices and plain metric questions are recognised by rule (the metric rules
+    are the KPI engine's own, so a 'kpi' route is one the engine can answer; a metric
+    question with a filter, grouping or period it can't answer is left to the classifier,
+    which sends it to the analyst). Everything else is scored by a naive Bayes
+    classifier, nudged by whole-word keyword hits.
+    """
+
+    def __init__(self, keywords=INTENT_KEYWORDS, examples=TRAINING_EXAMPLES):
+        self.index = build_keyword_index(keywords)
+        self.greeting_words = GREETING_FILLERS | {word for phrase in keywords['greeting'] for word in tokenize(phrase)}
+        self.classifier = NaiveBayes(examples)
+
+    def keyword_hits(self, tokens):
+        hits = Counter()
+        for i, token in enumerate(tokens):
+            for intent, rest in self.index.get(token, ()):
+                if tuple(tokens[i + 1:i + 1 + len(rest)]) == rest:
+                    hits[intent] += 1
+        return hits
+
+    def route(self, message):
+        """Return the Route (intent, confidence, reason) for a message"""
+        tokens = tokenize(message)
+        if not tokens:
+            return Route('greeting', 1.0, 'empty')
+
+        hits = self.keyword_hits(tokens)
+        if hits['upload']:
+            return Route('upload', 1.0, 'keyword')
+        if hits['greeting'] and len(tokens) <= GREETING_MAX_TOKENS and all(
+                token in self.greeting_words for token in tokens):
+            return Route('greeting', 1.0, 'keyword')
+        if not hits['web_search'] and kpi_sections_for_question(message):
+            return Route('kpi', 1.0, 'kpi rule')
+
+        scores = self.classifier.scores(tokens)
+        for intent, count in hits.items():
+            if intent in scores:
+                scores[intent] += KEYWORD_WEIGHT * count
+        # Small talk needs a greeting word; anything else about the data is analysis
+        if not hits['greeting'] or len(tokens) > GREETING_MAX_TOKENS:
+            scores.pop('greeting', None)
+        intent, confidence = _softmax_top(scores)
+        if intent != 'analysis' and confidence < MIN_CONFIDENCE:
+            return Route('analysis', confidence, 'fallback')
+        return Route(intent, confidence, 'classifier')
+
+
+router = IntentRouter()
+
+
+def route_message(message):
+    """Route a chat message with the shared router"""
+    return router.route(message)
+
+
+GREETING_REPLY = (
+    "Hello! I'm SalesAnalyst, your sales analytics assistant. Ask me about your sales data - "
+    "for example total revenue, top or bottom products, monthly trends, customer insights, "
+    "or a full performance report."
+)
+
+UPLOAD_REPLY = (
+    "Welcome! For best results with the sales analysis, your CSV file should include these fields:\n\n"
+    "**Required Fields:**\n"
+    "- **Order/Transaction ID**: Unique identifier for each transaction\n"
+    "- **Product Name or ID**: What was sold\n"
+    "- **Date/Timestamp**: When the sale occurred\n"
+    "- **Quantity**: Number of units sold\n"
+    "- **Unit Price**: Price per unit\n"
+    "- **Total Amount**: Total sale value\n\n"
+    "**Recommended Additional Fields:**\n"
+    "- **Customer ID/Name**: Who purchased (for customer analytics)\n"
+    "- **Region/Location**: Where the sale occurred\n"
+    "- **Category/Department**: Product grouping\n"
+    "- **Cost**: Unit cost (for profit analysis)\n"
+    "- **Discount**: Any applied discounts\n\n"
+    "Don't worry if your file doesn't have all these fields - I'll work with what you have!"
+)
+
+NO_DATA_REPLY = (
+    "I'm sorry, I don't have access to any data files at the moment. Please upload a CSV file first. "
+    "For best analysis results, your CSV should include fields like order ID, product name, order date, "
+    "quantity, price, and total amount."
+)
+
+CANNED_REPLIES = {
+    'greeting': GREETING_REPLY,
+    'upload': UPLOAD_REPLY,
+}
+
+
+def canned_reply(intent):
+    """Fixed reply for intents that need neither data nor a model, or None"""
+    return CANNED_REPLIES.get(intent)
+
+
+def needs_dataset(intent):
+    """Whether answering an intent requires loading the sales data"""
+    return intent in ('kpi', 'analysis')
@@ -0,0 +1,83 @@
+"""
+Analyses the data analyst agent can call as tools instead of working them out in SQL
+
+Imports phi, so only import this module where an agent is being built.
+"""
+from phi.tools import Toolkit
+from app.data.forecast import FORECAST_MAX_HORIZON, GRAINS, get_forecasts, find_series, describe_forecast
+from app.data.customers import get_customer_analytics, find_customer, describe_customer, describe_customers
+from app.telemetry import span, count
+import functools
+import json
+
+
+class SalesAnalyticsTools(Toolkit):
+    """Tools over one materialized dataset; every call is timed and counted like a DuckDB tool call"""
+
+    def __init__(self, table_path):
+        super().__init__(name="sales_analytics_tools")
+        self.table_path = table_path
+        self.register(self.forecast_sales)
+        self.register(self.customer_insights)
+
+    def register(self, function, sanitize_arguments=True):
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            count('tool_calls')
+            with span('tool'):
+                return function(*args, **kwargs)
+
+        super().register(traced, sanitize_arguments=sanitize_arguments)
+
+    def forecast_sales(self, product: str = "", horizon: int = 3, grain: str = "month", measure: str = "revenue") -> str:
+        """Forecast sales for the whole business or one product, with confidence intervals.
+        Seasonal naive, Holt-Winters and linear trend models are backtested on recent history and the
+        most accurate one is used. Use this for any forecast or projection instead of extrapolating yourself.
+
+        Args:
+            product (str): Product to forecast; leave empty for total sales across all products.
+            horizon (int): Number of future periods to forecast (1-36).
+            grain (str): 'month' or 'day'.
+            measure (str): 'revenue' or 'quantity'.
+
+        Returns:
+            str: JSON with the chosen model, backtest errors per model and, per future period, the
+            forecast value with the lower and upper bounds of its 95% confidence interval.
+        """
+        if grain not in GRAINS:
+            return f"Error: grain must be one of {', '.join(GRAINS)}"
+        if measure not in ('revenue', 'quantity'):
+            return "Error: measure must be 'revenue' or 'quantity'"
+        horizon = min(max(int(horizon), 1), FORECAST_MAX_HORIZON)
+        forecasts = get_forecasts(self.table_path, grain, measure)
+        if forecasts is None:
+            return f"Error: the dataset has no dates or no {measure} column to forecast from"
+        index = find_series(forecasts, product)
+        if index is None:
+            known = ', '.join(forecasts['names'][1:11])
+            return f"Error: no product matching {product!r} among the forecast products (e.g. {known})"
+        return json.dumps(describe_forecast(forecasts, index, horizon))
+
+    def customer_insights(self, customer: str = "", top: int = 5) -> str:
+        """Customer analytics computed from the whole dataset: customer count, repeat customer rate, purchase
+        frequency, average order value, monthly retention, customer lifetime value (CLV), RFM segments, the top
+        customers by revenue and retention by first-purchase cohort. Use this for any question about customers,
+        retention, loyalty or CLV instead of writing queries.
+
+        Args:
+            customer (str): A customer to look up (their orders, revenue, recency, RFM score and segment);
+                leave empty for the overview.
+            top (int): Number of top customers by revenue to list (1-50).
+
+        Returns:
+            str: JSON with the metrics and the definitions used to compute them.
+        """
+        analytics = get_customer_analytics(self.table_path)
+        if analytics is None:
+            return "Error: the dataset has no customer, date or revenue column to analyse customers from"
+        if customer:
+            index = find_customer(analytics, customer)
+            if index is None:
+                return f"Error: no customer matching {customer!r}"
+            return json.dumps(describe_customer(analytics, index))
+        return json.dumps(describe_customers(analytics, min(max(int(top), 1), 50)))
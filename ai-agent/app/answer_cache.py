@@ -0,0 +1,180 @@
+from collections import OrderedDict
+from app.data.ingest import DATA_DIR, add_change_listener
+import threading
+import hashlib
+import logging
+import sqlite3
+import time
+import os
+import re
+
+ANSWER_CACHE_MEMORY_ITEMS = int(os.environ.get('ANSWER_CACHE_MEMORY_ITEMS', '512'))
+ANSWER_CACHE_DISK_ITEMS = int(os.environ.get('ANSWER_CACHE_DISK_ITEMS', '20000'))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get('ANSWER_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+ANSWER_CACHE_PATH = os.environ.get('ANSWER_CACHE_PATH', os.path.join(DATA_DIR, 'answers.sqlite3'))
+
+logger = logging.getLogger("AnswerCache")
+
+
+def normalize_question(question):
+    """Lower-case, collapse whitespace and drop trailing punctuation so trivial variations share an entry"""
+    text = re.sub(r'\s+', ' ', question.strip().lower())
+    return re.sub(r'[\s?!.]+$', '', text)
+
+
+def answer_key(content_hash, question, prompt_version):
+    """Cache key for a question asked against a particular version of a dataset and of the prompts"""
+    raw = f"{content_hash}\x1f{normalize_question(question)}\x1f{prompt_version}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """
+    Two-tier cache of finished answers
+
+    An in-memory LRU sits in front of a SQLite table that survives restarts. Entries
+    expire after a TTL, both tiers are capped by item count, and every entry records
+    the dataset it was computed from so a changed file can be invalidated at once.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, memory_items=ANSWER_CACHE_MEMORY_ITEMS,
+                 disk_items=ANSWER_CACHE_DISK_ITEMS, ttl_seconds=ANSWER_CACHE_TTL_SECONDS):
+        self.path = path
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # key -> (dataset_key, content_hash, answer, stored_at)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._initialized = False
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        con = getattr(self._local, 'connection', None)
+        if con is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            con = sqlite3.connect(self.path, timeout=10)
+            con.execute("PRAGMA journal_mode=WAL")
+            if not self._initialized:
+                con.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS answers (
+                        key TEXT PRIMARY KEY,
+                        dataset_key TEXT NOT NULL,
+                        content_hash TEXT NOT NULL,
+                        answer TEXT NOT NULL,
+                        stored_at REAL NOT NULL,
+                        used_at REAL NOT NULL
+                    )
+                    """
+                )
+                con.execute("CREATE INDEX IF NOT EXISTS answers_dataset ON answers (dataset_key)")
+                con.execute("CREATE INDEX IF NOT EXISTS answers_used ON answers (used_at)")
+                con.commit()
+                self._initialized = True
+            self._local.connection = con
+        return con
+
+    def get(self, key):
+        """Return the cached answer for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[3] < self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[2]
+            if entry:
+                del self._memory[key]
+
+        try:
+            con = self._connection()
+            row = con.execute(
+                "SELECT dataset_key, content_hash, answer, stored_at FROM answers WHERE key = ? AND stored_at > ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row:
+                con.execute("UPDATE answers SET used_at = ? WHERE key = ?", (now, key))
+                con.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Answer cache read failed: {e}")
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row)
+        return row[2]
+
+    def put(self, key, dataset_key, content_hash, answer):
+        """Store an answer in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, (dataset_key, content_hash, answer, now))
+        try:
+            con = self._connection()
+            con.execute(
+                "INSERT OR REPLACE INTO answers (key, dataset_key, content_hash, answer, stored_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, dataset_key, content_hash, answer, now, now),
+            )
+            self._evict_disk(con, now)
+            con.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Answer cache write failed: {e}")
+
+    def invalidate_dataset(self, dataset_key, keep_hash=None):
+        """
+        Drop every answer computed from a dataset
+
+        keep_hash spares answers computed from that version of the file, so when the
+        content behind a file ID changes only the stale answers go.
+        """
+        with self._lock:
+            for key in [key for key, entry in self._memory.items()
+                        if entry[0] == dataset_key and entry[1] != keep_hash]:
+                del self._memory[key]
+        try:
+            con = self._connection()
+            con.execute(
+                "DELETE FROM answers WHERE dataset_key = ? AND content_hash != ?",
+                (dataset_key, keep_hash or ''),
+            )
+            con.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Answer cache invalidation failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_items": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, con, now):
+        con.execute("DELETE FROM answers WHERE stored_at <= ?", (now - self.ttl_seconds,))
+        count = con.execute("SELECT count(*) FROM answers").fetchone()[0]
+        if count > self.disk_items:
+            con.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY used_at LIMIT ?)",
+                (count - self.disk_items,),
+            )
+
+
+answer_cache = AnswerCache()
+# Forget answers about a file as soon as its content changes
+add_change_listener(
+    lambda dataset, previous_path: answer_cache.invalidate_dataset(dataset['key'], dataset['content_hash'])
+)
@@ -1,69 +1,318 @@
+"""
+File URLs from the backend
+
+Lookups share one keep-alive connection pool with strict timeouts: a requests Session
+for code on worker threads, an httpx client for the event loop (the a* functions).
+Results go into a TTL cache, so a file ID that was resolved once is resolved again
+without a request, and IDs the backend doesn't know are remembered for a shorter
+time. The newest upload and a browser's file list change whenever someone uploads,
+so those are only cached briefly.
+"""
+from collections import OrderedDict
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app.telemetry import timed, span
+import threading
 import requests
+import asyncio
 import logging
+import time
 import os
 
 BACKEND_URL = os.environ.get('BACKEND_URL', 'http://localhost:5000')
+# Seconds to connect to the backend and to wait for its answer
+URL_CONNECT_TIMEOUT = float(os.environ.get('URL_CONNECT_TIMEOUT', '2'))
+URL_READ_TIMEOUT = float(os.environ.get('URL_READ_TIMEOUT', '5'))
+# Keep-alive connections to the backend per client
+URL_POOL_SIZE = int(os.environ.get('URL_POOL_SIZE', '16'))
+# How long a file's URL, a missing file, and the latest file / a browser's files are cached
+URL_CACHE_TTL_SECONDS = float(os.environ.get('URL_CACHE_TTL_SECONDS', '3600'))
+URL_NEGATIVE_TTL_SECONDS = float(os.environ.get('URL_NEGATIVE_TTL_SECONDS', '30'))
+URL_LIST_TTL_SECONDS = float(os.environ.get('URL_LIST_TTL_SECONDS', '5'))
+URL_CACHE_MAX_ITEMS = int(os.environ.get('URL_CACHE_MAX_ITEMS', '10000'))
 
 logger = logging.getLogger("CakeBuddy")
 
-def fetch_urls():
-    """Fetch all file URLs from backend API and return them"""
+LATEST = ('latest',)
+
+
+class UrlCache:
+    """TTL cache of backend lookups, oldest entries dropped first beyond max_items; None is cached too"""
+
+    def __init__(self, max_items=URL_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """(True, value) for a live entry, else (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, ttl_seconds):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.monotonic() + ttl_seconds)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'items': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+url_cache = UrlCache()
+
+_session = None
+_session_lock = threading.Lock()
+_async_client = None  # (event loop, httpx.AsyncClient)
+
+
+def get_session():
+    """The pooled requests Session, created on first use so forked workers don't share its sockets"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # Retry only failed connection attempts; a request that reached the backend isn't repeated
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=URL_POOL_SIZE,
+                                  max_retries=Retry(total=1, connect=1, read=0, status=0, backoff_factor=0.1))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def get_async_client():
+    """The pooled httpx client of the running event loop; one made on another loop is closed"""
+    global _async_client
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client[0] is not loop:
+        if _async_client is not None:
+            _discard_async_client(*_async_client)
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(URL_READ_TIMEOUT, connect=URL_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=URL_POOL_SIZE, max_keepalive_connections=URL_POOL_SIZE),
+            transport=httpx.AsyncHTTPTransport(retries=1),
+        )
+        _async_client = (loop, client)
+    return _async_client[1]
+
+
+def _discard_async_client(loop, client):
+    """
+    Close a client made on another event loop. Its connections belong to that loop, so
+    they are closed there while it is open; once it is closed they are dead already.
+    """
+    if loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+    except RuntimeError:
+        # The loop closed in the meantime
+        pass
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        client = _async_client[1]
+        _async_client = None
+        await client.aclose()
+
+
+def _json(response):
     try:
-        response = requests.get(f'{BACKEND_URL}/api/urls')
-        
-        if response.status_code == 200:
-            data = response.json()
-            urls = data.get('urls', [])
-            return urls
-        else:
-            logger.error(f"Error: Received status code {response.status_code}")
-            logger.error(response.text)
-            return []
-            
-    except Exception as e:
-        logger.error(f"Error fetching URLs: {e}")
+        return response.json()
+    except ValueError:
+        return None
+
+
+def _get(path):
+    """GET a backend path: (status code, JSON body or None), or (None, None) when the backend can't be reached"""
+    try:
+        response = get_session().get(f'{BACKEND_URL}{path}', timeout=(URL_CONNECT_TIMEOUT, URL_READ_TIMEOUT))
+    except requests.RequestException as e:
+        logger.error(f"Error fetching {path}: {e}")
+        return None, None
+    if response.status_code != 200:
+        logger.error(f"Error: Received status code {response.status_code} when fetching {path}: {response.text[:200]}")
+    return response.status_code, _json(response)
+
+
+async def _aget(path):
+    """Async counterpart of _get"""
+    import httpx
+
+    try:
+        response = await get_async_client().get(f'{BACKEND_URL}{path}')
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching {path}: {e!r}")
+        return None, None
+    if response.status_code != 200:
+        logger.error(f"Error: Received status code {response.status_code} when fetching {path}: {response.text[:200]}")
+    return response.status_code, _json(response)
+
+
+# Paths and result handling shared by the sync and async lookups
+
+def _file_path(file_id):
+    return f'/api/url/{quote(str(file_id), safe="")}'
+
+
+def _file_url(file_id, status, data):
+    """Cache the outcome of a file URL lookup; only a 404 is cached as not found, errors aren't cached"""
+    url = (data or {}).get('url') if status == 200 else None
+    if url:
+        logger.info(f"Found URL for file ID {file_id}: {url}")
+        url_cache.put(('file', file_id), url, URL_CACHE_TTL_SECONDS)
+    elif status == 404:
+        url_cache.put(('file', file_id), None, URL_NEGATIVE_TTL_SECONDS)
+    return url
+
+
+def _latest_url(status, data):
+    """
+    Cache the newest upload's URL from /api/url/latest; a 404 (nothing uploaded) is
+    cached as None, errors aren't cached
+    """
+    if status == 200 and data and data.get('url'):
+        if data.get('id'):
+            url_cache.put(('file', data['id']), data['url'], URL_CACHE_TTL_SECONDS)
+        url_cache.put(LATEST, data['url'], URL_LIST_TTL_SECONDS)
+        return data['url']
+    if status == 404:
+        url_cache.put(LATEST, None, URL_LIST_TTL_SECONDS)
+    return None
+
+
+def _browser_files(browser_id, status, data):
+    if status != 200:
         return []
+    files = [(file['_id'], file['file_url']) for file in (data or {}).get('files', []) if file.get('file_url')]
+    for file_id, url in files:
+        url_cache.put(('file', file_id), url, URL_CACHE_TTL_SECONDS)
+    url_cache.put(('browser', browser_id), files, URL_LIST_TTL_SECONDS)
+    return files
+
+
+def fetch_urls():
+    """Fetch all file URLs from backend API and return them"""
+    status, data = _get('/api/urls')
+    return (data or {}).get('urls', []) if status == 200 else []
+
 
 def get_file_url_by_id(file_id):
     """Get a specific file URL by its ID"""
-    try:
-        response = requests.get(f'http://localhost:5000/api/url/{file_id}')
-        
-        if response.status_code == 200:
-            data = response.json()
-            url = data.get('url')
-            logger.info(f"Found URL for file ID {file_id}: {url}")
-            return url
-        else:
-            logger.error(f"Error: Received status code {response.status_code} when fetching file ID {file_id}")
-            logger.error(response.text)
-            return None
-            
-    except Exception as e:
-        logger.error(f"Error fetching URL for file ID {file_id}: {e}")
-        return None
+    found, url = url_cache.get(('file', file_id))
+    if found:
+        return url
+    return _file_url(file_id, *_get(_file_path(file_id)))
+
+
+def get_latest_file_url():
+    """Get the URL of the most recently uploaded file"""
+    found, url = url_cache.get(LATEST)
+    if found:
+        return url
+    return _latest_url(*_get('/api/url/latest'))
 
-# Default function that gets the first URL (for backward compatibility)
+
+@timed('resolve_url')
+def get_browser_files(browser_id):
+    """Get (file ID, URL) pairs for every file uploaded from a browser, newest first"""
+    found, files = url_cache.get(('browser', browser_id))
+    if found:
+        return files
+    return _browser_files(browser_id, *_get(f'/api/files/browser/{quote(str(browser_id), safe="")}'))
+
+
+@timed('resolve_url')
+def get_file_urls(file_ids):
+    """Get (file ID, URL) pairs for a list of file IDs, skipping IDs that can't be resolved"""
+    files = []
+    for file_id in dict.fromkeys(file_ids):
+        url = get_file_url_by_id(file_id)
+        if url:
+            files.append((file_id, url))
+    return files
+
+
+@timed('resolve_url')
 def get_csv_url(file_id=None):
     """
     Get a CSV file URL:
     - If file_id is provided, get that specific file URL
-    - Otherwise, get the first URL from the list
+    - Otherwise, or if that file doesn't exist, the most recently uploaded file's URL
     """
     if file_id:
         url = get_file_url_by_id(file_id)
         if url:
             return url
-        # Fall back to first URL if file_id doesn't exist
-        logger.warning(f"File ID {file_id} not found, falling back to first available URL")
-    
-    urls = fetch_urls()
-    if urls and len(urls) > 0:
-        return urls[0]
-    return None
+        logger.warning(f"File ID {file_id} not found, falling back to the latest file")
+    return get_latest_file_url()
+
+
+async def aget_file_url_by_id(file_id):
+    found, url = url_cache.get(('file', file_id))
+    if found:
+        return url
+    return _file_url(file_id, *await _aget(_file_path(file_id)))
+
+
+async def aget_latest_file_url():
+    found, url = url_cache.get(LATEST)
+    if found:
+        return url
+    return _latest_url(*await _aget('/api/url/latest'))
+
+
+async def aget_browser_files(browser_id):
+    """Async counterpart of get_browser_files"""
+    with span('resolve_url'):
+        found, files = url_cache.get(('browser', browser_id))
+        if found:
+            return files
+        return _browser_files(browser_id, *await _aget(f'/api/files/browser/{quote(str(browser_id), safe="")}'))
+
+
+async def aget_file_urls(file_ids):
+    """Async counterpart of get_file_urls; the IDs that aren't cached are looked up concurrently"""
+    with span('resolve_url'):
+        file_ids = list(dict.fromkeys(file_ids))
+        urls = await asyncio.gather(*(aget_file_url_by_id(file_id) for file_id in file_ids))
+        return [(file_id, url) for file_id, url in zip(file_ids, urls) if url]
+
+
+async def aget_csv_url(file_id=None):
+    """Async counterpart of get_csv_url"""
+    with span('resolve_url'):
+        if file_id:
+            url = await aget_file_url_by_id(file_id)
+            if url:
+                return url
+            logger.warning(f"File ID {file_id} not found, falling back to the latest file")
+        return await aget_latest_file_url()
+
 
 if __name__ == "__main__":
     # Example of accessing the URL as a variable
     csv_url = get_csv_url()
     if csv_url:
-        print(f"{csv_url}")
\ No newline at end of file
+        print(f"{csv_url}")
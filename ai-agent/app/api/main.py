@@ -1,7 +1,14 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.get_csv_url import get_csv_url
+from fastapi.responses import StreamingResponse, Response
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+from app.api.get_csv_url import (get_csv_url, get_file_urls, get_browser_files, aget_csv_url, aget_file_urls,
+                                 aget_browser_files, close_async_client, url_cache)
 from pydantic import BaseModel
+import threading
+import asyncio
+import time
+import json
 import os
 import sys
 import logging
@@ -11,7 +18,16 @@ parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 
 # Import the AI agent functions
-from app.main import handle_user_input, remove_sql_queries
+from app.main import handle_user_input, stream_user_input, remove_sql_queries, resolve_dataset, resolve_file_set, answer_analysis
+from app.chart_data import collect_sales_chart_data
+from app.data.collection import FileSet, file_set_key
+from app.api.workers import agent_workers, WorkerPoolFull
+from app.agent.pool import agent_pool
+from app.agent.router import route_message, needs_dataset, Route, NO_DATA_REPLY
+from app.answer_cache import answer_cache
+from app.data.query_cache import query_cache
+from app.reports import report_jobs
+from app.telemetry import start_trace, finish_trace, current_trace
 
 app = FastAPI(title="CakeBuddy API", description="API for the Cake Shop Analytics AI Assistant")
 
@@ -28,13 +44,77 @@ app.add_middleware(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Questions of one /chat/batch request answered at the same time, and the most one request may ask
+CHAT_BATCH_PARALLELISM = int(os.environ.get('CHAT_BATCH_PARALLELISM', '4'))
+CHAT_BATCH_MAX_QUESTIONS = int(os.environ.get('CHAT_BATCH_MAX_QUESTIONS', '50'))
+# How often a report's event stream checks the job for progress
+REPORT_EVENTS_POLL_SECONDS = float(os.environ.get('REPORT_EVENTS_POLL_SECONDS', '0.5'))
+
+# Endpoints whose requests are traced stage by stage (see app.telemetry)
+TRACED_PATHS = {"/chat", "/chat/stream", "/chat/batch", "/chart"}
+
+@app.middleware("http")
+async def trace_requests(request, call_next):
+    """Trace each chat/chart request and report its stage timings in a Server-Timing header"""
+    if request.url.path not in TRACED_PATHS:
+        return await call_next(request)
+    
+    trace = start_trace(request.url.path)
+    try:
+        response = await call_next(request)
+    except Exception:
+        finish_trace(trace, 500)
+        raise
+    response.headers["Server-Timing"] = trace.server_timing()
+    
+    # Streamed bodies are still being produced here, so finish the trace once the body is sent
+    body = response.body_iterator
+    async def body_then_finish():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finish_trace(trace, response.status_code)
+    response.body_iterator = body_then_finish()
+    return response
+
 class ChatRequest(BaseModel):
     message: str
     csvFilename: str = None
     fileId: str = None
+    # Analyse several uploads as one table: these file IDs, or every file uploaded from a browser
+    fileIds: list[str] = None
+    browserId: str = None
+    # Answer from a stratified sample of a very large dataset, stating the margin of error
+    approximate: bool = False
 
 class ChatResponse(BaseModel):
     response: str
+
+class BatchChatRequest(BaseModel):
+    questions: list[str]
+    fileId: str = None
+    fileIds: list[str] = None
+    browserId: str = None
+
+class BatchAnswer(BaseModel):
+    question: str
+    status: str  # "ok" or "error"
+    response: str = None
+    error: str = None
+    ms: float
+
+class BatchChatResponse(BaseModel):
+    results: list[BatchAnswer]
+    dataset_ms: float
+    total_ms: float
+
+class ReportRequest(BaseModel):
+    fileId: str = None
+    fileIds: list[str] = None
+    browserId: str = None
+    # Regenerate instead of serving a stored report of the same data
+    refresh: bool = False
     
 
 @app.get("/")
@@ -43,48 +123,141 @@ async def root():
         "message": "Sales Analyst API is running",
         "docs": "/docs",
         "health": "/health",
-        "endpoints": ["/chat"]
+        "endpoints": ["/chat", "/chat/stream", "/chat/batch", "/reports", "/chart", "/metrics"]
     }
 
 
+def busy_error(e):
+    """503 with Retry-After for a request the worker pool could not admit"""
+    return HTTPException(
+        status_code=503,
+        detail="The analyst is busy with other requests, please try again shortly.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+def resolve_chat_csv_url(request, route):
+    """Return the CSV URL to answer a chat request from, or None when no data is needed"""
+    # Greetings, file notifications and web searches don't need the file ID or CSV URL
+    if not needs_dataset(route.intent):
+        logger.info(f"Routed as {route.intent}, bypassing CSV loading")
+        return None
+    
+    if request.fileId:
+        logger.info(f"Using file ID: {request.fileId}")
+        csv_url = get_csv_url(request.fileId)
+    else:
+        logger.info("No file ID provided, using default CSV file")
+        csv_url = get_csv_url()
+        
+    logger.info(f"Using CSV URL: {csv_url}")
+    return csv_url
+
+def chat_file_set(request, files):
+    """The FileSet for the (file ID, URL) pairs a request's fileIds or browserId resolved to, or None if there are none"""
+    if not files:
+        logger.warning("None of the requested files were found, using a single CSV file")
+        return None
+    if request.fileIds:
+        key = file_set_key(file_ids=[file_id for file_id, _ in files])
+    else:
+        key = file_set_key(browser_id=request.browserId)
+    logger.info(f"Analysing {len(files)} files together as {key}")
+    return FileSet(key, files)
+
+def resolve_chat_file_set(request, route):
+    """Return the set of files a chat request asks to analyse together, or None to use a single CSV"""
+    if not needs_dataset(route.intent) or not (request.fileIds or request.browserId):
+        return None
+    files = get_file_urls(request.fileIds) if request.fileIds else get_browser_files(request.browserId)
+    return chat_file_set(request, files)
+
+async def resolve_chat_files(request, route):
+    """
+    Return (file set, CSV URL) for a chat request, like resolve_chat_file_set and
+    resolve_chat_csv_url but on the event loop, so no worker thread waits on the backend
+    """
+    if not needs_dataset(route.intent):
+        logger.info(f"Routed as {route.intent}, bypassing CSV loading")
+        return None, None
+    if request.fileIds or request.browserId:
+        files = await (aget_file_urls(request.fileIds) if request.fileIds else aget_browser_files(request.browserId))
+        file_set = chat_file_set(request, files)
+        if file_set:
+            return file_set, None
+    csv_url = await aget_csv_url(request.fileId)
+    logger.info(f"Using CSV URL: {csv_url}")
+    return None, csv_url
+
+def answer_chat(request, route, file_set, csv_url):
+    """Run the agent for a chat request on its resolved files (blocking, runs on a worker thread)"""
+    # Process the message using the AI agent
+    response_text = handle_user_input(request.message, csv_url, request.fileId if csv_url else None, route, file_set,
+                                      request.approximate)
+    
+    # Always clean up the response
+    return remove_sql_queries(response_text)
+
+def stream_chat(request, route, file_set, csv_url, emit, cancelled):
+    """Run the streaming agent for a chat request, passing each piece of text to emit (runs on a worker thread)"""
+    chunks = stream_user_input(request.message, csv_url, request.fileId if csv_url else None, route, file_set,
+                               request.approximate)
+    try:
+        for text in chunks:
+            if cancelled.is_set():
+                break
+            emit(text)
+    finally:
+        chunks.close()
+
+def load_batch_dataset(request, routes):
+    """
+    Resolve and materialize the dataset a batch's questions share (blocking, runs on a worker thread)
+
+    Returns (csv_url, dataset); both are None when no question needs data, and dataset is
+    None when the CSV could only be read remotely.
+    """
+    route = next((route for route in routes if needs_dataset(route.intent)), None)
+    if route is None:
+        return None, None
+    file_set = resolve_chat_file_set(request, route)
+    if file_set:
+        return None, resolve_file_set(file_set)
+    csv_url = resolve_chat_csv_url(request, route)
+    return csv_url, resolve_dataset(csv_url, request.fileId) if csv_url else None
+
+def answer_batch_question(question, route, csv_url, dataset, file_id):
+    """Answer one question of a batch from the shared dataset; errors propagate (runs on a worker thread)"""
+    if not needs_dataset(route.intent):
+        return handle_user_input(question, route=route)
+    if dataset is None and not csv_url:
+        return NO_DATA_REPLY
+    return remove_sql_queries(answer_analysis(question, csv_url, file_id, dataset=dataset))
+
+def load_report_dataset(request):
+    """Resolve and materialize the dataset a report is about (runs on the report job's thread)"""
+    _, dataset = load_batch_dataset(request, [Route("analysis", 1.0, "report")])
+    return dataset
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     try:
         logger.info(f"Received chat request: {request.message}")
         
-        # Check if it's a simple greeting first to avoid loading CSV
-        greeting_phrases = ["hi", "hello", "hey", "greetings", "good morning", "good afternoon", "howdy"]
-        message_lower = request.message.lower()
-        is_greeting = any(phrase in message_lower for phrase in greeting_phrases)
-        is_short = len(request.message.strip().split()) < 3
-        
-        # Check if it's a new file notification
-        is_new_file = "upload" in message_lower or "new file" in message_lower or "uploaded" in message_lower
-        
-        # For greetings or file notifications, don't even bother with the file ID and CSV URL
-        if (is_greeting and is_short) or is_new_file:
-            logger.info("Detected simple greeting or file upload notification, bypassing CSV loading")
-            response_text = handle_user_input(request.message, None)
-        else:
-            # Only load the CSV URL if this is not a simple greeting
-            if request.fileId:
-                logger.info(f"Using file ID: {request.fileId}")
-                csv_url = get_csv_url(request.fileId)
-            else:
-                logger.info("No file ID provided, using default CSV file")
-                csv_url = get_csv_url()
-                
-            logger.info(f"Using CSV URL: {csv_url}")
-            
-            # Process the message using the AI agent
-            response_text = handle_user_input(request.message, csv_url)
-        
-        # Always clean up the response
-        response_text = remove_sql_queries(response_text)
+        route = route_message(request.message)
+        file_set, csv_url = await resolve_chat_files(request, route)
+        # Agent work is blocking, so run it on the worker pool to keep the event loop responsive
+        response_text = await agent_workers.run(answer_chat, request, route, file_set, csv_url)
         
         logger.info(f"Generated response: {response_text[:100]}...")
         
         return ChatResponse(response=response_text)
+    except WorkerPoolFull as e:
+        logger.warning(f"Rejecting chat request: {str(e)}")
+        raise busy_error(e)
     except Exception as e:
         logger.error(f"Error processing chat: {str(e)}")
         raise HTTPException(
@@ -92,6 +265,191 @@ async def chat(request: ChatRequest):
             detail=f"Error processing your request: {str(e)}"
         )
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    logger.info(f"Received streaming chat request: {request.message}")
+    
+    trace = current_trace()
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+    
+    def emit(text):
+        loop.call_soon_threadsafe(queue.put_nowait, text)
+    
+    # Nothing has been streamed yet, so failures up to here are HTTP errors like /chat's
+    try:
+        route = route_message(request.message)
+        file_set, csv_url = await resolve_chat_files(request, route)
+        job = agent_workers.submit(stream_chat, request, route, file_set, csv_url, emit, cancelled)
+    except WorkerPoolFull as e:
+        logger.warning(f"Rejecting streaming chat request: {str(e)}")
+        raise busy_error(e)
+    except Exception as e:
+        logger.error(f"Error processing streaming chat: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing your request: {str(e)}"
+        )
+    # Wake the event stream once the job is done, however it ended
+    job.add_done_callback(lambda _: queue.put_nowait(None))
+    
+    async def events():
+        try:
+            while True:
+                text = await queue.get()
+                if text is None:
+                    break
+                yield sse_event("token", {"text": text})
+            # Surface any error raised by the job itself
+            await job
+            # Headers went out before the work started, so the timings travel with the last event
+            yield sse_event("done", {"timing": trace.summary()} if trace else {})
+        except Exception as e:
+            logger.error(f"Error streaming chat: {str(e)}")
+            yield sse_event("error", {"detail": f"Error processing your request: {str(e)}"})
+        finally:
+            # Stop the agent if the client disconnected
+            cancelled.set()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(request: BatchChatRequest):
+    """Answer several questions about one dataset, loading it once; a failed question doesn't fail the rest"""
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions were given")
+    if len(request.questions) > CHAT_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"A batch can ask at most {CHAT_BATCH_MAX_QUESTIONS} questions")
+    logger.info(f"Received batch of {len(request.questions)} questions")
+    
+    started = time.perf_counter()
+    routes = [route_message(question) for question in request.questions]
+    try:
+        csv_url, dataset = await agent_workers.run(load_batch_dataset, request, routes)
+    except WorkerPoolFull as e:
+        logger.warning(f"Rejecting chat batch: {str(e)}")
+        raise busy_error(e)
+    except Exception as e:
+        logger.error(f"Error loading the dataset for a chat batch: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing your request: {str(e)}"
+        )
+    dataset_ms = (time.perf_counter() - started) * 1000
+    file_id = request.fileId if csv_url else None
+    
+    # Each question is its own pool job, at most CHAT_BATCH_PARALLELISM of them at a time
+    semaphore = asyncio.Semaphore(CHAT_BATCH_PARALLELISM)
+    async def answer(question, route):
+        async with semaphore:
+            question_started = time.perf_counter()
+            try:
+                response_text = await agent_workers.run(answer_batch_question, question, route, csv_url, dataset, file_id)
+                result = {"status": "ok", "response": response_text}
+            except WorkerPoolFull as e:
+                result = {"status": "error", "error": f"The analyst was busy, retry after {e.retry_after} seconds"}
+            except Exception as e:
+                logger.error(f"Error answering batch question '{question}': {str(e)}")
+                result = {"status": "error", "error": f"Error processing this question: {str(e)}"}
+            return BatchAnswer(question=question, ms=(time.perf_counter() - question_started) * 1000, **result)
+    
+    results = await asyncio.gather(*(answer(question, route) for question, route in zip(request.questions, routes)))
+    return BatchChatResponse(results=results, dataset_ms=dataset_ms, total_ms=(time.perf_counter() - started) * 1000)
+
+@app.post("/reports", status_code=202)
+async def submit_report(request: ReportRequest):
+    """Start generating a full performance report; poll /reports/{job_id} or follow /reports/{job_id}/events"""
+    try:
+        job_id = report_jobs.submit(lambda: load_report_dataset(request), refresh=request.refresh)
+    except WorkerPoolFull as e:
+        logger.warning(f"Rejecting report request: {str(e)}")
+        raise busy_error(e)
+    logger.info(f"Started report job {job_id}")
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/reports/{job_id}",
+        "events_url": f"/reports/{job_id}/events",
+    }
+
+@app.get("/reports/{job_id}")
+async def report_status(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    job.pop("events", None)
+    return job
+
+@app.get("/reports/{job_id}/events")
+async def report_events(job_id: str):
+    """Server-Sent Events for a report job's progress: section and summary events, then done or error"""
+    if report_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    
+    async def events():
+        sent = 0
+        while True:
+            job = report_jobs.get(job_id)
+            for event in job["events"][sent:]:
+                # The last event carries the finished report, so followers needn't fetch it separately
+                yield sse_event(event["type"], dict(event, report=job["report"]) if event["type"] == "done" else event)
+            sent = len(job["events"])
+            if job["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(REPORT_EVENTS_POLL_SECONDS)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def load_chart_data(csv_url, file_id, month):
+    """Materialize the requested file and build its daily sales chart (blocking, runs on a worker thread)"""
+    dataset = resolve_dataset(csv_url, file_id)
+    if not dataset:
+        raise HTTPException(status_code=502, detail="Could not load the data file for charting")
+    return collect_sales_chart_data(dataset['path'], month)
+
+@app.get("/chart")
+async def chart(fileId: str = None, month: str = None):
+    try:
+        csv_url = await aget_csv_url(fileId)
+    except Exception as e:
+        logger.error(f"Error looking up the data file for charting: {str(e)}")
+        raise HTTPException(status_code=502, detail="Could not look up the data file for charting")
+    if not csv_url:
+        raise HTTPException(status_code=404, detail="No data file available for charting")
+    try:
+        return await agent_workers.run(load_chart_data, csv_url, fileId, month)
+    except WorkerPoolFull as e:
+        raise busy_error(e)
+
+@app.get("/metrics")
+async def metrics():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # Several worker processes (serve.py): aggregate what each has written to the shared directory
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {
+        "status": "healthy",
+        "workers": agent_workers.stats(),
+        "agent_pool": agent_pool.stats(),
+        "answer_cache": answer_cache.stats(),
+        "url_cache": url_cache.stats(),
+        "query_cache": query_cache.stats(),
+    }
+
+@app.on_event("shutdown")
+async def close_backend_client():
+    await close_async_client()
\ No newline at end of file
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+from app.telemetry import observe
+import contextvars
+import threading
+import asyncio
+import logging
+import time
+import os
+
+AGENT_WORKERS = int(os.environ.get('AGENT_WORKERS', '4'))
+AGENT_QUEUE_DEPTH = int(os.environ.get('AGENT_QUEUE_DEPTH', '16'))
+AGENT_RETRY_AFTER_SECONDS = int(os.environ.get('AGENT_RETRY_AFTER_SECONDS', '5'))
+
+logger = logging.getLogger("AgentWorkers")
+
+
+class WorkerPoolFull(Exception):
+    """Raised when the admission queue is full and a request has to be turned away"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Agent worker pool is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class AgentWorkerPool:
+    """
+    Dedicated thread pool for blocking agent work with a bounded admission queue
+
+    At most `workers` jobs run at once and at most `queue_depth` more wait for a
+    free worker; anything beyond that is rejected with WorkerPoolFull so callers
+    can answer with Retry-After instead of piling up requests. Background callers
+    that would rather wait for room than be turned away use start_when_admitted.
+    """
+
+    def __init__(self, workers=AGENT_WORKERS, queue_depth=AGENT_QUEUE_DEPTH, retry_after=AGENT_RETRY_AFTER_SECONDS):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-worker")
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+        self._admitted = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on a worker thread without blocking the event loop"""
+        return await self.submit(fn, *args, **kwargs)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Admit fn(*args, **kwargs) to the pool and return an awaitable for its result
+
+        Raises WorkerPoolFull right away when the admission queue is full.
+        """
+        return asyncio.wrap_future(self.start(fn, *args, **kwargs))
+
+    def start(self, fn, *args, **kwargs):
+        """Like submit, but return a concurrent.futures.Future, for callers on plain threads"""
+        self._admit(timeout=0)
+        return self._start(fn, args, kwargs)
+
+    def start_when_admitted(self, fn, *args, timeout=None, **kwargs):
+        """
+        Like start, but wait up to timeout seconds (forever for None) for the admission
+        queue to have room; raises WorkerPoolFull if it still has none
+        """
+        self._admit(timeout)
+        return self._start(fn, args, kwargs)
+
+    def _admit(self, timeout):
+        """Take an admission slot, waiting up to timeout seconds for one (not at all for 0)"""
+        with self._room:
+            if not (self._has_room() or (timeout != 0 and self._room.wait_for(self._has_room, timeout))):
+                self._rejected += 1
+                raise WorkerPoolFull(self.retry_after)
+            self._admitted += 1
+
+    def _has_room(self):
+        return self._admitted < self.workers + self.queue_depth
+
+    def _start(self, fn, args, kwargs):
+        submitted_at = time.monotonic()
+
+        def job():
+            waited = time.monotonic() - submitted_at
+            observe('queue_wait', time.perf_counter() - waited, waited)
+            with self._lock:
+                self._running += 1
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        # Copy the request context so per-request state follows the job onto the worker thread
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, job)
+        # Release the admission slot when the job really finishes, even if the client went away
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self._room:
+            self._admitted -= 1
+            self._room.notify()
+
+    def stats(self):
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "running": self._running,
+                "queued": self._admitted - self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 1) if started else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 1),
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+agent_workers = AgentWorkerPool()
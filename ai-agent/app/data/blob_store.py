@@ -0,0 +1,260 @@
+"""
+Local store of downloaded CSVs
+
+Every version of a file is kept once, under its content hash (blobs/<sha256>.csv),
+and every URL has a record of the blob it last served and the validators it came
+with (ETag, Last-Modified). The backend writes S3 objects under the uploaded file's
+name, so a URL can start serving different bytes whenever someone uploads a file with
+the same name; rather than downloading again to find out, a known URL is revalidated
+with a conditional GET (If-None-Match / If-Modified-Since), which answers 304 with no
+body when nothing changed. For BLOB_REVALIDATE_SECONDS after a check the URL is
+trusted without asking.
+
+Downloads stream into a partial file that survives a broken connection or a restart;
+the next attempt asks for the rest with a Range request (If-Range makes the server
+send the whole object instead if it changed meanwhile). Callers hold blob_lock(url)
+around fetch_blob and their use of the blob, so concurrent fetches of one URL, in this
+process or another sharing DATA_DIR, wait for a single download, and a blob isn't
+removed while someone is still reading it.
+"""
+from contextlib import contextmanager
+from app.data.engine import DATA_DIR
+from app.data.locks import file_lock
+import requests
+import threading
+import hashlib
+import logging
+import json
+import time
+import os
+
+BLOB_DIR = os.path.join(DATA_DIR, 'blobs')
+# Seconds a revalidated URL is trusted before it is checked again (0 checks on every use)
+BLOB_REVALIDATE_SECONDS = float(os.environ.get('BLOB_REVALIDATE_SECONDS', '60'))
+# Requests made for one download before a broken connection is given up on
+BLOB_DOWNLOAD_ATTEMPTS = int(os.environ.get('BLOB_DOWNLOAD_ATTEMPTS', '3'))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger("BlobStore")
+
+# URL records read or written by this process, keyed by URL
+_records = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class ContentHash:
+    """sha256 of a stream of chunks, also noting the hash of its first prefix_length bytes and its last byte"""
+
+    def __init__(self, prefix_length=None):
+        self.hasher = hashlib.sha256()
+        self.prefix_length = prefix_length
+        self.prefix_hash = None
+        self.size = 0
+        self.last_byte = b''
+
+    def update(self, chunk):
+        if not chunk:
+            return
+        # Snapshot the hash where the previous version of the file ended
+        if self.prefix_length is not None and self.size <= self.prefix_length < self.size + len(chunk):
+            split = self.prefix_length - self.size
+            self.hasher.update(chunk[:split])
+            self.prefix_hash = self.hasher.hexdigest()
+            self.hasher.update(chunk[split:])
+        else:
+            self.hasher.update(chunk)
+        self.size += len(chunk)
+        self.last_byte = chunk[-1:]
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+def _url_name(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def _record_path(name):
+    return os.path.join(BLOB_DIR, 'urls', f'{name}.json')
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable {path}: {e}")
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@contextmanager
+def blob_lock(url):
+    """Hold a URL's lock, in this process and across processes sharing DATA_DIR"""
+    name = _url_name(url)
+    with _locks_guard:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock, file_lock(os.path.join(BLOB_DIR, 'urls', f'{name}.lock')):
+        yield
+
+
+def is_fresh(url):
+    """Whether this process revalidated the URL within BLOB_REVALIDATE_SECONDS (no lock or I/O needed)"""
+    record = _records.get(url)
+    return record is not None and time.time() - record['validated_at'] < BLOB_REVALIDATE_SECONDS
+
+
+def _validators(response):
+    return {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+
+
+def _conditional_headers(record):
+    headers = {}
+    if record.get('etag'):
+        headers['If-None-Match'] = record['etag']
+    if record.get('last_modified'):
+        headers['If-Modified-Since'] = record['last_modified']
+    return headers
+
+
+def _stream(url, name, record, prefix_length):
+    """
+    GET a URL into its partial file, resuming a partial download where one is left
+
+    Returns:
+        None when the record's blob is still current (304), else (ContentHash of the
+        whole file, its validators, bytes transferred, path of the downloaded file)
+    """
+    part_path = os.path.join(BLOB_DIR, 'urls', f'{name}.part')
+    partial_path = part_path + '.json'
+    transferred = 0
+    for attempt in range(1, BLOB_DOWNLOAD_ATTEMPTS + 1):
+        partial = _read_json(partial_path) if os.path.exists(part_path) else None
+        offset = os.path.getsize(part_path) if partial and partial.get('url') == url else 0
+        validator = partial and (partial.get('etag') or partial.get('last_modified'))
+        if offset and validator:
+            headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+        elif record:
+            headers = _conditional_headers(record)
+        else:
+            headers = {}
+        try:
+            with requests.get(url, stream=True, headers=headers, timeout=(5, 60)) as response:
+                if response.status_code == 304 and record:
+                    return None
+                if response.status_code == 416:
+                    # The partial file is no prefix of what the server has now; start over
+                    _remove(part_path)
+                    continue
+                response.raise_for_status()
+                content = ContentHash(prefix_length)
+                validators = _validators(response)
+                if response.status_code == 206:
+                    logger.info(f"Resuming download of {url} at byte {offset}")
+                    with open(part_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                            content.update(chunk)
+                    validators = {key: partial.get(key) for key in validators}
+                    mode = 'ab'
+                else:
+                    _write_json(partial_path, dict(validators, url=url))
+                    mode = 'wb'
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        content.update(chunk)
+                        transferred += len(chunk)
+                        f.write(chunk)
+            return content, validators, transferred, part_path
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == BLOB_DOWNLOAD_ATTEMPTS:
+                raise
+            logger.warning(f"Download of {url} broke off (attempt {attempt}), retrying: {e}")
+    raise requests.ConnectionError(f"Could not download {url} in {BLOB_DOWNLOAD_ATTEMPTS} attempts")
+
+
+def _prune(sha256, keep_name):
+    """Remove a blob no other URL record refers to"""
+    directory = os.path.join(BLOB_DIR, 'urls')
+    for entry in os.listdir(directory):
+        if entry.endswith('.json') and not entry.endswith('.part.json') and entry != f'{keep_name}.json':
+            other = _read_json(os.path.join(directory, entry))
+            if other and other.get('sha256') == sha256:
+                return
+    _remove(os.path.join(BLOB_DIR, f'{sha256}.csv'))
+
+
+def fetch_blob(url, prefix_length=None):
+    """
+    The current content of a URL, downloaded only when it is new or has changed;
+    call while holding blob_lock(url)
+
+    If the URL can't be reached but an earlier download of it is stored, that is
+    used (and the URL checked again next time).
+
+    Args:
+        url (str): URL of the file (usually an S3 object URL)
+        prefix_length (int, optional): also hash the first prefix_length bytes of a
+            download, to tell whether the new content starts with an older version
+
+    Returns:
+        dict: the URL's record (sha256, size, ends_with_newline and the blob's path)
+        plus bytes_downloaded and prefix_hash (None unless content was downloaded and
+        is longer than prefix_length)
+    """
+    name = _url_name(url)
+    os.makedirs(os.path.join(BLOB_DIR, 'urls'), exist_ok=True)
+    record = _read_json(_record_path(name))
+    if not (record and record.get('url') == url and os.path.exists(record.get('path', ''))):
+        record = None
+    elif time.time() - record['validated_at'] < BLOB_REVALIDATE_SECONDS:
+        # Checked moments ago, e.g. by a request this one waited for
+        _records[url] = record
+        return dict(record, bytes_downloaded=0, prefix_hash=None)
+
+    try:
+        result = _stream(url, name, record, prefix_length)
+    except requests.RequestException as e:
+        if record is None:
+            raise
+        logger.warning(f"Could not revalidate {url}, using the stored copy ({record['sha256'][:12]}): {e}")
+        return dict(record, bytes_downloaded=0, prefix_hash=None)
+
+    if result is None:
+        record['validated_at'] = time.time()
+        _write_json(_record_path(name), record)
+        _records[url] = record
+        logger.info(f"{url} unchanged ({record['sha256'][:12]})")
+        return dict(record, bytes_downloaded=0, prefix_hash=None)
+
+    content, validators, transferred, part_path = result
+    sha256 = content.hexdigest()
+    blob_path = os.path.join(BLOB_DIR, f'{sha256}.csv')
+    if os.path.exists(blob_path):
+        _remove(part_path)
+    else:
+        os.replace(part_path, blob_path)
+    _remove(part_path + '.json')
+
+    previous = record
+    record = dict(validators, url=url, sha256=sha256, size=content.size,
+                  ends_with_newline=content.last_byte == b'\n', path=blob_path, validated_at=time.time())
+    _write_json(_record_path(name), record)
+    _records[url] = record
+    if previous and previous['sha256'] != sha256:
+        logger.info(f"{url} changed ({previous['sha256'][:12]} -> {sha256[:12]})")
+        _prune(previous['sha256'], name)
+    return dict(record, bytes_downloaded=transferred, prefix_hash=content.prefix_hash)
@@ -0,0 +1,189 @@
+"""
+Several uploaded files analysed as one sales_data table
+
+Each file is materialized on its own (see app.data.ingest), so adding a month to a
+set of monthly exports downloads and converts only the new file. The set is then
+written out as a collection file listing every file as a partition with the date
+range its profile found. app.data.sources reads the partitions back as one
+UNION ALL BY NAME relation in which each partition carries a guard on its date range,
+so a query filtered to a month only scans the files that overlap it.
+"""
+from collections import namedtuple
+from app.data.ingest import (DATA_DIR, materialize_dataset, notify_dataset_changed, prune_retired_versions,
+                             restore_version, retire_version)
+from app.data.sources import COLLECTION_SUFFIX, read_collection
+from app.data.profiler import get_profile
+from app.data.rollups import get_rollups
+from app.data.sample import get_sample
+from app.data.columns import quote_identifier, sql_literal
+from app.data.locks import file_lock
+import threading
+import hashlib
+import logging
+import json
+import os
+
+logger = logging.getLogger("Collection")
+
+# A set of uploaded files: key names the set on disk, files are (file ID, CSV URL) pairs
+FileSet = namedtuple('FileSet', ['key', 'files'])
+
+# Collections already materialized by this process, keyed by file set key
+_collections = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def file_set_key(file_ids=None, browser_id=None):
+    """
+    Directory key for a file set
+
+    A browser's uploads keep one key as files are added, so older versions of its
+    collection are cleaned up; an explicit list of IDs is keyed by the IDs themselves.
+    """
+    if browser_id:
+        return 'browser-' + hashlib.sha1(browser_id.encode('utf-8')).hexdigest()[:20]
+    ids = '\x1f'.join(sorted(set(file_ids or [])))
+    return 'files-' + hashlib.sha1(ids.encode('utf-8')).hexdigest()[:20]
+
+
+def _collection_lock(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _collection_dir(key):
+    return os.path.join(DATA_DIR, 'collections', key)
+
+
+def _read_manifest(key):
+    manifest_path = os.path.join(_collection_dir(key), 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, value):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def date_guard(profile):
+    """
+    Predicate that holds for every row of a file, from its profiled date range
+
+    Only written for DATE and TIMESTAMP columns without nulls: a guard on a column that
+    needs parsing could not be pushed down, and one on a column with nulls would drop rows.
+    """
+    date_range = profile.get('date_range')
+    column_name = profile['roles'].get('date')
+    if not date_range or not column_name:
+        return None
+    column = next(column for column in profile['columns'] if column['name'] == column_name)
+    if column['null_count']:
+        return None
+    start = f"CAST({sql_literal(date_range['start'])} AS DATE)"
+    end = f"CAST({sql_literal(date_range['end'])} AS DATE)"
+    quoted = quote_identifier(column_name)
+    column_type = column['type'].upper()
+    if column_type == 'DATE':
+        return f"{quoted} BETWEEN {start} AND {end}"
+    if column_type == 'TIMESTAMP':
+        return f"{quoted} >= CAST({start} AS TIMESTAMP) AND {quoted} < CAST({end} AS TIMESTAMP) + INTERVAL 1 DAY"
+    return None
+
+
+def _partition(dataset):
+    profile = get_profile(dataset['path'])
+    return {
+        'file_id': dataset['file_id'],
+        'key': dataset['key'],
+        'path': dataset['path'],
+        'content_hash': dataset['content_hash'],
+        'row_count': dataset['row_count'],
+        'date_range': profile.get('date_range'),
+        'guard': date_guard(profile),
+    }
+
+
+def materialize_collection(file_set):
+    """
+    Materialize every file of a set and combine them into one collection
+
+    Files that can't be materialized are left out with a warning.
+
+    Returns:
+        dict: Dataset info like app.data.ingest.materialize_dataset returns (key,
+        content_hash, row_count and the path of the collection file), plus the partitions
+    """
+    datasets = []
+    for file_id, csv_url in file_set.files:
+        try:
+            datasets.append(materialize_dataset(csv_url, file_id))
+        except Exception as e:
+            logger.warning(f"Leaving file {file_id} out of collection {file_set.key}: {e}")
+    if not datasets:
+        raise ValueError(f"None of the {len(file_set.files)} files in collection {file_set.key} could be loaded")
+
+    # The collection's content is the set of its files' contents, in any order
+    hashes = '\x1f'.join(sorted(dataset['content_hash'] for dataset in datasets))
+    content_hash = hashlib.sha256(hashes.encode('utf-8')).hexdigest()
+    collection = _collections.get(file_set.key)
+    if collection and collection['content_hash'] == content_hash and os.path.exists(collection['path']):
+        return collection
+
+    directory = _collection_dir(file_set.key)
+    with _collection_lock(file_set.key), file_lock(os.path.join(directory, '.lock')):
+        prune_retired_versions(directory)
+        previous = _read_manifest(file_set.key)
+        path = os.path.join(directory, f'{content_hash}{COLLECTION_SUFFIX}')
+        partitions = sorted((_partition(dataset) for dataset in datasets),
+                            key=lambda partition: (partition['date_range'] or {}).get('start') or '')
+        if not os.path.exists(path):
+            _write_json(path, {'partitions': partitions})
+            logger.info(f"Collected {len(partitions)} files as {file_set.key} ({content_hash[:12]})")
+        else:
+            restore_version(path)
+        try:
+            get_rollups(path)
+        except Exception as e:
+            logger.warning(f"Could not build rollups for collection {file_set.key}: {e}")
+        try:
+            get_sample(path)
+        except Exception as e:
+            logger.warning(f"Could not sample collection {file_set.key}: {e}")
+
+        collection = {
+            'key': file_set.key,
+            'file_ids': [partition['file_id'] for partition in partitions],
+            'content_hash': content_hash,
+            'row_count': sum(partition['row_count'] for partition in partitions),
+            'path': path,
+            'partitions': partitions,
+        }
+        _write_json(os.path.join(directory, 'manifest.json'), collection)
+        _collections[file_set.key] = collection
+
+        if previous and previous['path'] != path:
+            notify_dataset_changed(collection, previous['path'])
+            retire_version(previous['path'])
+    return collection
+
+
+def describe_partitions_for_semantic_model(collection_path):
+    """Semantic model details for a collection: which files it combines and the dates each covers"""
+    partitions = read_collection(collection_path)['partitions']
+    return {
+        'partitions': [
+            {key: value for key, value in (
+                ('file_id', partition['file_id']),
+                ('row_count', partition['row_count']),
+                ('date_range', partition['date_range']),
+            ) if value is not None}
+            for partition in partitions
+        ],
+    }
@@ -0,0 +1,142 @@
+import re
+
+# Column names that usually hold each role, most specific first (compared after normalization)
+ROLE_NAME_HINTS = {
+    'date': ['orderdate', 'transactiondate', 'invoicedate', 'saledate', 'salesdate', 'purchasedate',
+             'date', 'datetime', 'timestamp', 'orderdatetime', 'createdat'],
+    'amount': ['totalamount', 'invoicetotal', 'totalsales', 'salesamount', 'linetotal', 'totalprice',
+               'total', 'amount', 'sales', 'revenue', 'netsales'],
+    'quantity': ['quantity', 'qty', 'quantitysold', 'units', 'unitssold', 'itemcount'],
+    'price': ['unitprice', 'price', 'priceperunit', 'itemprice', 'sellingprice'],
+    'product': ['productname', 'product', 'item', 'itemname', 'productid', 'sku', 'productcode', 'itemid'],
+    'customer': ['customername', 'customer', 'customerid', 'client', 'clientname', 'clientid', 'buyer'],
+    'order_id': ['orderid', 'invoiceid', 'invoiceno', 'invoicenumber', 'transactionid', 'orderno',
+                 'ordernumber', 'receiptid'],
+    'region': ['region', 'location', 'city', 'country', 'state', 'store', 'branch', 'territory'],
+}
+
+# Substrings that suggest a role when no exact name matches
+ROLE_NAME_FRAGMENTS = {
+    'date': ['date', 'time'],
+    'amount': ['total', 'amount', 'sales', 'revenue'],
+    'quantity': ['quantity', 'qty', 'units'],
+    'price': ['price'],
+    'product': ['product', 'item'],
+    'customer': ['customer', 'client'],
+    'order_id': ['order', 'invoice', 'transaction'],
+    'region': ['region', 'location', 'city', 'country'],
+}
+
+NUMERIC_TYPES = ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT',
+                 'UINTEGER', 'UBIGINT', 'FLOAT', 'DOUBLE', 'DECIMAL', 'REAL')
+TEMPORAL_TYPES = ('DATE', 'TIMESTAMP')
+
+# Roles whose column must be numeric / may be temporal or text
+NUMERIC_ROLES = ('amount', 'quantity', 'price')
+
+
+def _normalize(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def is_numeric_type(column_type):
+    return column_type.upper().startswith(NUMERIC_TYPES)
+
+
+def is_temporal_type(column_type):
+    return column_type.upper().startswith(TEMPORAL_TYPES)
+
+
+def _fits_role(role, column_type):
+    if role in NUMERIC_ROLES:
+        return is_numeric_type(column_type)
+    if role == 'date':
+        return is_temporal_type(column_type) or column_type.upper() == 'VARCHAR'
+    return True
+
+
+def detect_column_roles(columns):
+    """
+    Work out which column plays each role in a sales table
+
+    Args:
+        columns (list): (name, duckdb type) pairs, e.g. from DESCRIBE
+
+    Returns:
+        dict: role -> column name for every role that could be identified
+    """
+    roles = {}
+    taken = set()
+    normalized = [(name, _normalize(name), column_type) for name, column_type in columns]
+
+    # Exact name matches first, then substring matches, so "order_date" never ends up as an order ID
+    for matcher in ('exact', 'fragment'):
+        for role, hints in ROLE_NAME_HINTS.items():
+            if role in roles:
+                continue
+            candidates = hints if matcher == 'exact' else ROLE_NAME_FRAGMENTS[role]
+            for hint in candidates:
+                match = next(
+                    (name for name, norm, column_type in normalized
+                     if name not in taken and _fits_role(role, column_type)
+                     and (norm == hint if matcher == 'exact' else hint in norm)),
+                    None,
+                )
+                if match:
+                    roles[role] = match
+                    taken.add(match)
+                    break
+
+    # Fall back to the first temporal column for the date role
+    if 'date' not in roles:
+        match = next((name for name, _, column_type in normalized
+                      if name not in taken and is_temporal_type(column_type)), None)
+        if match:
+            roles['date'] = match
+    return roles
+
+
+def quote_identifier(name):
+    """Quote a column name for use in DuckDB SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def sql_literal(value):
+    """Quote a string (usually a file path) as a DuckDB string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def role_expressions(roles, column_types=None):
+    """
+    SQL expressions for the measures and dimensions a set of column roles supports
+
+    Revenue falls back to price * quantity when there is no total column, and orders
+    fall back to counting rows when there is no order ID. When column_types shows the
+    date column is already temporal, 'date_filter' is the bare column so range filters
+    can be pushed down into Parquet row-group statistics.
+    """
+    expressions = {}
+    if 'date' in roles:
+        column = quote_identifier(roles['date'])
+        column_type = (column_types or {}).get(roles['date'], '')
+        if column_type.upper() == 'DATE':
+            expressions['date'] = column
+        elif is_temporal_type(column_type):
+            expressions['date'] = f"CAST({column} AS DATE)"
+        else:
+            expressions['date'] = f"TRY_CAST({column} AS DATE)"
+        expressions['date_filter'] = column if is_temporal_type(column_type) else expressions['date']
+    if 'amount' in roles:
+        expressions['revenue'] = quote_identifier(roles['amount'])
+    elif 'price' in roles and 'quantity' in roles:
+        expressions['revenue'] = f"{quote_identifier(roles['price'])} * {quote_identifier(roles['quantity'])}"
+    if 'quantity' in roles:
+        expressions['quantity'] = quote_identifier(roles['quantity'])
+    if 'order_id' in roles:
+        expressions['orders'] = f"count(DISTINCT {quote_identifier(roles['order_id'])})"
+    else:
+        expressions['orders'] = "count(*)"
+    for role in ('product', 'customer', 'region'):
+        if role in roles:
+            expressions[role] = quote_identifier(roles[role])
+    return expressions
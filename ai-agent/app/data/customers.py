@@ -0,0 +1,260 @@
+"""
+Customer analytics: RFM, cohort retention and lifetime value
+
+One scan of sales_data groups it by customer and month (revenue, orders, first and
+last purchase date); everything else is computed from those rows with NumPy:
+
+  - per customer: recency (days since the last purchase, as of the dataset's last
+    date), frequency (orders) and monetary value (revenue), each scored 1-5 by
+    quintile, and an RFM segment
+  - cohorts by first-purchase month: the share of each cohort buying again 1, 2, ...
+    months later
+  - repeat rate, purchase frequency, average order value, month-over-month retention
+    and lifetime value
+
+Results are cached per dataset.
+"""
+from app.data.profiler import get_profile, profile_expressions
+from app.data.sources import table_source
+from app.data.engine import connect
+from functools import lru_cache
+import numpy as np
+import logging
+
+# Cohorts and months after the first purchase reported
+COHORT_MONTHS = 12
+# Expected customer lifetime is capped, since retention close to 100% would make it unbounded
+MAX_LIFETIME_MONTHS = 60
+
+# RFM segments, first match wins: (name, minimum recency score, maximum recency score, minimum frequency score)
+SEGMENTS = [
+    ('Champions', 4, 5, 4),
+    ('Loyal', 3, 5, 3),
+    ('New', 4, 5, 1),
+    ('At risk', 1, 2, 3),
+    ('Lost', 1, 1, 1),
+    ('Needs attention', 1, 5, 1),
+]
+
+logger = logging.getLogger("Customers")
+
+
+def _month_label(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _quintile_scores(values, higher_is_better=True):
+    """Scores 1-5 by quintile of values; equal values get equal scores"""
+    edges = np.quantile(values, [0.2, 0.4, 0.6, 0.8])
+    if higher_is_better:
+        return 1 + np.searchsorted(edges, values, side='left')
+    return 5 - np.searchsorted(edges, values, side='left')
+
+
+def load_customer_months(parquet_path):
+    """
+    Revenue, orders and first / last purchase day per customer and month, in one scan
+
+    Returns:
+        dict of arrays (customer, month as months since year 0, revenue, orders, first_day
+        and last_day as days since 1970-01-01), or None without customer, date or revenue columns
+    """
+    expr = profile_expressions(get_profile(parquet_path))
+    if not all(role in expr for role in ('customer', 'date', 'revenue')):
+        return None
+    date = expr['date']
+    con = connect()
+    try:
+        return con.execute(
+            f"""
+            SELECT CAST({expr['customer']} AS VARCHAR) AS customer,
+                   year({date}) * 12 + month({date}) - 1 AS month,
+                   CAST(sum({expr['revenue']}) AS DOUBLE) AS revenue,
+                   CAST({expr['orders']} AS BIGINT) AS orders,
+                   CAST(datediff('day', DATE '1970-01-01', min({date})) AS BIGINT) AS first_day,
+                   CAST(datediff('day', DATE '1970-01-01', max({date})) AS BIGINT) AS last_day
+            FROM {table_source(parquet_path)}
+            WHERE {expr['customer']} IS NOT NULL AND {date} IS NOT NULL
+            GROUP BY ALL
+            ORDER BY customer, month
+            """
+        ).fetchnumpy()
+    finally:
+        con.close()
+
+
+def compute_customer_analytics(rows):
+    """
+    Customer metrics from customer-month rows sorted by customer and month (see load_customer_months)
+
+    Returns:
+        dict: per-customer arrays (names, recency_days, frequency, monetary, RFM scores,
+        segment), segment totals, the cohort retention matrix and summary metrics
+    """
+    customers = np.asarray(rows['customer'], dtype=object)
+    if not len(customers):
+        return None
+    month = rows['month'].astype(np.int64)
+    revenue = np.nan_to_num(rows['revenue'].astype(float))
+    orders = rows['orders'].astype(np.int64)
+
+    # Rows are sorted by customer, so each customer is one run of rows
+    starts = np.flatnonzero(np.r_[True, customers[1:] != customers[:-1]])
+    customer_index = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(customers)]))
+    names = customers[starts]
+    monetary = np.add.reduceat(revenue, starts)
+    frequency = np.add.reduceat(orders, starts)
+    first_day = np.minimum.reduceat(rows['first_day'].astype(np.int64), starts)
+    last_day = np.maximum.reduceat(rows['last_day'].astype(np.int64), starts)
+    first_month = month[starts]
+
+    as_of = int(last_day.max())
+    recency = as_of - last_day
+    r_score = _quintile_scores(recency, higher_is_better=False)
+    f_score = _quintile_scores(frequency)
+    m_score = _quintile_scores(monetary)
+    segment = np.select(
+        [(r_score >= low) & (r_score <= high) & (f_score >= min_f) for _, low, high, min_f in SEGMENTS],
+        [name for name, _, _, _ in SEGMENTS],
+        default='Needs attention',
+    )
+
+    # Cohort retention: customers of each first-purchase month active k months later
+    last_month = int(month.max())
+    cohort_start = max(int(first_month.min()), last_month - COHORT_MONTHS + 1)
+    cohort = first_month[customer_index]
+    offset = month - cohort
+    in_table = (cohort >= cohort_start) & (offset <= COHORT_MONTHS)
+    cells = np.bincount((cohort[in_table] - cohort_start) * (COHORT_MONTHS + 1) + offset[in_table],
+                        minlength=(last_month - cohort_start + 1) * (COHORT_MONTHS + 1))
+    active = cells.reshape(-1, COHORT_MONTHS + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retention = active / active[:, :1]
+    # Months after the end of the data haven't happened yet
+    observed = np.arange(COHORT_MONTHS + 1)[None, :] <= (last_month - np.arange(cohort_start, last_month + 1))[:, None]
+    retention = np.where(observed, retention, np.nan)
+
+    # Month-over-month retention: of the customers buying in a month, the share buying again the next month
+    same_customer = customer_index[1:] == customer_index[:-1]
+    returned = (same_customer & (month[1:] == month[:-1] + 1)).sum()
+    could_return = (month < last_month).sum()
+    monthly_retention = returned / could_return if could_return else None
+
+    total_revenue = monetary.sum()
+    total_orders = frequency.sum()
+    average_order_value = total_revenue / total_orders if total_orders else None
+    # Lifetime value: revenue per active customer-month times the expected months a customer stays
+    revenue_per_active_month = total_revenue / len(month)
+    if monthly_retention is None:
+        lifetime_months = None
+    elif monthly_retention >= 1 - 1 / MAX_LIFETIME_MONTHS:
+        lifetime_months = MAX_LIFETIME_MONTHS
+    else:
+        lifetime_months = 1 / (1 - monthly_retention)
+
+    segments = {}
+    for name, _, _, _ in SEGMENTS:
+        members = segment == name
+        if members.any():
+            segments[name] = {'customers': int(members.sum()), 'revenue': float(monetary[members].sum())}
+
+    return {
+        'names': names,
+        'recency_days': recency,
+        'frequency': frequency,
+        'monetary': monetary,
+        'first_day': first_day,
+        'last_day': last_day,
+        'r_score': r_score,
+        'f_score': f_score,
+        'm_score': m_score,
+        'segment': segment,
+        'segments': segments,
+        'cohort_months': [_month_label(index) for index in range(cohort_start, last_month + 1)],
+        'cohort_sizes': active[:, 0],
+        'retention': retention,
+        'summary': {
+            'customers': len(names),
+            'total_revenue': float(total_revenue),
+            'total_orders': int(total_orders),
+            'repeat_customer_rate': float((frequency > 1).mean()),
+            'average_purchase_frequency': float(total_orders / len(names)),
+            'average_order_value': average_order_value,
+            'average_revenue_per_customer': float(total_revenue / len(names)),
+            'monthly_retention_rate': monthly_retention,
+            'expected_lifetime_months': lifetime_months,
+            'customer_lifetime_value': (revenue_per_active_month * lifetime_months
+                                        if lifetime_months is not None else None),
+            'as_of': str(np.datetime64(as_of, 'D')),
+        },
+    }
+
+
+@lru_cache(maxsize=32)
+def get_customer_analytics(parquet_path):
+    """Customer analytics for a materialized dataset, computed once per parquet file (the path includes the content hash)"""
+    rows = load_customer_months(parquet_path)
+    analytics = compute_customer_analytics(rows) if rows is not None else None
+    if analytics is None:
+        logger.info(f"No customer, date and revenue columns in {parquet_path}, skipping customer analytics")
+    else:
+        logger.info(f"Analysed {analytics['summary']['customers']} customers of {parquet_path}")
+    return analytics
+
+
+def _round(value, digits=2):
+    return None if value is None else round(float(value), digits)
+
+
+def describe_customer(analytics, index):
+    """One customer's purchases, RFM scores and segment as plain data for the agent"""
+    return {
+        'customer': str(analytics['names'][index]),
+        'revenue': _round(analytics['monetary'][index]),
+        'orders': int(analytics['frequency'][index]),
+        'first_purchase': str(np.datetime64(int(analytics['first_day'][index]), 'D')),
+        'last_purchase': str(np.datetime64(int(analytics['last_day'][index]), 'D')),
+        'recency_days': int(analytics['recency_days'][index]),
+        'rfm': f"{analytics['r_score'][index]}{analytics['f_score'][index]}{analytics['m_score'][index]}",
+        'segment': str(analytics['segment'][index]),
+    }
+
+
+def find_customer(analytics, customer):
+    """Index of a customer, matching exactly (ignoring case) first, else by substring; None if there's no match"""
+    wanted = customer.strip().lower()
+    names = np.char.lower(analytics['names'].astype(str))
+    exact = np.flatnonzero(names == wanted)
+    if len(exact):
+        return int(exact[0])
+    partial = np.flatnonzero(np.char.find(names, wanted) >= 0)
+    return int(partial[0]) if len(partial) else None
+
+
+def describe_customers(analytics, top=5):
+    """Summary, segments, top customers and cohort retention as plain data for the agent"""
+    summary = analytics['summary']
+    top_customers = np.argsort(-analytics['monetary'], kind='stable')[:top]
+    return {
+        'summary': {key: _round(value, 4) if isinstance(value, float) else value for key, value in summary.items()},
+        'segments': {name: {'customers': segment['customers'], 'revenue': _round(segment['revenue']),
+                            'revenue_share': _round(segment['revenue'] / summary['total_revenue'], 4)
+                            if summary['total_revenue'] else None}
+                     for name, segment in analytics['segments'].items()},
+        'top_customers': [describe_customer(analytics, index) for index in top_customers],
+        'cohort_retention': [
+            {'cohort': cohort, 'customers': int(size),
+             'retained_after_months': [_round(share, 4) for share in row[1:] if not np.isnan(share)]}
+            for cohort, size, row in zip(analytics['cohort_months'], analytics['cohort_sizes'], analytics['retention'])
+            if size
+        ],
+        'definitions': {
+            'recency_days': f"days from the customer's last purchase to {summary['as_of']}",
+            'rfm': "recency, frequency and monetary quintile scores, 5 is best",
+            'repeat_customer_rate': "share of customers with more than one order",
+            'monthly_retention_rate': "share of customers buying in a month who buy again the next month",
+            'customer_lifetime_value': "revenue per active customer-month x expected lifetime months "
+                                       "(1 / (1 - monthly retention), at most 60)",
+            'retained_after_months': "share of the cohort buying 1, 2, ... months after its first purchase month",
+        },
+    }
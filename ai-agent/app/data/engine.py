@@ -0,0 +1,96 @@
+"""
+DuckDB connections with bounded memory
+
+Every connection the service opens goes through connect(), so large scans and
+group-bys stay within DUCKDB_MEMORY_LIMIT and spill to DUCKDB_TEMP_DIR instead of
+growing until the container is OOM-killed. Each connection is its own DuckDB instance
+with its own limit, so the default leaves room for a few of them running at once.
+"""
+import itertools
+import duckdb
+import logging
+import os
+
+DATA_DIR = os.environ.get(
+    'DATA_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.data')
+)
+
+# Memory per connection, e.g. '2GB'; by default a fraction of the memory available to the container
+DUCKDB_MEMORY_LIMIT = os.environ.get('DUCKDB_MEMORY_LIMIT')
+DUCKDB_MEMORY_FRACTION = float(os.environ.get('DUCKDB_MEMORY_FRACTION', '0.25'))
+# Threads per connection; by default the CPUs this process may run on (DuckDB counts all host CPUs)
+DUCKDB_THREADS = os.environ.get('DUCKDB_THREADS')
+DUCKDB_TEMP_DIR = os.environ.get('DUCKDB_TEMP_DIR', os.path.join(DATA_DIR, 'duckdb_tmp'))
+# Queries at least this large (in memory or spilled) are logged at INFO, smaller ones at DEBUG
+QUERY_MEMORY_LOG_BYTES = int(os.environ.get('QUERY_MEMORY_LOG_BYTES', str(256 * 1024 * 1024)))
+
+logger = logging.getLogger("DuckDB")
+
+_settings = None
+_connection_ids = itertools.count()
+
+
+def _available_memory():
+    """Bytes of memory available to this process: the cgroup limit if there is one, else physical RAM"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # Unlimited cgroups report 'max' (v2) or a huge sentinel (v1)
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _cpu_count():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def duckdb_settings():
+    """The memory_limit and threads every connection is opened with"""
+    global _settings
+    if _settings is None:
+        settings = {
+            'threads': int(DUCKDB_THREADS) if DUCKDB_THREADS else _cpu_count(),
+        }
+        if DUCKDB_MEMORY_LIMIT:
+            settings['memory_limit'] = DUCKDB_MEMORY_LIMIT
+        else:
+            available = _available_memory()
+            if available:
+                settings['memory_limit'] = f"{max(64, int(available * DUCKDB_MEMORY_FRACTION) // 2**20)}MiB"
+        os.makedirs(DUCKDB_TEMP_DIR, exist_ok=True)
+        _settings = settings
+    return dict(_settings)
+
+
+def connect():
+    """Open an in-memory DuckDB connection with the service's memory, thread and spill settings"""
+    # Each instance spills into its own directory, which DuckDB creates on demand and removes on close
+    temp_directory = os.path.join(DUCKDB_TEMP_DIR, f"{os.getpid()}-{next(_connection_ids)}")
+    return duckdb.connect(config=dict(duckdb_settings(), temp_directory=temp_directory))
+
+
+def memory_usage(con):
+    """(bytes held in memory, bytes spilled to temp files) by a connection's buffer pool"""
+    return con.execute(
+        "SELECT coalesce(sum(memory_usage_bytes), 0), coalesce(sum(temporary_storage_bytes), 0) FROM duckdb_memory()"
+    ).fetchone()
+
+
+def log_memory(con, label):
+    """Log a connection's memory use after a query; failures are ignored, this is diagnostics only"""
+    try:
+        in_memory, spilled = memory_usage(con)
+    except Exception:
+        return
+    level = logging.INFO if max(in_memory, spilled) >= QUERY_MEMORY_LOG_BYTES else logging.DEBUG
+    logger.log(level, f"{label}: {in_memory / 2**20:.1f} MiB in memory, {spilled / 2**20:.1f} MiB spilled")
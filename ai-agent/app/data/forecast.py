@@ -0,0 +1,344 @@
+"""
+Sales forecasts for every product at once
+
+Monthly (or daily) totals are read from the dataset's rollups into one matrix with a
+row per series - the whole business first, then the products with the most sales -
+and each model is fitted to all rows together with NumPy:
+
+  - seasonal naive: the value one season (12 months, 7 days) earlier
+  - Holt-Winters: additive level, trend and season, smoothing parameters picked per
+    series from a small grid by in-sample error (Holt's linear method when there is
+    less than two seasons of history)
+  - linear trend: least squares over time
+
+Each model is backtested on the last periods of history, the one with the lowest
+error is kept per series and refitted on all of it. Intervals come from the chosen
+model's one-step residuals, widened with the horizon. Forecasts are made once per
+dataset, grain and measure for FORECAST_MAX_HORIZON periods and cached; a shorter
+horizon is the first periods of them (no model's first steps depend on how many
+follow).
+"""
+from app.data.profiler import get_profile, profile_expressions
+from app.data.rollups import get_rollups
+from app.data.sources import table_source
+from app.data.columns import sql_literal
+from app.data.engine import connect
+from functools import lru_cache
+import numpy as np
+import calendar
+import logging
+import os
+
+# Products forecast individually, by sales; the rest only count towards the total
+FORECAST_MAX_SERIES = int(os.environ.get('FORECAST_MAX_SERIES', '500'))
+FORECAST_MAX_HORIZON = 36
+TOTAL_SERIES = 'All products'
+
+# grain -> (rollup table, season length)
+GRAINS = {
+    'month': ('sales_by_month_product', 12),
+    'day': ('sales_by_day_product', 7),
+}
+MODELS = ('seasonal_naive', 'holt_winters', 'linear_trend')
+
+# Smoothing parameters tried for Holt-Winters (level, trend, season)
+HW_ALPHAS = (0.2, 0.5, 0.8)
+HW_BETAS = (0.05, 0.2)
+HW_GAMMAS = (0.1, 0.3)
+
+Z_SCORES = {80: 1.2816, 90: 1.6449, 95: 1.96}
+
+logger = logging.getLogger("Forecast")
+
+
+def _period_index_sql(grain, column):
+    """SQL for a date's period as an integer: months since year 0, or days since 1970-01-01"""
+    if grain == 'month':
+        return f"(year({column}) * 12 + month({column}) - 1)"
+    return f"CAST(datediff('day', DATE '1970-01-01', CAST({column} AS DATE)) AS BIGINT)"
+
+
+def _period_label(grain, index):
+    if grain == 'month':
+        return f"{index // 12:04d}-{index % 12 + 1:02d}"
+    return str(np.datetime64(int(index), 'D'))
+
+
+def _source_sql(parquet_path, grain, measure):
+    """SELECT of (period date, product, value) rows, from the rollup when there is one"""
+    table = get_rollups(parquet_path)['tables'].get(GRAINS[grain][0])
+    if table is not None and measure in table['measures']:
+        return f"SELECT {grain} AS period, product, {measure} AS value FROM read_parquet({sql_literal(table['path'])})"
+    expr = profile_expressions(get_profile(parquet_path))
+    value = f"sum({expr['revenue']})" if measure == 'revenue' else f"sum({expr['quantity']})"
+    product = expr.get('product', 'NULL')
+    return (f"SELECT {expr['date']} AS period, {product} AS product, {value} AS value "
+            f"FROM {table_source(parquet_path)} GROUP BY ALL")
+
+
+def load_series(parquet_path, grain='month', measure='revenue', max_series=FORECAST_MAX_SERIES):
+    """
+    Sales per period as a matrix
+
+    Returns:
+        (names, first period index, matrix) with a row per series (the total first, then
+        products by sales) and a column per period, missing periods filled with zeros;
+        or None when the dataset has no dates or no such measure
+    """
+    expr = profile_expressions(get_profile(parquet_path))
+    if 'date' not in expr or (measure == 'revenue' and 'revenue' not in expr) or \
+            (measure == 'quantity' and 'quantity' not in expr):
+        return None
+    period = _period_index_sql(grain, 'period')
+    con = connect()
+    try:
+        con.execute(f"CREATE TEMP TABLE series AS SELECT {period} AS p, product, CAST(sum(value) AS DOUBLE) AS v "
+                    f"FROM ({_source_sql(parquet_path, grain, measure)}) WHERE period IS NOT NULL GROUP BY ALL")
+        totals = con.execute("SELECT p, sum(v) AS v FROM series GROUP BY p").fetchnumpy()
+        products = con.execute(
+            f"""
+            WITH ranked AS (
+                SELECT product, row_number() OVER (ORDER BY sum(v) DESC NULLS LAST, product) AS r
+                FROM series WHERE product IS NOT NULL GROUP BY product
+            )
+            SELECT ranked.product, r, p, v FROM series JOIN ranked USING (product) WHERE r <= {int(max_series)}
+            """
+        ).fetchnumpy()
+    finally:
+        con.close()
+    if not len(totals['p']):
+        return None
+
+    start = int(totals['p'].min())
+    periods = int(totals['p'].max()) - start + 1
+    count = int(products['r'].max()) if len(products['r']) else 0
+    matrix = np.zeros((count + 1, periods))
+    np.add.at(matrix[0], totals['p'].astype(np.int64) - start, np.nan_to_num(totals['v'].astype(float)))
+    names = [TOTAL_SERIES] + [None] * count
+    if count:
+        ranks = products['r'].astype(np.int64)
+        np.add.at(matrix, (ranks, products['p'].astype(np.int64) - start), np.nan_to_num(products['v'].astype(float)))
+        for rank, product in zip(ranks, products['product']):
+            names[rank] = str(product)
+    return names, start, matrix
+
+
+def _drop_partial_period(parquet_path, grain, start, matrix):
+    """Leave out a last month the data doesn't cover to its end, which would look like a slump"""
+    date_range = get_profile(parquet_path).get('date_range')
+    if grain != 'month' or not date_range or matrix.shape[1] < 2:
+        return matrix, False
+    year, month, day = map(int, str(date_range['end'])[:10].split('-'))
+    last = start + matrix.shape[1] - 1
+    if last == year * 12 + month - 1 and day < calendar.monthrange(year, month)[1]:
+        return matrix[:, :-1], True
+    return matrix, False
+
+
+# Models: each takes a (series, periods) matrix and a horizon and returns
+# (forecasts, one-step residual std, interval width multiplier per step), all batched over series
+
+def seasonal_naive(y, horizon, season):
+    season = season if y.shape[1] >= season else 1
+    steps = np.arange(horizon)
+    forecasts = y[:, y.shape[1] - season + steps % season]
+    residuals = y[:, season:] - y[:, :-season]
+    sigma = residuals.std(axis=1) if residuals.shape[1] else np.zeros(len(y))
+    return forecasts, sigma, np.sqrt(steps // season + 1)
+
+
+def linear_trend(y, horizon, season=None):
+    n = y.shape[1]
+    t = np.arange(n, dtype=float)
+    centered = t - t.mean()
+    spread = (centered ** 2).sum() or 1.0
+    slope = (y - y.mean(axis=1, keepdims=True)) @ centered / spread
+    intercept = y.mean(axis=1) - slope * t.mean()
+    future = np.arange(n, n + horizon, dtype=float)
+    forecasts = intercept[:, None] + slope[:, None] * future
+    residuals = y - (intercept[:, None] + slope[:, None] * t)
+    sigma = np.sqrt((residuals ** 2).sum(axis=1) / max(n - 2, 1))
+    return forecasts, sigma, np.sqrt(1 + 1 / n + (future - t.mean()) ** 2 / spread)
+
+
+def _holt_winters_pass(y, alpha, beta, gamma, season):
+    """One smoothing pass over every row (alpha, beta and gamma per row): the final state and one-step errors"""
+    rows, n = y.shape
+    if season > 1:
+        level = y[:, :season].mean(axis=1)
+        trend = (y[:, season:2 * season].mean(axis=1) - level) / season
+        seasonal = y[:, :season] - level[:, None]
+        first = 0
+    else:
+        level = y[:, 0].copy()
+        trend = y[:, 1] - y[:, 0]
+        seasonal = np.zeros((rows, 1))
+        first = 1
+    errors = np.zeros((rows, n))
+    for t in range(first, n):
+        s = seasonal[:, t % season]
+        errors[:, t] = y[:, t] - (level + trend + s)
+        new_level = alpha * (y[:, t] - s) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        seasonal[:, t % season] = gamma * (y[:, t] - new_level) + (1 - gamma) * s
+        level = new_level
+    # The first season only initializes the state
+    skip = season if season > 1 else first
+    return level, trend, seasonal, errors[:, skip:]
+
+
+def holt_winters(y, horizon, season):
+    rows, n = y.shape
+    season = season if n >= 2 * season else 1
+    gammas = HW_GAMMAS if season > 1 else (0.0,)
+    grid = np.array([(a, b, g) for a in HW_ALPHAS for b in HW_BETAS for g in gammas])
+    # Every parameter set for every series in one pass: row i * len(grid) + j is series i with grid[j]
+    stacked = np.repeat(y, len(grid), axis=0)
+    params = np.tile(grid, (rows, 1))
+    level, trend, seasonal, errors = _holt_winters_pass(stacked, params[:, 0], params[:, 1], params[:, 2], season)
+    best = (errors ** 2).sum(axis=1).reshape(rows, len(grid)).argmin(axis=1)
+    chosen = np.arange(rows) * len(grid) + best
+
+    steps = np.arange(1, horizon + 1)
+    forecasts = (level[chosen, None] + trend[chosen, None] * steps
+                 + seasonal[chosen][:, (n + steps - 1) % season])
+    sigma = errors[chosen].std(axis=1) if errors.shape[1] else np.zeros(rows)
+    alpha, beta, gamma = (params[chosen, i][:, None] for i in range(3))
+    # Variance of the h-step error of additive Holt-Winters: sigma^2 (1 + sum over j < h of c_j^2)
+    j = np.arange(1, horizon)
+    c = alpha * (1 + j * beta) + gamma * (j % season == 0)
+    widths = np.sqrt(1 + np.concatenate([np.zeros((rows, 1)), np.cumsum(c ** 2, axis=1)], axis=1))
+    return forecasts, sigma, widths
+
+
+MODEL_FUNCTIONS = {'seasonal_naive': seasonal_naive, 'holt_winters': holt_winters, 'linear_trend': linear_trend}
+
+
+def _eligible_models(n):
+    if n < 3:
+        return ['seasonal_naive']
+    return list(MODELS)
+
+
+def _error_metrics(actual, predicted):
+    """MAE, RMSE and MAPE (over non-zero actuals, None when there are none) per series"""
+    errors = actual - predicted
+    nonzero = actual != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ape = np.where(nonzero, np.abs(errors) / np.abs(actual), 0.0)
+        mape = ape.sum(axis=1) / nonzero.sum(axis=1)
+    return np.abs(errors).mean(axis=1), np.sqrt((errors ** 2).mean(axis=1)), mape
+
+
+def fit_forecasts(y, horizon, season, confidence=95):
+    """
+    Backtest every model on all series, keep the best per series and forecast with it
+
+    Returns:
+        dict: 'model' (name per series), 'forecast', 'lower' and 'upper' ((series, horizon)
+        arrays) and 'backtest' (model -> (mae, rmse, mape) arrays, with the holdout length)
+    """
+    rows, n = y.shape
+    models = _eligible_models(n)
+    holdout = min(horizon, max(1, n // 4)) if n >= 4 else 0
+    backtest = {}
+    if holdout:
+        train, actual = y[:, :n - holdout], y[:, n - holdout:]
+        for name in models:
+            predicted, _, _ = MODEL_FUNCTIONS[name](train, holdout, season)
+            backtest[name] = _error_metrics(actual, predicted)
+        scores = np.stack([backtest[name][0] for name in models], axis=1)
+        best = scores.argmin(axis=1)
+    else:
+        best = np.zeros(rows, dtype=int)
+
+    z = Z_SCORES[confidence]
+    forecast = np.zeros((rows, horizon))
+    lower, upper = np.zeros((rows, horizon)), np.zeros((rows, horizon))
+    for i, name in enumerate(models):
+        chosen = best == i
+        if not chosen.any():
+            continue
+        values, sigma, widths = MODEL_FUNCTIONS[name](y[chosen], horizon, season)
+        margin = z * sigma[:, None] * widths
+        forecast[chosen] = values
+        lower[chosen], upper[chosen] = values - margin, values + margin
+    # Sales don't go negative
+    return {
+        'model': [models[i] for i in best],
+        'forecast': np.maximum(forecast, 0),
+        'lower': np.maximum(lower, 0),
+        'upper': np.maximum(upper, 0),
+        'backtest': backtest,
+        'holdout': holdout,
+    }
+
+
+@lru_cache(maxsize=32)
+def get_forecasts(parquet_path, grain='month', measure='revenue', confidence=95):
+    """
+    Forecasts FORECAST_MAX_HORIZON periods ahead for the total and every product of a
+    materialized dataset, computed once per parquet file (the path includes the content
+    hash); describe_forecast gives the periods asked for
+
+    Returns:
+        dict: grain, measure, series names, history (periods, last actual period, whether a
+        partial last month was left out) and the fitted forecasts, or None without dates
+    """
+    loaded = load_series(parquet_path, grain, measure)
+    if loaded is None:
+        return None
+    names, start, matrix = loaded
+    matrix, dropped_partial = _drop_partial_period(parquet_path, grain, start, matrix)
+    fitted = fit_forecasts(matrix, FORECAST_MAX_HORIZON, GRAINS[grain][1], confidence)
+    last = start + matrix.shape[1] - 1
+    logger.info(f"Forecast {len(names)} {measure} series over {matrix.shape[1]} {grain}s for {parquet_path}")
+    return dict(fitted, grain=grain, measure=measure, confidence=confidence, names=names, periods=matrix.shape[1],
+                last_period=_period_label(grain, last),
+                future_periods=[_period_label(grain, last + step) for step in range(1, FORECAST_MAX_HORIZON + 1)],
+                dropped_partial_period=dropped_partial)
+
+
+def find_series(forecasts, product=None):
+    """Row of a product in forecasts (the total when product is empty), matching exactly first, else by substring"""
+    if not product:
+        return 0
+    wanted = product.strip().lower()
+    names = [name.lower() for name in forecasts['names']]
+    if wanted in names:
+        return names.index(wanted)
+    matches = [i for i, name in enumerate(names) if i and wanted in name]
+    return matches[0] if matches else None
+
+
+def _round(value):
+    return round(float(value), 2)
+
+
+def describe_forecast(forecasts, index, horizon):
+    """One series' forecast for its first horizon periods as plain data for the agent"""
+    model = forecasts['model'][index]
+    result = {
+        'series': forecasts['names'][index],
+        'measure': forecasts['measure'],
+        'grain': forecasts['grain'],
+        'history_periods': forecasts['periods'],
+        'last_actual_period': forecasts['last_period'],
+        'model': model,
+        'confidence': forecasts['confidence'],
+        'forecast': [
+            {'period': period, 'value': _round(forecasts['forecast'][index, step]),
+             'lower': _round(forecasts['lower'][index, step]), 'upper': _round(forecasts['upper'][index, step])}
+            for step, period in enumerate(forecasts['future_periods'][:horizon])
+        ],
+    }
+    if forecasts['backtest']:
+        result['backtest'] = {
+            'holdout_periods': forecasts['holdout'],
+            **{name: {'mae': _round(mae[index]), 'rmse': _round(rmse[index]),
+                      'mape': None if np.isnan(mape[index]) else round(float(mape[index]), 4)}
+               for name, (mae, rmse, mape) in forecasts['backtest'].items()},
+        }
+    if forecasts['dropped_partial_period']:
+        result['note'] = "The last month in the data is incomplete and was left out of the history"
+    return result
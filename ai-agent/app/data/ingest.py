@@ -0,0 +1,306 @@
+from app.data.columns import sql_literal
+from app.data.rollups import get_rollups, refresh_rollups
+from app.data.sample import get_sample
+from app.data.locks import file_lock
+from app.data.engine import DATA_DIR, connect, log_memory
+from app.data.sources import is_materialized, table_source
+from app.data.blob_store import blob_lock, fetch_blob, is_fresh
+from app.telemetry import span, count
+import duckdb
+import hashlib
+import threading
+import logging
+import json
+import time
+import os
+
+# Rows the CSV sniffer reads to infer column types (-1 reads the whole file, slow for multi-GB files)
+CSV_SAMPLE_SIZE = int(os.environ.get('CSV_SAMPLE_SIZE', '100000'))
+# How long the files of a replaced dataset version are kept: other worker processes can
+# still be answering from it until they next revalidate its source (see app.data.blob_store)
+DATASET_VERSION_GRACE_SECONDS = float(os.environ.get('DATASET_VERSION_GRACE_SECONDS', '3600'))
+RETIRED_SUFFIX = '.retired'
+
+logger = logging.getLogger("Ingest")
+
+# Datasets already materialized by this process, keyed by dataset key
+_datasets = {}
+_locks = {}
+_locks_guard = threading.Lock()
+# Callbacks run with the new dataset info and the previous version's path whenever the
+# content behind a dataset key changes, before the previous version is retired
+_change_listeners = []
+
+
+def add_change_listener(listener):
+    """Register listener(dataset, previous_path) to be called when a dataset is re-materialized with new content"""
+    _change_listeners.append(listener)
+
+
+def dataset_key(csv_url, file_id=None):
+    """Return the directory key for a dataset: the file ID, or a hash of the URL"""
+    if file_id:
+        return str(file_id)
+    return hashlib.sha1(csv_url.encode('utf-8')).hexdigest()
+
+
+def _dataset_lock(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _dataset_dir(key):
+    return os.path.join(DATA_DIR, 'datasets', key)
+
+
+def _read_manifest(key):
+    manifest_path = os.path.join(_dataset_dir(key), 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable manifest for dataset {key}: {e}")
+        return None
+
+
+def _write_manifest(key, manifest):
+    manifest_path = os.path.join(_dataset_dir(key), 'manifest.json')
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def parquet_row_count(parquet_path):
+    """Row count of a parquet file, read from its footer metadata"""
+    con = connect()
+    try:
+        return con.execute(f"SELECT count(*) FROM read_parquet({sql_literal(parquet_path)})").fetchone()[0]
+    finally:
+        con.close()
+
+
+def _copy_csv_to_parquet(con, csv_path, parquet_path, sample_size):
+    tmp_path = parquet_path + '.tmp'
+    # Rows stay in file order: incremental rollups rely on appended rows coming last
+    con.execute(
+        f"COPY (SELECT * FROM read_csv({sql_literal(csv_path)}, sample_size = {int(sample_size)})) "
+        f"TO {sql_literal(tmp_path)} (FORMAT PARQUET, COMPRESSION ZSTD)"
+    )
+    os.replace(tmp_path, parquet_path)
+
+
+def _csv_to_parquet(csv_path, parquet_path):
+    """
+    Type-infer a CSV with DuckDB and write it out as Parquet, returning the row count
+
+    The CSV is streamed through in chunks rather than loaded whole, so files larger than
+    memory convert within the connection's memory limit. Types are inferred from a
+    sample of CSV_SAMPLE_SIZE rows; if a later row doesn't fit them the conversion is
+    retried once with the whole file sampled.
+    """
+    con = connect()
+    try:
+        try:
+            _copy_csv_to_parquet(con, csv_path, parquet_path, CSV_SAMPLE_SIZE)
+        except (duckdb.ConversionException, duckdb.InvalidInputException) as e:
+            if CSV_SAMPLE_SIZE == -1:
+                raise
+            logger.warning(f"CSV types inferred from {CSV_SAMPLE_SIZE} rows did not fit the whole file, "
+                           f"sampling all rows: {str(e).splitlines()[0]}")
+            _copy_csv_to_parquet(con, csv_path, parquet_path, -1)
+        log_memory(con, f"Converted {os.path.basename(csv_path)} to parquet")
+    finally:
+        con.close()
+        if os.path.exists(parquet_path + '.tmp'):
+            os.remove(parquet_path + '.tmp')
+    return parquet_row_count(parquet_path)
+
+
+def open_dataset_connection(path, table='sales_data', sample=None):
+    """
+    Open a DuckDB connection with the dataset exposed as a view
+
+    Local parquet copies and collections of them are exposed directly, together with
+    their rollup tables (see app.data.rollups); a remote CSV URL is left for the agent
+    to load itself. Given the metadata of the dataset's sample (see app.data.sample),
+    the table is the sample instead, so approximate answers can't read the full data.
+    """
+    con = connect()
+    if is_materialized(path):
+        if sample and sample.get('path'):
+            source = f"read_parquet({sql_literal(sample['path'])})"
+        else:
+            source = table_source(path)
+        con.execute(f"CREATE VIEW {table} AS SELECT * FROM {source}")
+        try:
+            for name, rollup in get_rollups(path)['tables'].items():
+                con.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet({sql_literal(rollup['path'])})")
+        except Exception as e:
+            logger.warning(f"Could not expose rollups for {path}: {e}")
+    return con
+
+
+def notify_dataset_changed(dataset, previous_path):
+    """Run the change listeners for a dataset whose content has replaced the version at previous_path"""
+    for listener in _change_listeners:
+        try:
+            listener(dataset, previous_path)
+        except Exception as e:
+            logger.warning(f"Dataset change listener failed for {dataset['key']}: {e}")
+
+
+def remove_version_files(parquet_path):
+    """Remove a dataset version's parquet or collection file and the files derived from it (same prefix)"""
+    _remove_stem(os.path.dirname(parquet_path), os.path.splitext(os.path.basename(parquet_path))[0])
+
+
+def _remove_stem(directory, stem):
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.startswith(stem):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def _retired_marker(parquet_path):
+    return os.path.splitext(parquet_path)[0] + RETIRED_SUFFIX
+
+
+def retire_version(parquet_path):
+    """
+    Mark a replaced dataset version for removal
+
+    Other worker processes may still have agents and views over its files, and only this
+    process's change listeners have let go of it, so the files stay for
+    DATASET_VERSION_GRACE_SECONDS and are removed by a later prune_retired_versions.
+    Call with the dataset's lock held.
+    """
+    marker = _retired_marker(parquet_path)
+    with open(marker, 'a'):
+        pass
+    os.utime(marker)
+    prune_retired_versions(os.path.dirname(parquet_path))
+
+
+def restore_version(parquet_path):
+    """Keep a retired version that has become current again (the content went back to it)"""
+    try:
+        os.remove(_retired_marker(parquet_path))
+    except FileNotFoundError:
+        pass
+
+
+def prune_retired_versions(directory):
+    """Remove the versions in a dataset directory retired over DATASET_VERSION_GRACE_SECONDS ago (lock held)"""
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - DATASET_VERSION_GRACE_SECONDS
+    for name in os.listdir(directory):
+        if not name.endswith(RETIRED_SUFFIX):
+            continue
+        try:
+            retired_at = os.path.getmtime(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        if retired_at <= cutoff:
+            logger.info(f"Removing dataset version {name[:-len(RETIRED_SUFFIX)]} retired at {time.ctime(retired_at)}")
+            _remove_stem(directory, name[:-len(RETIRED_SUFFIX)])
+
+
+def materialize_dataset(csv_url, file_id=None):
+    """
+    Make a local Parquet copy of a CSV dataset, downloading it only the first time it is seen
+
+    Args:
+        csv_url (str): URL of the CSV file (usually an S3 object URL)
+        file_id (str, optional): Backend file ID, used as the dataset key when available
+
+    Returns:
+        dict: Dataset info with key, source_url, content_hash, row_count and the local parquet path
+    """
+    key = dataset_key(csv_url, file_id)
+
+    # The URL may serve new content at any time (re-uploads overwrite the S3 object), so
+    # it is trusted without asking only shortly after it was revalidated
+    dataset = _datasets.get(key)
+    if dataset and dataset['source_url'] == csv_url and os.path.exists(dataset['path']) and is_fresh(csv_url):
+        return dataset
+
+    # Concurrent requests for the same dataset wait for a single download, in this
+    # process and in any other worker sharing DATA_DIR
+    with _dataset_lock(key), file_lock(os.path.join(_dataset_dir(key), '.lock')):
+        return _materialize(csv_url, file_id, key)
+
+
+def _materialize(csv_url, file_id, key):
+    manifest = _read_manifest(key)
+    directory = _dataset_dir(key)
+    os.makedirs(directory, exist_ok=True)
+    prune_retired_versions(directory)
+
+    # A file that only gained rows starts with exactly the bytes of the previous version
+    previous = manifest if manifest and os.path.exists(manifest.get('path', '')) else None
+    prefix_length = previous['byte_count'] if previous and previous.get('ends_with_newline') else None
+
+    with blob_lock(csv_url):
+        with span('download'):
+            blob = fetch_blob(csv_url, prefix_length)
+        count('bytes_downloaded', blob['bytes_downloaded'])
+        content_hash = blob['sha256']
+        if previous and previous.get('source_url') == csv_url and previous['content_hash'] == content_hash:
+            logger.info(f"Using materialized dataset {key} ({content_hash[:12]})")
+            _datasets[key] = previous
+            return previous
+
+        logger.info(f"Materializing dataset {key} from {csv_url}")
+        parquet_path = os.path.join(directory, f'{content_hash}.parquet')
+        if os.path.exists(parquet_path):
+            restore_version(parquet_path)
+            row_count = parquet_row_count(parquet_path)
+        else:
+            row_count = _csv_to_parquet(blob['path'], parquet_path)
+    size, prefix_hash, ends_with_newline = blob['size'], blob['prefix_hash'], blob['ends_with_newline']
+
+    appended = bool(prefix_hash) and prefix_hash == previous['content_hash'] and row_count > previous['row_count']
+    try:
+        if appended:
+            refresh_rollups(parquet_path, previous)
+        else:
+            get_rollups(parquet_path)
+    except Exception as e:
+        logger.warning(f"Could not build rollups for dataset {key}: {e}")
+    try:
+        get_sample(parquet_path)
+    except Exception as e:
+        logger.warning(f"Could not sample dataset {key}: {e}")
+
+    previous_path = manifest.get('path') if manifest else None
+    manifest = {
+        'key': key,
+        'file_id': file_id,
+        'source_url': csv_url,
+        'content_hash': content_hash,
+        'byte_count': size,
+        'ends_with_newline': ends_with_newline,
+        'row_count': row_count,
+        'path': parquet_path,
+    }
+    _write_manifest(key, manifest)
+    _datasets[key] = manifest
+
+    # Retire the parquet of an older version of this dataset and anything derived from it,
+    # once this process's listeners have let go of it (pooled agents have views over those
+    # files); they are removed after the grace period, when other processes have moved on
+    if previous_path and previous_path != parquet_path:
+        notify_dataset_changed(manifest, previous_path)
+        retire_version(previous_path)
+
+    logger.info(f"Materialized dataset {key}: {row_count} rows, {size} bytes, hash {content_hash[:12]}")
+    return manifest
+
@@ -0,0 +1,256 @@
+from app.data.profiler import get_profile, profile_expressions
+from app.data.engine import connect
+from app.data.sources import table_source
+from functools import lru_cache
+import logging
+import re
+
+TOP_N = 5
+
+logger = logging.getLogger("KPI")
+
+
+def _growth(current, previous):
+    if current is None or not previous:
+        return None
+    return (current - previous) / previous
+
+
+def compute_kpis(con, profile, table='sales_data'):
+    """
+    Compute the "Sales Performance Metrics" and product rankings for a sales table
+
+    Args:
+        con: DuckDB connection that exposes the table
+        profile (dict): dataset profile with the column roles, see app.data.profiler
+        table (str): table or view to aggregate
+
+    Returns:
+        dict: totals, monthly series, month-over-month / year-over-year growth and
+        top/bottom products, or None when the table has no usable revenue column
+    """
+    expr = profile_expressions(profile)
+    if 'revenue' not in expr:
+        return None
+    revenue = expr['revenue']
+    quantity = f"sum({expr['quantity']})" if 'quantity' in expr else "NULL"
+
+    total_revenue, total_orders, total_quantity = con.execute(
+        f"SELECT sum({revenue}), {expr['orders']}, {quantity} FROM {table}"
+    ).fetchone()
+    kpis = {
+        'roles': profile['roles'],
+        'total_revenue': total_revenue,
+        'total_orders': total_orders,
+        'total_quantity': total_quantity,
+        'average_order_value': total_revenue / total_orders if total_orders else None,
+        'monthly': [],
+        'top_products_by_revenue': [],
+        'bottom_products_by_revenue': [],
+        'top_products_by_quantity': [],
+        'bottom_products_by_quantity': [],
+    }
+
+    if 'date' in expr:
+        rows = con.execute(
+            f"""
+            SELECT strftime(date_trunc('month', {expr['date']}), '%Y-%m') AS month,
+                   sum({revenue}) AS revenue,
+                   {expr['orders']} AS orders
+            FROM {table}
+            WHERE {expr['date']} IS NOT NULL
+            GROUP BY ALL
+            ORDER BY month
+            """
+        ).fetchall()
+        kpis['monthly'] = [{'month': month, 'revenue': rev, 'orders': orders} for month, rev, orders in rows]
+        if kpis['monthly']:
+            by_month = {row['month']: row['revenue'] for row in kpis['monthly']}
+            latest = kpis['monthly'][-1]
+            year, month = map(int, latest['month'].split('-'))
+            previous_month = f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+            kpis['latest_month'] = latest['month']
+            kpis['latest_month_revenue'] = latest['revenue']
+            kpis['mom_growth'] = _growth(latest['revenue'], by_month.get(previous_month))
+            kpis['yoy_growth'] = _growth(latest['revenue'], by_month.get(f"{year - 1}-{month:02d}"))
+
+    if 'product' in expr:
+        quantity_sum = f"sum({expr['quantity']})" if 'quantity' in expr else "count(*)"
+        rows = con.execute(
+            f"""
+            WITH products AS (
+                SELECT {expr['product']} AS product, sum({revenue}) AS revenue, {quantity_sum} AS quantity
+                FROM {table}
+                GROUP BY ALL
+            ), ranked AS (
+                SELECT *,
+                       row_number() OVER (ORDER BY revenue DESC NULLS LAST) AS revenue_top,
+                       row_number() OVER (ORDER BY revenue ASC NULLS LAST) AS revenue_bottom,
+                       row_number() OVER (ORDER BY quantity DESC NULLS LAST) AS quantity_top,
+                       row_number() OVER (ORDER BY quantity ASC NULLS LAST) AS quantity_bottom
+                FROM products
+            )
+            SELECT product, revenue, quantity, revenue_top, revenue_bottom, quantity_top, quantity_bottom
+            FROM ranked
+            WHERE least(revenue_top, revenue_bottom, quantity_top, quantity_bottom) <= {TOP_N}
+            """
+        ).fetchall()
+        for product, rev, qty, revenue_top, revenue_bottom, quantity_top, quantity_bottom in rows:
+            entry = {'product': product, 'revenue': rev, 'quantity': qty}
+            for key, rank in (('top_products_by_revenue', revenue_top), ('bottom_products_by_revenue', revenue_bottom),
+                              ('top_products_by_quantity', quantity_top), ('bottom_products_by_quantity', quantity_bottom)):
+                if rank <= TOP_N:
+                    kpis[key].append((rank, entry))
+        for key in ('top_products_by_revenue', 'bottom_products_by_revenue',
+                    'top_products_by_quantity', 'bottom_products_by_quantity'):
+            kpis[key] = [entry for _, entry in sorted(kpis[key], key=lambda item: item[0])]
+
+    return kpis
+
+
+@lru_cache(maxsize=32)
+def get_dataset_kpis(parquet_path):
+    """KPIs for a materialized dataset, computed once per parquet file (the path includes the content hash)"""
+    con = connect()
+    try:
+        con.execute(f"CREATE VIEW sales_data AS SELECT * FROM {table_source(parquet_path)}")
+        kpis = compute_kpis(con, get_profile(parquet_path))
+        if kpis is None:
+            logger.info(f"No revenue column found in {parquet_path}, skipping KPIs")
+        return kpis
+    finally:
+        con.close()
+
+
+def format_currency(value):
+    return "n/a" if value is None else f"${value:,.2f}"
+
+
+def format_percent(value):
+    return "n/a" if value is None else f"{value * 100:+.1f}%"
+
+
+def format_number(value):
+    if value is None:
+        return "n/a"
+    return f"{value:,.0f}" if float(value).is_integer() else f"{value:,.2f}"
+
+
+def _product_table(entries):
+    lines = ["| Rank | Product | Revenue | Quantity |", "|---|---|---|---|"]
+    for rank, entry in enumerate(entries, 1):
+        lines.append(f"| {rank} | {entry['product']} | {format_currency(entry['revenue'])} | {format_number(entry['quantity'])} |")
+    return "\n".join(lines)
+
+
+# Questions the engine can answer on its own, mapped to the report sections that answer them
+KPI_QUESTION_PATTERNS = [
+    (re.compile(r'\b(total|overall)\s+(sales\s+)?(revenue|sales)\b'), 'totals'),
+    (re.compile(r'\b(how many|number of|total|count of)\s+(orders|sales|transactions|invoices)\b'), 'totals'),
+    (re.compile(r'\b(average order value|aov)\b'), 'totals'),
+    (re.compile(r'\b(growth|month[- ]over[- ]month|year[- ]over[- ]year|mom|yoy)\b'), 'growth'),
+    (re.compile(r'\b(top|best)\b.*\b(products?|items?|sellers?|selling)\b'), 'top_products'),
+    (re.compile(r'\b(bottom|worst|least)\b.*\b(products?|items?|sellers?|selling)\b'), 'bottom_products'),
+]
+
+# Words a question may consist of and still be answered from whole-dataset KPIs. Any
+# other word (a filter like "for", "in" or "from", a grouping like "by store", a period,
+# a product or store name, another metric like profit) changes what is asked, so the
+# agent answers it instead
+KPI_QUESTION_WORDS = frozenset("""
+    a all an and are can could date did do does ever far give have how is list me much many my of
+    our overall please show so tell the to total us was we were what whats which you
+    aov average count growth invoices mom month number order orders over rate revenue sales
+    transactions value year yoy
+    best bottom item items least performing product products seller sellers selling top worst
+""".split())
+
+# The rankings are by revenue and by quantity, so a question may say which of the two it means
+RANKING_METRIC_PATTERN = re.compile(r'\bby (revenue|sales|quantity|units|volume)\b')
+
+
+def _matched_sections(text):
+    sections = []
+    for pattern, section in KPI_QUESTION_PATTERNS:
+        if pattern.search(text) and section not in sections:
+            sections.append(section)
+    return sections
+
+
+def unrecognized_words(question):
+    """Words of a question that fall outside KPI_QUESTION_WORDS (a ranking size other than TOP_N included)"""
+    text = RANKING_METRIC_PATTERN.sub(' ', question.lower().replace("'", ''))
+    return [word for word in re.findall(r'[a-z0-9]+', text)
+            if word not in KPI_QUESTION_WORDS and word != str(TOP_N)]
+
+
+def kpi_sections_for_question(question):
+    """Return the KPI sections a question asks for, or an empty list if the engine can't answer it alone"""
+    if unrecognized_words(question):
+        return []
+    return _matched_sections(question.lower())
+
+
+def mentions_kpis(question):
+    """Whether a question asks about one of the KPIs, even if qualified in a way the engine can't answer"""
+    return bool(_matched_sections(question.lower()))
+
+
+def format_kpis(kpis, sections=('totals', 'growth', 'top_products', 'bottom_products')):
+    """Render the requested KPI sections as markdown"""
+    parts = []
+    if 'totals' in sections:
+        parts.append(
+            "**Total Sales Revenue**: {}\n- Total Number of Sales: {}\n- **Average Order Value**: {}".format(
+                format_currency(kpis['total_revenue']),
+                format_number(kpis['total_orders']),
+                format_currency(kpis['average_order_value']),
+            )
+        )
+        if kpis['total_quantity'] is not None:
+            parts[-1] += f"\n- Units Sold: {format_number(kpis['total_quantity'])}"
+    if 'growth' in sections and kpis.get('latest_month'):
+        parts.append(
+            f"**Sales Growth Rate** ({kpis['latest_month']}, revenue {format_currency(kpis['latest_month_revenue'])}):\n"
+            f"- Month-over-month: {format_percent(kpis['mom_growth'])}\n"
+            f"- Year-over-year: {format_percent(kpis['yoy_growth'])}"
+        )
+    if 'top_products' in sections and kpis['top_products_by_revenue']:
+        parts.append(f"**Top {TOP_N} Products by Revenue**\n\n" + _product_table(kpis['top_products_by_revenue']))
+        if kpis['total_quantity'] is not None:
+            parts.append(f"**Top {TOP_N} Products by Quantity**\n\n" + _product_table(kpis['top_products_by_quantity']))
+    if 'bottom_products' in sections and kpis['bottom_products_by_revenue']:
+        parts.append(f"**Bottom {TOP_N} Products by Revenue**\n\n" + _product_table(kpis['bottom_products_by_revenue']))
+        if kpis['total_quantity'] is not None:
+            parts.append(f"**Bottom {TOP_N} Products by Quantity**\n\n" + _product_table(kpis['bottom_products_by_quantity']))
+    return "\n\n".join(parts)
+
+
+def answer_kpi_question(question, kpis):
+    """Answer a plain metric question straight from the KPIs, or return None to let the agent handle it"""
+    if not kpis:
+        return None
+    sections = kpi_sections_for_question(question)
+    if not sections:
+        return None
+    answer = format_kpis(kpis, sections)
+    return answer or None
+
+
+REPORT_PATTERN = re.compile(r'\b(report|summary|overview|performance|kpis?|metrics)\b')
+
+
+def wants_kpi_context(question):
+    """
+    Whether the analyst should get the precomputed KPIs: for broad questions, and for
+    metric questions the engine couldn't answer alone (filtered, grouped or for a period)
+    """
+    return bool(REPORT_PATTERN.search(question.lower())) or mentions_kpis(question)
+
+
+def kpi_context(kpis):
+    """Precomputed metrics to hand to the analyst so it narrates them instead of recomputing"""
+    return (
+        "Precomputed metrics for the whole dataset (exact, use these numbers instead of recalculating them):\n\n"
+        + format_kpis(kpis)
+    )
@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on path (created if needed) for the duration of the block
+
+    Serializes work across processes, e.g. several API workers materializing the same
+    dataset; threads within a process should still use their own lock first.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            # LK_LOCK retries for ~10s before raising, so keep retrying until the holder is done
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,132 @@
+from app.data.columns import detect_column_roles, role_expressions, quote_identifier
+from app.data.locks import file_lock
+from app.data.engine import connect
+from app.data.sources import table_source
+import threading
+import logging
+import json
+import os
+
+logger = logging.getLogger("Profiler")
+
+# Profiles already loaded by this process, keyed by parquet path (which includes the content hash)
+_profiles = {}
+_lock = threading.Lock()
+
+
+def describe_parquet(con, path):
+    """Return (name, type) pairs for the columns of a parquet file or collection"""
+    return [(row[0], row[1]) for row in con.execute(f"DESCRIBE SELECT * FROM {table_source(path)}").fetchall()]
+
+
+def _profile_path(parquet_path):
+    return os.path.splitext(parquet_path)[0] + '.profile.json'
+
+
+def _json_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def build_profile(parquet_path):
+    """
+    Profile a materialized dataset in a couple of scans
+
+    Returns:
+        dict: row count, every column's type, role, approximate distinct count and null
+        count, the detected column roles and the date range covered by the data
+    """
+    con = connect()
+    try:
+        source = table_source(parquet_path)
+        columns = describe_parquet(con, parquet_path)
+        roles = detect_column_roles(columns)
+
+        stats = []
+        for name, _ in columns:
+            column = quote_identifier(name)
+            stats += [f"approx_count_distinct({column})", f"count(*) - count({column})"]
+        expressions = role_expressions(roles, dict(columns))
+        date_range = []
+        if 'date' in expressions:
+            date_range = [f"min({expressions['date']})", f"max({expressions['date']})"]
+
+        row = con.execute(f"SELECT count(*), {', '.join(stats + date_range)} FROM {source}").fetchone()
+    finally:
+        con.close()
+
+    column_roles = {column: role for role, column in roles.items()}
+    profile = {
+        'row_count': row[0],
+        'columns': [
+            {
+                'name': name,
+                'type': column_type,
+                'role': column_roles.get(name),
+                # HyperLogLog estimates can overshoot on small columns
+                'distinct_values': min(row[1 + 2 * i], row[0] - row[2 + 2 * i]),
+                'null_count': row[2 + 2 * i],
+            }
+            for i, (name, column_type) in enumerate(columns)
+        ],
+        'roles': roles,
+        'date_range': None,
+    }
+    if date_range:
+        start, end = row[-2], row[-1]
+        profile['date_range'] = {'start': _json_value(start), 'end': _json_value(end)} if start else None
+    return profile
+
+
+def get_profile(parquet_path):
+    """Return the cached profile of a materialized dataset, building and persisting it the first time"""
+    profile = _profiles.get(parquet_path)
+    if profile is not None:
+        return profile
+
+    profile_path = _profile_path(parquet_path)
+    with _lock, file_lock(profile_path + '.lock'):
+        profile = _profiles.get(parquet_path)
+        if profile is not None:
+            return profile
+
+        if os.path.exists(profile_path):
+            try:
+                with open(profile_path) as f:
+                    profile = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Rebuilding unreadable profile {profile_path}: {e}")
+
+        if profile is None:
+            profile = build_profile(parquet_path)
+            tmp_path = profile_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(profile, f)
+            os.replace(tmp_path, profile_path)
+            logger.info(f"Profiled {parquet_path}: {profile['row_count']} rows, roles {profile['roles']}")
+
+        _profiles[parquet_path] = profile
+        return profile
+
+
+def profile_expressions(profile):
+    """SQL expressions for the column roles found in a profile, see app.data.columns.role_expressions"""
+    return role_expressions(profile['roles'], {column['name']: column['type'] for column in profile['columns']})
+
+
+def describe_for_semantic_model(profile):
+    """Table details for the agent's semantic model, so it can skip schema discovery"""
+    details = {
+        'row_count': profile['row_count'],
+        'columns': [
+            {key: value for key, value in (
+                ('name', column['name']),
+                ('type', column['type']),
+                ('role', column['role']),
+                ('distinct_values', column['distinct_values']),
+            ) if value is not None}
+            for column in profile['columns']
+        ],
+    }
+    if profile.get('date_range'):
+        details['date_range'] = profile['date_range']
+    return details
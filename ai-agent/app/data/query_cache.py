@@ -0,0 +1,172 @@
+"""
+Memoized results of the agent's DuckDB queries
+
+The analyst agent re-runs the same aggregates (total revenue, monthly sums, top
+products) for question after question about a file. Results are kept as Arrow
+tables in an LRU bounded by bytes, keyed by a scope (the dataset and the views of
+the connection that ran the query, see SalesDuckDbTools) and the query with
+comments, whitespace and case outside quotes normalized, so only the first of those
+queries reaches DuckDB.
+
+Only the first QUERY_RESULT_MAX_ROWS rows of a result are fetched, kept and written
+into the prompt; the rest is streamed past and counted, and summarized in one line
+telling the agent to aggregate.
+"""
+from collections import OrderedDict
+import threading
+import re
+import os
+
+QUERY_CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Rows of a result the agent gets to see
+QUERY_RESULT_MAX_ROWS = int(os.environ.get('QUERY_RESULT_MAX_ROWS', '100'))
+# Rows read from DuckDB at a time while fetching a result
+FETCH_BATCH_ROWS = 8192
+
+# String literals and quoted identifiers (kept as they are), comments, whitespace, statement ends
+_SQL_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|(--[^\n]*|/\*.*?\*/)|(\s+)|(;)""", re.DOTALL)
+# Statements that only read, and so can be answered from an earlier run
+_READ_ONLY = re.compile(r'^\(*\s*(select|with|from|values|table|describe|summarize|show|explain|pivot|unpivot)\b')
+# Functions whose value changes between runs of the same query
+_VOLATILE = re.compile(r'\b(random|uuid|gen_random_uuid|now|current_date|current_time|current_timestamp|today|nextval)\b')
+
+
+def normalize_query(query):
+    """
+    The first statement of a query with comments dropped and whitespace collapsed
+    (backticks are dropped too, as the DuckDB tools do), and its cache key: the same
+    statement lower-cased outside quotes
+
+    Returns:
+        (statement, key)
+    """
+    statement, key = [], []
+    position = 0
+    text = query.replace('`', '')
+    for match in _SQL_TOKENS.finditer(text):
+        statement.append(text[position:match.start()])
+        key.append(text[position:match.start()].lower())
+        position = match.end()
+        quoted, comment, space, end = match.groups()
+        if end:
+            return _join(statement), _join(key)
+        statement.append(quoted or ' ')
+        key.append(quoted or ' ')
+    statement.append(text[position:])
+    key.append(text[position:].lower())
+    return _join(statement), _join(key)
+
+
+def _join(parts):
+    return re.sub(r' +', ' ', ''.join(parts)).strip()
+
+
+def is_cacheable(key):
+    """Whether a statement (by its cache key) only reads and gives the same result every time"""
+    return bool(_READ_ONLY.match(key)) and not _VOLATILE.search(key)
+
+
+def fetch_result(relation, max_rows=QUERY_RESULT_MAX_ROWS):
+    """
+    The first max_rows rows of a DuckDB relation as an Arrow table, and how many rows
+    it has in all; the rows after them are counted as they stream past, never held
+
+    Returns:
+        (table, total rows)
+    """
+    import pyarrow
+
+    reader = relation.fetch_arrow_reader(FETCH_BATCH_ROWS)
+    batches, kept, total = [], 0, 0
+    for batch in reader:
+        total += batch.num_rows
+        if kept < max_rows:
+            batches.append(batch.slice(0, max_rows - kept))
+            kept += batches[-1].num_rows
+    return pyarrow.Table.from_batches(batches, schema=reader.schema), total
+
+
+def format_result(table, total_rows=None, max_rows=QUERY_RESULT_MAX_ROWS):
+    """
+    Arrow table as the text the DuckDB tools give the agent (a header line of column
+    names, then comma separated rows), cut at max_rows; total_rows is the size of the
+    whole result when the table holds only its first rows
+
+    Returns:
+        (text, number of rows left out)
+    """
+    total_rows = table.num_rows if total_rows is None else total_rows
+    shown = table.slice(0, max_rows)
+    columns = [column.to_pylist() for column in shown.columns]
+    lines = [','.join(table.column_names)]
+    for row in zip(*columns):
+        lines.append(str(row[0]) if len(row) == 1 else ','.join(str(value) for value in row))
+    left_out = max(total_rows - max_rows, 0)
+    if left_out:
+        lines.append(f"... {left_out} more rows not shown ({total_rows} in total); "
+                     f"aggregate further or add a LIMIT to see the rows that matter")
+    return '\n'.join(lines), left_out
+
+
+class QueryCache:
+    """LRU of query results (Arrow tables of their first rows) bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (scope, key) -> (table, total rows, seconds the query took)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self.rows_truncated = 0
+
+    def get(self, scope, key):
+        """(Arrow table, total rows, seconds it took to compute) for a cached query, else None"""
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((scope, key))
+            self.hits += 1
+            self.seconds_saved += entry[2]
+            return entry
+
+    def put(self, scope, key, table, total_rows, seconds):
+        # A result that would push out a quarter of the cache isn't worth keeping
+        size = table.nbytes
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            previous = self._entries.pop((scope, key), None)
+            if previous is not None:
+                self._bytes -= previous[0].nbytes
+            self._entries[(scope, key)] = (table, total_rows, seconds)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def record_truncated(self, rows):
+        with self._lock:
+            self.rows_truncated += rows
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'seconds_saved': round(self.seconds_saved, 3),
+                'rows_truncated': self.rows_truncated,
+            }
+
+
+query_cache = QueryCache()
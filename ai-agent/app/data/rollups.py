@@ -0,0 +1,231 @@
+from app.data.profiler import get_profile, profile_expressions
+from app.data.columns import sql_literal
+from app.data.locks import file_lock
+from app.data.engine import connect, log_memory
+from app.data.sources import is_collection, read_collection, table_source
+import threading
+import logging
+import json
+import os
+
+logger = logging.getLogger("Rollups")
+
+# Pre-aggregated tables built at ingest: name -> (dimensions, description)
+ROLLUPS = {
+    'sales_by_day_product': (('day', 'product'), "Daily sales totals per product"),
+    'sales_by_month_product': (('month', 'product'), "Monthly sales totals per product"),
+    'sales_by_month_region': (('month', 'region'), "Monthly sales totals per region"),
+    'sales_by_month_customer': (('month', 'customer'), "Monthly sales totals per customer"),
+}
+
+MEASURE_DESCRIPTION = (
+    "revenue = summed sales amount, order_count = distinct orders, "
+    "line_count = sales_data rows, quantity = units sold"
+)
+
+COUNT_MEASURES = ('order_count', 'line_count')
+
+# Rollups already loaded by this process, keyed by parquet path (which includes the content hash)
+_rollups = {}
+# Reentrant: a collection's rollups are merged from its partitions' rollups, loaded under the same lock
+_lock = threading.RLock()
+
+
+def _rollups_path(parquet_path):
+    return os.path.splitext(parquet_path)[0] + '.rollups.json'
+
+
+def _table_path(parquet_path, name):
+    return os.path.splitext(parquet_path)[0] + f'.{name}.parquet'
+
+
+def _dimension_expressions(expr):
+    dimensions = {}
+    if 'date' in expr:
+        dimensions['day'] = expr['date']
+        dimensions['month'] = f"CAST(date_trunc('month', {expr['date']}) AS DATE)"
+    for role in ('product', 'region', 'customer'):
+        if role in expr:
+            dimensions[role] = expr[role]
+    return dimensions
+
+
+def _aggregate_sql(source, expr, dimensions, where=''):
+    """SELECT that aggregates raw sales rows from source into one rollup's grain"""
+    columns = [f"{dimensions[name]} AS {name}" for name in dimensions]
+    columns += [
+        f"sum({expr['revenue']}) AS revenue",
+        f"{expr['orders']} AS order_count",
+        "count(*) AS line_count",
+    ]
+    if 'quantity' in expr:
+        columns.append(f"sum({expr['quantity']}) AS quantity")
+    return f"SELECT {', '.join(columns)} FROM {source} {where} GROUP BY ALL"
+
+
+def _merge_sql(sources, measures):
+    """SELECT that re-aggregates several already aggregated sources of the same rollup into one"""
+    # Summed counts are HUGEINT, which Parquet would store as DOUBLE
+    sums = ', '.join(
+        f"CAST(sum({measure}) AS BIGINT) AS {measure}" if measure in COUNT_MEASURES else f"sum({measure}) AS {measure}"
+        for measure in measures
+    )
+    dimensions = "* EXCLUDE (" + ', '.join(measures) + ")"
+    return (
+        f"SELECT {dimensions}, {sums} FROM ("
+        + ' UNION ALL BY NAME '.join(f"({source})" for source in sources)
+        + ") GROUP BY ALL"
+    )
+
+
+def _rollup_table_sql(table):
+    return f"SELECT * FROM read_parquet({sql_literal(table['path'])})"
+
+
+def _partition_rollups(collection_path, expr):
+    """Rollups of every partition of a collection, or None if any was built from different column roles"""
+    partitions = [get_rollups(partition['path']) for partition in read_collection(collection_path)['partitions']]
+    if any(partition.get('expressions') != expr for partition in partitions):
+        return None
+    return partitions
+
+
+def _write_table(con, select_sql, path):
+    tmp_path = path + '.tmp'
+    con.execute(f"COPY ({select_sql}) TO {sql_literal(tmp_path)} (FORMAT PARQUET, COMPRESSION ZSTD)")
+    os.replace(tmp_path, path)
+    return con.execute(f"SELECT count(*) FROM read_parquet({sql_literal(path)})").fetchone()[0]
+
+
+def build_rollups(parquet_path, previous=None):
+    """
+    Build the rollup tables for a materialized dataset
+
+    Args:
+        parquet_path (str): Local parquet copy of the sales data, or a collection of them. A
+            collection's rollups are merged from its partitions' rollups when they all use
+            the same column roles.
+        previous (dict, optional): 'path' and 'row_count' of an earlier version of the dataset
+            that the new one extends by appending rows. When its rollups were built from the
+            same column roles, only the appended rows are aggregated and merged into them.
+
+    Returns:
+        dict: the expressions the rollups were built from and, per table, its path,
+        dimensions, measures and row count
+    """
+    expr = profile_expressions(get_profile(parquet_path))
+    metadata = {'expressions': expr, 'tables': {}}
+    if 'revenue' not in expr:
+        return metadata
+    dimensions = _dimension_expressions(expr)
+    measures = ['revenue', 'order_count', 'line_count'] + (['quantity'] if 'quantity' in expr else [])
+
+    base = _load(previous['path']) if previous else None
+    if base is not None and base.get('expressions') != expr:
+        base = None
+    partitions = _partition_rollups(parquet_path, expr) if is_collection(parquet_path) else None
+
+    con = connect()
+    try:
+        for name, (grain, description) in ROLLUPS.items():
+            if not all(dimension in dimensions for dimension in grain):
+                continue
+            grain_expressions = {dimension: dimensions[dimension] for dimension in grain}
+            if base is not None and name in base['tables']:
+                # Aggregate only the appended rows and fold them into the previous rollup
+                delta_sql = _aggregate_sql(
+                    f"read_parquet({sql_literal(parquet_path)}, file_row_number = true)", expr, grain_expressions,
+                    f"WHERE file_row_number >= {int(previous['row_count'])}",
+                )
+                select_sql = _merge_sql([_rollup_table_sql(base['tables'][name]), delta_sql], measures)
+            elif partitions and all(name in partition['tables'] for partition in partitions):
+                select_sql = _merge_sql([_rollup_table_sql(partition['tables'][name]) for partition in partitions],
+                                        measures)
+            else:
+                select_sql = _aggregate_sql(table_source(parquet_path), expr, grain_expressions)
+            path = _table_path(parquet_path, name)
+            metadata['tables'][name] = {
+                'path': path,
+                'description': description,
+                'dimensions': list(grain),
+                'measures': measures,
+                'row_count': _write_table(con, select_sql, path),
+            }
+        log_memory(con, f"Built rollups for {os.path.basename(parquet_path)}")
+    finally:
+        con.close()
+    return metadata
+
+
+def _store(parquet_path, metadata):
+    rollups_path = _rollups_path(parquet_path)
+    tmp_path = rollups_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, rollups_path)
+    _rollups[parquet_path] = metadata
+
+
+def _load(parquet_path):
+    """Read persisted rollup metadata, or None when it is missing, unreadable or its tables are gone"""
+    rollups_path = _rollups_path(parquet_path)
+    if not os.path.exists(rollups_path):
+        return None
+    try:
+        with open(rollups_path) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Rebuilding unreadable rollups {rollups_path}: {e}")
+        return None
+    if not all(os.path.exists(table['path']) for table in metadata['tables'].values()):
+        return None
+    return metadata
+
+
+def get_rollups(parquet_path):
+    """Return the rollup metadata of a materialized dataset, building the rollups the first time"""
+    metadata = _rollups.get(parquet_path)
+    if metadata is not None:
+        return metadata
+
+    with _lock, file_lock(_rollups_path(parquet_path) + '.lock'):
+        metadata = _rollups.get(parquet_path)
+        if metadata is not None:
+            return metadata
+
+        metadata = _load(parquet_path)
+        if metadata is None:
+            metadata = build_rollups(parquet_path)
+            _store(parquet_path, metadata)
+            logger.info(f"Built rollups for {parquet_path}: {sorted(metadata['tables'])}")
+        else:
+            _rollups[parquet_path] = metadata
+        return metadata
+
+
+def refresh_rollups(parquet_path, previous):
+    """
+    Build the rollups of a dataset version that appended rows to previous
+
+    Sums, line counts and quantities merge exactly. Distinct order counts are summed
+    too, so an order whose lines straddle the append point is counted once per side.
+    """
+    metadata = build_rollups(parquet_path, previous)
+    _store(parquet_path, metadata)
+    logger.info(f"Refreshed rollups for {parquet_path} from rows {previous['row_count']} onwards")
+    return metadata
+
+
+def describe_rollups_for_semantic_model(metadata):
+    """Semantic model entries for the rollup tables of a dataset"""
+    return [
+        {
+            'name': name,
+            'description': f"{table['description']}, pre-aggregated from sales_data ({MEASURE_DESCRIPTION})",
+            'path': table['path'],
+            'row_count': table['row_count'],
+            'dimensions': table['dimensions'],
+            'measures': table['measures'],
+        }
+        for name, table in metadata['tables'].items()
+    ]
@@ -0,0 +1,220 @@
+"""
+Stratified samples for approximate answers
+
+For datasets of at least SAMPLE_MIN_ROWS rows, ingest also writes a sample of about
+SAMPLE_FRACTION of the rows, stratified by month and product: every (month, product)
+stratum keeps its share of rows, and at least SAMPLE_MIN_PER_STRATUM of them (all of a
+smaller one), so small products and quiet months aren't lost. Rows are drawn by a hash
+of their values, in one pass without sorting, so the same data always gives the same
+sample. Each sampled row carries _sample_weight, its stratum's rows divided by the rows
+drawn from it: sum(x * _sample_weight) estimates the total of x, sum(_sample_weight) is
+the row count.
+
+The standard error of estimated total revenue comes from the variance within each
+stratum, giving the confidence interval approximate answers state. Distinct counts
+(customers, products, orders) can't be scaled up from a sample; they are taken from the
+profile's HyperLogLog estimates over the whole dataset instead.
+"""
+from app.data.profiler import get_profile, profile_expressions
+from app.data.columns import sql_literal
+from app.data.locks import file_lock
+from app.data.engine import connect, log_memory
+from app.data.sources import table_source
+import threading
+import logging
+import json
+import math
+import os
+
+SAMPLE_MIN_ROWS = int(os.environ.get('SAMPLE_MIN_ROWS', '1000000'))
+SAMPLE_FRACTION = float(os.environ.get('SAMPLE_FRACTION', '0.02'))
+SAMPLE_MIN_PER_STRATUM = int(os.environ.get('SAMPLE_MIN_PER_STRATUM', '30'))
+# Two-sided 95% confidence
+CONFIDENCE_Z = 1.96
+
+# Rows are drawn where hash(row) % DRAW_SCALE < stratum share * DRAW_SCALE; the row's hash is
+# hashed again, as its low bits follow the values of single columns too closely
+DRAW_SCALE = 1000000
+
+logger = logging.getLogger("Sample")
+
+# Samples already loaded by this process, keyed by parquet path (which includes the content hash)
+_samples = {}
+_lock = threading.Lock()
+
+
+def _sample_path(parquet_path):
+    return os.path.splitext(parquet_path)[0] + '.sample.parquet'
+
+
+def _metadata_path(parquet_path):
+    return os.path.splitext(parquet_path)[0] + '.sample.json'
+
+
+def _strata_expressions(expr):
+    strata = []
+    if 'date' in expr:
+        strata.append(f"CAST(date_trunc('month', {expr['date']}) AS DATE)")
+    if 'product' in expr:
+        strata.append(expr['product'])
+    return strata or ['NULL']
+
+
+def _estimated_distinct(profile):
+    """HyperLogLog distinct counts over the whole dataset for the customer, product and order columns"""
+    counts = {}
+    for column in profile['columns']:
+        name = {'customer': 'customers', 'product': 'products', 'order_id': 'orders'}.get(column['role'])
+        if name and column.get('distinct_values') is not None:
+            counts[name] = column['distinct_values']
+    return counts
+
+
+def build_sample(parquet_path):
+    """
+    Write the stratified sample of a materialized dataset
+
+    Returns:
+        dict: the sample's path (None when the dataset is too small to need one), row
+        counts, the fraction sampled, the estimated total revenue with its standard
+        error and relative 95% margin, and estimated distinct counts
+    """
+    profile = get_profile(parquet_path)
+    expr = profile_expressions(profile)
+    if profile['row_count'] < SAMPLE_MIN_ROWS or 'revenue' not in expr:
+        return {'path': None, 'source_rows': profile['row_count']}
+
+    strata = _strata_expressions(expr)
+    keys = [f"_stratum_{i}" for i in range(len(strata))]
+    matches = ' AND '.join(f"source.{key} IS NOT DISTINCT FROM strata.{key}" for key in keys)
+    path = _sample_path(parquet_path)
+    tmp_path = path + '.tmp'
+    con = connect()
+    try:
+        con.execute(
+            f"""
+            COPY (
+                WITH source AS (
+                    SELECT src.*, {', '.join(f'{sql} AS {key}' for sql, key in zip(strata, keys))},
+                           hash(hash(src)) % {DRAW_SCALE} AS _draw
+                    FROM {table_source(parquet_path)} src
+                ),
+                strata AS (
+                    SELECT {', '.join(keys)}, count(*) AS _rows,
+                           least(1.0, greatest(count(*) * {SAMPLE_FRACTION}, {SAMPLE_MIN_PER_STRATUM}) / count(*)) AS _share
+                    FROM source GROUP BY ALL
+                ),
+                drawn AS (
+                    SELECT source.*, strata._rows
+                    FROM source JOIN strata ON {matches}
+                    WHERE source._draw < strata._share * {DRAW_SCALE}
+                )
+                SELECT * EXCLUDE ({', '.join(keys)}, _draw, _rows),
+                       _rows / count(*) OVER (PARTITION BY {', '.join(keys)}) AS _sample_weight
+                FROM drawn
+            ) TO {sql_literal(tmp_path)} (FORMAT PARQUET, COMPRESSION ZSTD)
+            """
+        )
+        os.replace(tmp_path, path)
+        # Stratified estimate of total revenue and its variance, sum of N^2 (1 - n/N) s^2 / n over strata
+        sample_rows, source_rows, strata_count, revenue, variance = con.execute(
+            f"""
+            WITH stratum AS (
+                SELECT count(*) AS n, sum(_sample_weight) AS size,
+                       sum(revenue * _sample_weight) AS total, coalesce(var_samp(revenue), 0) AS spread
+                FROM (SELECT {', '.join(f'{sql} AS {key}' for sql, key in zip(strata, keys))},
+                             {expr['revenue']} AS revenue, _sample_weight
+                      FROM read_parquet({sql_literal(path)}))
+                GROUP BY {', '.join(keys)}
+            )
+            SELECT sum(n), CAST(round(sum(size)) AS BIGINT), count(*), sum(total),
+                   sum(size * size * (1 - n / size) * spread / n)
+            FROM stratum
+            """
+        ).fetchone()
+        log_memory(con, f"Sampled {os.path.basename(parquet_path)}")
+    finally:
+        con.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    standard_error = math.sqrt(max(variance or 0.0, 0.0))
+    return {
+        'path': path,
+        'rows': sample_rows,
+        'source_rows': source_rows,
+        'fraction': sample_rows / source_rows if source_rows else None,
+        'strata': strata_count,
+        'revenue_estimate': revenue,
+        'revenue_standard_error': standard_error,
+        'revenue_margin': CONFIDENCE_Z * standard_error / abs(revenue) if revenue else None,
+        'estimated_distinct': _estimated_distinct(profile),
+    }
+
+
+def _load(parquet_path):
+    """Read persisted sample metadata, or None when it is missing, unreadable or its table is gone"""
+    metadata_path = _metadata_path(parquet_path)
+    if not os.path.exists(metadata_path):
+        return None
+    try:
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Rebuilding unreadable sample metadata {metadata_path}: {e}")
+        return None
+    if metadata['path'] and not os.path.exists(metadata['path']):
+        return None
+    return metadata
+
+
+def get_sample(parquet_path):
+    """Return the sample metadata of a materialized dataset, building the sample the first time"""
+    metadata = _samples.get(parquet_path)
+    if metadata is not None:
+        return metadata
+
+    with _lock, file_lock(_metadata_path(parquet_path) + '.lock'):
+        metadata = _samples.get(parquet_path)
+        if metadata is not None:
+            return metadata
+
+        metadata = _load(parquet_path)
+        if metadata is None:
+            metadata = build_sample(parquet_path)
+            metadata_path = _metadata_path(parquet_path)
+            with open(metadata_path + '.tmp', 'w') as f:
+                json.dump(metadata, f)
+            os.replace(metadata_path + '.tmp', metadata_path)
+            if metadata['path']:
+                logger.info(f"Sampled {metadata['rows']} of {metadata['source_rows']} rows of {parquet_path} "
+                            f"in {metadata['strata']} strata, revenue within {metadata['revenue_margin']:.3%}")
+        _samples[parquet_path] = metadata
+        return metadata
+
+
+def describe_sample_for_semantic_model(metadata):
+    """Semantic model entry for sales_data when it is the sample (see app.data.ingest.open_dataset_connection)"""
+    return {
+        'name': 'sales_data',
+        'description': (
+            f"Stratified sample of {metadata['fraction']:.1%} of the sales data ({metadata['rows']:,} of "
+            f"{metadata['source_rows']:,} rows) by month and product, with the columns of the full data plus "
+            f"_sample_weight (rows of the full data each sampled row stands for). Estimate totals with "
+            f"sum(column * _sample_weight), row counts with sum(_sample_weight) and averages with "
+            f"sum(column * _sample_weight) / sum(_sample_weight)"
+        ),
+        'path': metadata['path'],
+        'row_count': metadata['rows'],
+        'estimated_distinct': metadata['estimated_distinct'],
+    }
+
+
+def describe_accuracy(metadata):
+    """One line stating how an approximate answer was estimated and how close its totals are"""
+    note = (f"Approximate answer estimated from a {metadata['fraction']:.1%} stratified sample "
+            f"({metadata['rows']:,} of {metadata['source_rows']:,} rows)")
+    if metadata.get('revenue_margin') is not None:
+        note += (f"; total revenue is within ±{metadata['revenue_margin']:.2%} at 95% confidence, "
+                 f"narrower breakdowns are less precise")
+    return f"_{note}._"
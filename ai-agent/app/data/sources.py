@@ -0,0 +1,54 @@
+"""
+SQL sources for materialized tables
+
+A materialized table is either a single parquet file (one uploaded CSV, see
+app.data.ingest) or a collection file listing several of them as date partitions
+(see app.data.collection). table_source() turns either into something to select
+FROM, so the profiler, KPI engine, rollups and charts work on both.
+"""
+from app.data.columns import sql_literal
+import json
+import os
+
+COLLECTION_SUFFIX = '.collection.json'
+
+# Collection files never change once written (their name includes the content hash)
+_collections = {}
+
+
+def is_collection(path):
+    return path.endswith(COLLECTION_SUFFIX)
+
+
+def is_materialized(path):
+    """Whether path is a local table (parquet file or collection) rather than a remote CSV URL"""
+    return bool(path) and (path.endswith('.parquet') or is_collection(path)) and os.path.exists(path)
+
+
+def read_collection(path):
+    collection = _collections.get(path)
+    if collection is None:
+        with open(path) as f:
+            collection = json.load(f)
+        _collections[path] = collection
+    return collection
+
+
+def partition_sql(partition):
+    """SELECT over one partition; the date guard lets DuckDB drop it when a filter can't match its range"""
+    sql = f"SELECT * FROM read_parquet({sql_literal(partition['path'])})"
+    if partition.get('guard'):
+        sql += f" WHERE {partition['guard']}"
+    return sql
+
+
+def union_sql(collection):
+    """All partitions of a collection as one relation, matching columns by name"""
+    return ' UNION ALL BY NAME '.join(partition_sql(partition) for partition in collection['partitions'])
+
+
+def table_source(path):
+    """FROM-clause SQL for a materialized table"""
+    if is_collection(path):
+        return f"({union_sql(read_collection(path))})"
+    return f"read_parquet({sql_literal(path)})"
@@ -1,10 +1,20 @@
-from phi.agent import Agent
-from phi.model.openai import OpenAIChat
-from phi.tools.googlesearch import GoogleSearch
-from phi.agent.duckdb import DuckDbAgent
 from app.api.get_csv_url import get_csv_url
+from app.data.ingest import materialize_dataset, open_dataset_connection, add_change_listener
+from app.data.collection import materialize_collection, describe_partitions_for_semantic_model
+from app.data.sources import is_collection, is_materialized, read_collection
+from app.data.profiler import get_profile, describe_for_semantic_model
+from app.data.rollups import get_rollups, describe_rollups_for_semantic_model
+from app.data.sample import get_sample, describe_sample_for_semantic_model, describe_accuracy
+from app.data.kpi import get_dataset_kpis, answer_kpi_question, wants_kpi_context, kpi_context
+from app.agent.pool import agent_pool
+from app.agent.prompts import analyst_instructions, scope_question, approximate_question
+from app.agent.router import route_message, canned_reply, needs_dataset, NO_DATA_REPLY
+from app.answer_cache import answer_cache, answer_key
+from app.telemetry import span, timed, observe
 from dotenv import load_dotenv
+from functools import lru_cache
 import logging
+import time
 import sys
 import json
 import re
@@ -18,128 +28,29 @@ logging.basicConfig(level=logging.INFO,
 
 logger = logging.getLogger("SalesAnalyst")
 
-# Simple chatbot for greetings and basic interactions
-basic_chat = Agent(
-    name="Sales Analysis Assistant",
-    role="Handle basic greetings and non-analytical questions",
-    model=OpenAIChat(model="gpt-4o"),
-    instructions=[
-        "You are a friendly sales data analysis assistant named SalesAnalyst",
-        "Keep responses short, friendly and personable",
-        "For greetings, introduce yourself as SalesAnalyst, the sales analytics assistant",
-        "For simple questions, provide brief, helpful responses",
-        "If unsure, suggest asking about sales data or analytics",
-        "If user uploads a new file, remind them about required fields for sales analysis:",
-        "- Order/Transaction ID",
-        "- Product name/ID",
-        "- Order date/timestamp",
-        "- Quantity sold",
-        "- Unit price",
-        "- Total amount",
-        "- Optional but useful: customer information, region/location, payment method, etc."
-    ],
-    markdown=True
-)
-
-# Data analysis agent
-data_analyst = DuckDbAgent(
-    model=OpenAIChat(model="gpt-4o"),
-    semantic_model=json.dumps(
-        {
-            "tables": [
-                {
-                    "name": "sales_data",
-                    "description": "Contains detailed sales data including product information, order dates, quantities, prices, customer information, and total invoice amounts",
-                    "path": get_csv_url(),
-                }
-            ]
-        }
-    ),
-    instructions=[
-        "You are an AI-powered sales analytics system that analyzes sales data comprehensively",
-        "When generating performance reports, always include these key sections:",
-        
-        "EXECUTIVE SUMMARY:",
-        "- Provide a concise 2-3 sentence overview highlighting the most significant findings",
-        "- Compare overall performance to previous periods (month-over-month and year-over-year)",
-        "- Include one critical recommendation based on the data",
-        
-        "1. Sales Performance Metrics:",
-        "   - Total Sales Revenue = Sum of all invoice totals",
-        "   - Total Number of Sales = Count of invoices",
-        "   - Average Order Value (AOV) = Total Sales Revenue / Total Number of Sales",
-        "   - Sales Growth Rate = (Current Period Sales - Previous Period Sales) / Previous Period Sales",
-        
-        "2. Product Performance & Profitability:",
-        "   - Top 5 Selling Products by both revenue and quantity",
-        "   - Bottom 5 Selling Products by both revenue and quantity",
-        "   - Profit Per Product where possible",
-        "   - Total Profit across all products",
-        
-        "3. Customer Insights:",
-        "   - Top 5 Customers by Revenue (if customer data is available)",
-        "   - Customer Retention Rate = Percentage of repeat customers",
-        "   - Average Purchase Frequency = Total Orders / Unique Customers",
-        "   - Customer Lifetime Value (CLV) = (Average Order Value × Purchase Frequency × Retention Rate)",
-        
-        "4. Inventory & Stock Analysis:",
-        "   - Most Profitable Products = Products with the highest total profit",
-        "   - Slow-Moving Inventory = Products with low sales over a period",
-        "   - Stock Turnover analysis where possible",
-        
-        "5. Seasonal Trends & Forecasting:",
-        "   - Monthly/Quarterly Sales Trends with clear identification of peak periods",
-        "   - Demand Forecasting for upcoming months based on historical trends",
-        "   - Price Sensitivity Analysis where possible",
-        
-        "6. Discount & Pricing Effectiveness:",
-        "   - Impact of Discounts on Sales = Comparing sales before and after discounts",
-        "   - Best-Performing Discount Strategies",
-        "   - Markdown Loss analysis if data permits",
-        
-        "7. Performance Comparison:",
-        "   - Compare with previous month (month-over-month)",
-        "   - Compare with same month last year (year-over-year)",
-        "   - Highlight significant changes (>10% change)",
-        
-        "8. Strategic Recommendations:",
-        "   - Provide 3-5 specific, actionable recommendations based on the data",
-        "   - Prioritize recommendations with highest potential impact",
-        "   - Include expected outcomes for each recommendation",
-        
-        "Always provide precise numerical answers with calculations explained",
-        "Use visual-friendly formatting like tables and lists for data presentation",
-        "Ensure all percentages are properly calculated and clearly labeled",
-        "When answering specific questions, focus on the requested metric but include related insights",
-        "For forecasting, use time series analysis techniques and explain your methodology",
-        "Use consistent number formatting (e.g., '$1,234.56' for currency)",
-        
-        "NEVER INCLUDE ANY SQL QUERIES IN YOUR RESPONSES",
-        "DO NOT MENTION SQL OR QUERY SYNTAX AT ALL",
-        "Present all findings as if they came from direct data analysis without mentioning database operations",
-        
-        "If certain data is missing (like cost data for profit calculations), clearly state this limitation",
-        "Identify common data fields automatically and adjust your analysis based on available columns",
-        "Adapt terminology to match the dataset (e.g., 'products' vs 'services', 'customers' vs 'clients')"
-    ],
-    markdown=True,
-    show_sql=False,
-)
-
-# Web search agent for market trends
-web_agent = Agent(
-    name="Web Agent",
-    role="Search the web for market trends related to sales data",
-    model=OpenAIChat(id="gpt-4o"),
-    tools=[GoogleSearch()],
-    instructions=[
-        "Always include sources and dates in responses",
-        "Focus on industry trends, market forecasts, and consumer preferences",
-        "Provide specific, actionable insights for business optimization"
-    ],
-    show_tool_calls=True,
-    markdown=True,
-)
+# Agents are built on first use so that importing this module stays cheap and
+# makes no network calls; phi is only imported once an agent is actually needed.
+
+@lru_cache(maxsize=None)
+def get_web_agent():
+    """Web search agent for market trends"""
+    from phi.agent import Agent
+    from phi.tools.googlesearch import GoogleSearch
+    from app.agent.instrumented import TracedOpenAIChat
+
+    return Agent(
+        name="Web Agent",
+        role="Search the web for market trends related to sales data",
+        model=TracedOpenAIChat(id="gpt-4o"),
+        tools=[GoogleSearch()],
+        instructions=[
+            "Always include sources and dates in responses",
+            "Focus on industry trends, market forecasts, and consumer preferences",
+            "Provide specific, actionable insights for business optimization"
+        ],
+        show_tool_calls=True,
+        markdown=True,
+    )
 
 def extract_response_content(response):
     """Extract the actual text content from a phi agent response"""
@@ -153,220 +64,391 @@ def extract_response_content(response):
     # Default fallback
     return str(response)
 
-def greeting_handler(user_input):
-    """Handle greetings and simple questions"""
-    response = basic_chat.run(user_input)
-    return extract_response_content(response)
-
-def format_analysis_response(response_text):
-    """Enhance and format the analysis response for better presentation"""
-    import re
-    
+# Formatting rules shared by the batch and streaming post-processors
+FORMAT_RULES = [
     # Format percentages consistently (ensure % symbol is attached)
-    response_text = re.sub(r'(\d+\.?\d*)\s+%', r'\1%', response_text)
-    
+    (re.compile(r'(\d+\.?\d*)\s+%'), r'\1%'),
     # Emphasize key metrics for visibility
-    response_text = re.sub(r'(Total Sales Revenue|Average Order Value|Sales Growth Rate|Total Profit|Customer Retention Rate):', r'**\1**:', response_text)
-    
+    (re.compile(r'(Total Sales Revenue|Average Order Value|Sales Growth Rate|Total Profit|Customer Retention Rate):'), r'**\1**:'),
     # Format section headings for reports
-    response_text = re.sub(r'EXECUTIVE SUMMARY:', r'## EXECUTIVE SUMMARY', response_text)
-    response_text = re.sub(r'(\d+\.\s+)([\w\s&]+:)', r'### \1\2', response_text)
-    response_text = re.sub(r'(Strategic Recommendations:)', r'### \1', response_text)
+    (re.compile(r'EXECUTIVE SUMMARY:'), r'## EXECUTIVE SUMMARY'),
+    (re.compile(r'(\d+\.\s+)([\w\s&]+:)'), r'### \1\2'),
+    (re.compile(r'(Strategic Recommendations:)'), r'### \1'),
+]
+DIVIDER_SECTIONS = ["Product Performance", "Customer Insights", "Strategic Recommendations"]
+DIVIDER_MIN_LENGTH = 500
+
+SQL_BLOCK_PATTERN = re.compile(r'```sql[\s\S]*?```')
+SQL_REFERENCE_PATTERNS = [
+    re.compile(r'Here is the SQL query used.*'),
+    re.compile(r'The SQL query.*'),
+    re.compile(r'Using the following SQL.*'),
+]
+
+@timed('format')
+def format_analysis_response(response_text):
+    """Enhance and format the analysis response for better presentation"""
+    for pattern, replacement in FORMAT_RULES:
+        response_text = pattern.sub(replacement, response_text)
     
     # Add section dividers for long responses
-    if len(response_text) > 500:
-        if "Product Performance" in response_text and "---" not in response_text:
-            response_text = response_text.replace("Product Performance", "\n---\n### Product Performance", 1)
-        if "Customer Insights" in response_text and "---" not in response_text:
-            response_text = response_text.replace("Customer Insights", "\n---\n### Customer Insights", 1)
-        if "Strategic Recommendations" in response_text and "---" not in response_text:
-            response_text = response_text.replace("Strategic Recommendations", "\n---\n### Strategic Recommendations", 1)
+    if len(response_text) > DIVIDER_MIN_LENGTH:
+        for section in DIVIDER_SECTIONS:
+            if section in response_text and "---" not in response_text:
+                response_text = response_text.replace(section, f"\n---\n### {section}", 1)
     
     return response_text
 
-def analysis_handler(user_input):
-    """Handle cake shop analysis requests with enhanced error handling"""
-    try:
-        response = data_analyst.run(user_input)
-        response_text = extract_response_content(response)
-        # Apply formatting enhancements
-        response_text = format_analysis_response(response_text)
-        return response_text
-    except Exception as e:
-        logger.error(f"Analysis handler error: {str(e)}", exc_info=True)
-        # Provide a more specific error based on the query type
-        if "profit margin" in user_input.lower():
-            return "I'm sorry, I couldn't calculate the profit margins you requested. Our system might not have the cost data needed for this analysis."
-        elif "forecast" in user_input.lower() or "predict" in user_input.lower():
-            return "I'm sorry, I couldn't generate the forecast you requested. This might require more historical data than is currently available."
-        elif "customer" in user_input.lower():
-            return "I'm sorry, I couldn't retrieve the customer data you requested. Our customer information might be limited in the current dataset."
-        else:
-            return "I'm sorry, I encountered an error while analyzing that data. Could you try asking a different question about our sales or products?"
-
 def web_search_handler(user_input):
     """Handle web search requests"""
-    response = web_agent.run(user_input)
+    response = get_web_agent().run(user_input)
     return extract_response_content(response)
 
-def handle_user_input(user_input, csv_url=None):
-    """Route user input to the appropriate handler"""
-    # Simple greeting detection
-    greeting_phrases = ["hi", "hello", "hey", "greetings", "good morning", "good afternoon", "howdy"]
-    user_input_lower = user_input.lower()
-    
+def handle_user_input(user_input, csv_url=None, file_id=None, route=None, file_set=None, approximate=False):
+    """
+    Route user input to the appropriate handler (route is the router's decision, if already made)
+
+    A file_set (see app.data.collection) is analysed as one table in place of csv_url.
+    approximate lets the analyst answer from the dataset's sample (see answer_analysis).
+    """
     # Print debug info
     logger.info(f"Processing user input: '{user_input}'")
     
-    # First check if this is a simple greeting BEFORE loading any CSV data
-    is_greeting = any(phrase in user_input_lower for phrase in greeting_phrases)
-    is_short = len(user_input.strip().split()) < 3
+    # Decide BEFORE loading any CSV data; greetings and upload notices get a fixed reply
+    route = route or route_message(user_input)
+    logger.info(f"Routed as {route.intent} ({route.reason}, confidence {route.confidence:.2f})")
     
-    # Check if this is a new file upload notification
-    is_file_upload = "upload" in user_input_lower or "new file" in user_input_lower or "csv file" in user_input_lower
+    reply = canned_reply(route.intent)
+    if reply:
+        return reply
     
-    if is_file_upload:
-        logger.info("Detected file upload notification, providing file requirements info")
-        return greeting_handler("Welcome! For best results with the sales analysis, your CSV file should include these fields:\n\n" + 
-                               "**Required Fields:**\n" +
-                               "- **Order/Transaction ID**: Unique identifier for each transaction\n" +
-                               "- **Product Name or ID**: What was sold\n" +
-                               "- **Date/Timestamp**: When the sale occurred\n" +
-                               "- **Quantity**: Number of units sold\n" +
-                               "- **Unit Price**: Price per unit\n" +
-                               "- **Total Amount**: Total sale value\n\n" +
-                               "**Recommended Additional Fields:**\n" +
-                               "- **Customer ID/Name**: Who purchased (for customer analytics)\n" +
-                               "- **Region/Location**: Where the sale occurred\n" +
-                               "- **Category/Department**: Product grouping\n" +
-                               "- **Cost**: Unit cost (for profit analysis)\n" +
-                               "- **Discount**: Any applied discounts\n\n" +
-                               "Don't worry if your file doesn't have all these fields - I'll work with what you have!")
+    if route.intent == "web_search":
+        return web_search_handler(user_input)
     
-    if is_greeting and is_short:
-        logger.info(f"Routing to greeting handler: is_greeting={is_greeting}, is_short={is_short}")
-        return greeting_handler(user_input)
+    if file_set:
+        return analyze_dataset(user_input, csv_url, file_id, file_set, approximate)
     
     # Only get the CSV URL if we're actually going to analyze data
     if not csv_url:
         csv_url = get_csv_url()
     logger.info(f"Current CSV URL: {csv_url}")
 
-    # Create a dynamic data analyst agent with the specific CSV URL
+    # Analyze the specific CSV with a data analyst agent
     if csv_url:
-        data_analyst_instance = create_data_analyst_agent(csv_url)
-        # Use this instance for analysis
-        return analysis_with_agent(user_input, data_analyst_instance)
+        return analyze_dataset(user_input, csv_url, file_id, approximate=approximate)
     else:
         logger.error("No CSV URL available. Cannot perform analysis.")
-        return greeting_handler("I'm sorry, I don't have access to any data files at the moment. Please upload a CSV file first. For best analysis results, your CSV should include fields like order ID, product name, order date, quantity, price, and total amount.")
-
-def create_data_analyst_agent(csv_url):
-    """Create a new data analyst agent with the specified CSV URL"""
-    return DuckDbAgent(
-        model=OpenAIChat(model="gpt-4o"),
-        semantic_model=json.dumps(
-            {
-                "tables": [
-                    {
-                        "name": "sales_data",
-                        "description": "Contains detailed sales data including product information, order dates, quantities, prices, customer information, and total invoice amounts",
-                        "path": csv_url,
-                    }
-                ]
-            }
-        ),
-        instructions=[
-            "You are an AI-powered sales analytics system that analyzes sales data comprehensively",
-            "When generating performance reports, always include these key sections:",
-            
-            "EXECUTIVE SUMMARY:",
-            "- Provide a concise 2-3 sentence overview highlighting the most significant findings",
-            "- Compare overall performance to previous periods (month-over-month and year-over-year)",
-            "- Include one critical recommendation based on the data",
-            
-            "1. Sales Performance Metrics:",
-            "   - Total Sales Revenue = Sum of all invoice totals",
-            "   - Total Number of Sales = Count of invoices/orders",
-            "   - Average Order Value (AOV) = Total Sales Revenue / Total Number of Sales",
-            "   - Sales Growth Rate = (Current Period Sales - Previous Period Sales) / Previous Period Sales",
-            
-            "2. Product Performance & Profitability:",
-            "   - Top 5 Selling Products by both revenue and quantity",
-            "   - Bottom 5 Selling Products by both revenue and quantity",
-            "   - Profit Per Product where possible (if cost data is available)",
-            "   - Total Profit across all products (if cost data is available)",
-            
-            "3. Customer Insights (if customer data is available):",
-            "   - Top 5 Customers by Revenue",
-            "   - Customer Retention Rate = Percentage of repeat customers",
-            "   - Average Purchase Frequency = Total Orders / Unique Customers",
-            "   - Customer Lifetime Value (CLV) = (Average Order Value × Purchase Frequency × Retention Rate)",
-            
-            "4. Inventory & Stock Analysis:",
-            "   - Most Profitable Products = Products with the highest total profit",
-            "   - Slow-Moving Inventory = Products with low sales over a period",
-            "   - Stock Turnover analysis where possible",
-            
-            "5. Seasonal Trends & Forecasting:",
-            "   - Monthly/Quarterly Sales Trends with clear identification of peak periods",
-            "   - Demand Forecasting for upcoming months based on historical trends",
-            "   - Price Sensitivity Analysis where possible",
-            
-            "6. Discount & Pricing Effectiveness (if discount data is available):",
-            "   - Impact of Discounts on Sales = Comparing sales before and after discounts",
-            "   - Best-Performing Discount Strategies",
-            "   - Markdown Loss analysis if data permits",
-            
-            "7. Performance Comparison:",
-            "   - Compare with previous month (month-over-month)",
-            "   - Compare with same month last year (year-over-year)",
-            "   - Highlight significant changes (>10% change)",
-            
-            "8. Strategic Recommendations:",
-            "   - Provide 3-5 specific, actionable recommendations based on the data",
-            "   - Prioritize recommendations with highest potential impact",
-            "   - Include expected outcomes for each recommendation",
-            
-            "Always provide precise numerical answers with calculations explained",
-            "Use visual-friendly formatting like tables and lists for data presentation",
-            "Ensure all percentages are properly calculated and clearly labeled",
-            "When answering specific questions, focus on the requested metric but include related insights",
-            "For forecasting, use time series analysis techniques and explain your methodology",
-            "Use consistent number formatting (e.g., '$1,234.56' for currency)",
-            
-            "NEVER INCLUDE ANY SQL QUERIES IN YOUR RESPONSES",
-            "DO NOT MENTION SQL OR QUERY SYNTAX AT ALL",
-            "Present all findings as if they came from direct data analysis without mentioning database operations",
-            
-            "First identify and interpret the data schema to understand the available columns",
-            "Adapt your analysis based on available data fields - skip sections that aren't applicable",
-            "When certain data is missing for calculations, clearly explain the limitation",
-            "Use appropriate terminology matching the data (products vs services, customers vs clients, etc.)"
-        ],
-        markdown=True,
-        show_sql=False,
-    )
+        return NO_DATA_REPLY
+
+def stream_user_input(user_input, csv_url=None, file_id=None, route=None, file_set=None, approximate=False):
+    """Like handle_user_input, but yield the analysis as it is generated"""
+    route = route or route_message(user_input)
+    if not needs_dataset(route.intent):
+        yield handle_user_input(user_input, csv_url, file_id, route)
+        return
+    
+    if file_set:
+        yield from stream_analyze_dataset(user_input, csv_url, file_id, file_set, approximate)
+        return
     
-def analysis_with_agent(user_input, agent):
-    """Handle sales data analysis requests with enhanced error handling using the provided agent"""
+    if not csv_url:
+        csv_url = get_csv_url()
+    if not csv_url:
+        yield handle_user_input(user_input, csv_url, file_id, route)
+        return
+    
+    yield from stream_analyze_dataset(user_input, csv_url, file_id, approximate=approximate)
+
+def plan_analysis(user_input, csv_url, file_id=None, file_set=None, dataset=None, approximate=False):
+    """
+    Work out how to answer an analysis question before any agent is involved
+
+    dataset is an already materialized dataset to use instead of resolving one (a batch
+    of questions resolves it once for all of them). Approximate answers are cached
+    apart from exact ones.
+
+    Returns (dataset, table_path, sample, cache_key, ready_answer, agent_input); sample is
+    the one to answer from (see analysis_sample), ready_answer is set when the answer
+    cache or the KPI engine already has the answer, and agent_input is written for the
+    agent lease_analyst gives for table_path and sample.
+    """
+    if dataset is None and file_set:
+        dataset = resolve_file_set(file_set)
+        if not dataset:
+            return None, None, None, None, NO_DATA_REPLY, user_input
+    elif dataset is None:
+        dataset = resolve_dataset(csv_url, file_id)
+    table_path = dataset['path'] if dataset else csv_url
+    prompt_version = f"{PROMPT_VERSION}-approximate" if approximate else PROMPT_VERSION
+    cache_key = answer_key(dataset['content_hash'], user_input, prompt_version) if dataset else None
+    
+    with span('plan'):
+        if cache_key:
+            cached = answer_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Serving cached answer")
+                return dataset, table_path, None, cache_key, cached, user_input
+        
+        sample = analysis_sample(table_path) if approximate else None
+        direct_answer, agent_input = prepare_analysis_input(user_input, table_path, sample)
+    return dataset, table_path, sample, cache_key, direct_answer, agent_input
+
+def analyze_dataset(user_input, csv_url, file_id=None, file_set=None, approximate=False):
+    """Answer an analysis question from the answer cache, the KPI engine or a pooled data analyst agent"""
     try:
-        response = agent.run(user_input)
-        response_text = extract_response_content(response)
-        # Apply formatting enhancements
-        response_text = format_analysis_response(response_text)
-        return response_text
+        return answer_analysis(user_input, csv_url, file_id, file_set, approximate=approximate)
     except Exception as e:
         logger.error(f"Analysis handler error: {str(e)}", exc_info=True)
-        # Provide a more specific error based on the query type
-        if "profit margin" in user_input.lower():
-            return "I'm sorry, I couldn't calculate the profit margins you requested. This might be because the dataset doesn't include cost information needed for profit calculations."
-        elif "forecast" in user_input.lower() or "predict" in user_input.lower():
-            return "I'm sorry, I couldn't generate the forecast you requested. This might require more historical data than is currently available in your dataset."
-        elif "customer" in user_input.lower():
-            return "I'm sorry, I couldn't retrieve the customer data you requested. Your dataset might not contain sufficient customer information for this analysis."
-        else:
-            return "I'm sorry, I encountered an error while analyzing that data. This might be due to missing fields in your dataset or an unsupported query type. Could you try asking a different question about your sales?"
+        return analysis_error_message(user_input)
+
+def answer_analysis(user_input, csv_url, file_id=None, file_set=None, dataset=None, approximate=False):
+    """
+    Like analyze_dataset, but errors propagate so callers can report them (see plan_analysis for dataset)
+
+    With approximate, a dataset large enough to have a sample (see app.data.sample) is
+    analysed from it by an agent of its own, and the answer says how precise it is;
+    answers the KPI engine has ready are exact anyway.
+    """
+    dataset, table_path, sample, cache_key, ready_answer, agent_input = plan_analysis(
+        user_input, csv_url, file_id, file_set, dataset, approximate
+    )
+    if ready_answer:
+        return ready_answer
+    
+    # Reuse an idle agent for this dataset when one is pooled
+    with lease_analyst(table_path, sample) as data_analyst_instance:
+        response_text = run_analysis(agent_input, data_analyst_instance)
+    if sample:
+        response_text = f"{response_text}\n\n{describe_accuracy(sample)}"
+    
+    # Store answers fully cleaned so cache hits need no further processing
+    response_text = remove_sql_queries(response_text)
+    if cache_key:
+        answer_cache.put(cache_key, dataset['key'], dataset['content_hash'], response_text)
+    return response_text
+
+def stream_analyze_dataset(user_input, csv_url, file_id=None, file_set=None, approximate=False):
+    """Streaming counterpart of analyze_dataset"""
+    dataset, table_path, sample, cache_key, ready_answer, agent_input = plan_analysis(
+        user_input, csv_url, file_id, file_set, approximate=approximate
+    )
+    if ready_answer:
+        yield ready_answer
+        return
+    
+    pieces = []
+    with lease_analyst(table_path, sample) as data_analyst_instance:
+        try:
+            for text in stream_analysis(agent_input, data_analyst_instance):
+                pieces.append(text)
+                yield text
+        except Exception as e:
+            logger.error(f"Streaming analysis error: {str(e)}", exc_info=True)
+            yield "\n\n" + analysis_error_message(user_input)
+            return
+    if sample:
+        pieces.append(f"\n\n{describe_accuracy(sample)}")
+        yield pieces[-1]
+    
+    if cache_key:
+        answer_cache.put(cache_key, dataset['key'], dataset['content_hash'], remove_sql_queries(''.join(pieces)))
+
+def prepare_analysis_input(user_input, table_path, sample=None):
+    """
+    Use the deterministic KPI engine before involving the LLM
+
+    Returns (direct_answer, agent_input): plain metric questions are answered directly,
+    and the rest go to the agent with the report sections they call for attached (see
+    scope_question), and the instructions for answering from the sample when one is
+    given. Broad report requests, and metric questions qualified in a way the engine
+    can't answer (for a product, by store, in March), also get the precomputed numbers
+    to narrate or start from.
+    """
+    agent_input = scope_question(user_input, tools=has_analytics_tools(table_path, sample))
+    if sample:
+        agent_input = approximate_question(agent_input, rollups=bool(rollup_table_models(table_path)))
+    if not is_materialized(table_path):
+        return None, agent_input
+    try:
+        kpis = get_dataset_kpis(table_path)
+    except Exception as e:
+        logger.warning(f"KPI computation failed, leaving metrics to the agent: {str(e)}")
+        return None, agent_input
+    if not kpis:
+        return None, agent_input
+    
+    direct_answer = answer_kpi_question(user_input, kpis)
+    if direct_answer:
+        logger.info("Answered metric question from precomputed KPIs")
+        return direct_answer, agent_input
+    if wants_kpi_context(user_input):
+        return None, f"{agent_input}\n\n{kpi_context(kpis)}"
+    return None, agent_input
+
+def analysis_sample(table_path):
+    """The sample of a materialized dataset for approximate answers, or None when it has none"""
+    if not is_materialized(table_path):
+        return None
+    try:
+        sample = get_sample(table_path)
+    except Exception as e:
+        logger.warning(f"Could not load the sample of {table_path}, answering exactly: {str(e)}")
+        return None
+    return sample if sample['path'] else None
+
+def has_analytics_tools(table_path, sample=None):
+    """Whether the analyst agent for a dataset (and sample) gets the analytics tools, which read the full table"""
+    return is_materialized(table_path) and not sample
+
+def lease_analyst(table_path, sample=None):
+    """Lease a pooled data analyst agent for a dataset; one given a sample is pooled separately"""
+    if sample:
+        return agent_pool.lease((table_path, 'approximate'), lambda: build_data_analyst_agent(table_path, sample))
+    return agent_pool.lease(table_path, lambda: build_data_analyst_agent(table_path))
+
+def dataset_files(table_path):
+    """The table files a pooled agent's connection reads: the dataset itself and, for a collection, its partitions"""
+    files = {table_path}
+    if is_collection(table_path) and is_materialized(table_path):
+        files.update(partition['path'] for partition in read_collection(table_path)['partitions'])
+    return files
+
+def evict_dataset_agents(dataset, previous_path):
+    """Close the pooled agents reading a dataset version that has been replaced, before its files are removed"""
+    evicted = agent_pool.evict(lambda key: previous_path in dataset_files(key[0] if isinstance(key, tuple) else key))
+    if evicted:
+        logger.info(f"Evicted {evicted} pooled agents of the replaced version of dataset {dataset['key']}")
+
+add_change_listener(evict_dataset_agents)
+
+def resolve_dataset(csv_url, file_id=None):
+    """Return the local materialized dataset for a CSV, or None if it can't be materialized"""
+    try:
+        with span('ingest'):
+            return materialize_dataset(csv_url, file_id)
+    except Exception as e:
+        logger.warning(f"Could not materialize {csv_url}, reading it remotely: {str(e)}")
+        return None
+
+def resolve_file_set(file_set):
+    """Return the collection combining a set of files (a single file as itself), or None if none could be loaded"""
+    try:
+        with span('ingest'):
+            if len(file_set.files) == 1:
+                file_id, csv_url = file_set.files[0]
+                return materialize_dataset(csv_url, file_id)
+            return materialize_collection(file_set)
+    except Exception as e:
+        logger.warning(f"Could not materialize file set {file_set.key}: {str(e)}")
+        return None
+
+# Bump whenever the analyst instructions (app.agent.prompts) change so cached answers are recomputed
+PROMPT_VERSION = "8"
+
+def sales_table_model(table_path):
+    """Semantic model entry for sales_data, including the dataset profile when one is available"""
+    table = {
+        "name": "sales_data",
+        "description": "Contains detailed sales data including product information, order dates, quantities, prices, customer information, and total invoice amounts",
+        "path": table_path,
+    }
+    if is_collection(table_path):
+        # The partitions are exposed as one view; there is no single file to load
+        del table["path"]
+        table.update(describe_partitions_for_semantic_model(table_path))
+    if is_materialized(table_path):
+        try:
+            table.update(describe_for_semantic_model(get_profile(table_path)))
+        except Exception as e:
+            logger.warning(f"Could not profile {table_path}: {str(e)}")
+    return table
+
+def rollup_table_models(table_path):
+    """Semantic model entries for the rollup tables built alongside a materialized dataset"""
+    if not is_materialized(table_path):
+        return []
+    try:
+        return describe_rollups_for_semantic_model(get_rollups(table_path))
+    except Exception as e:
+        logger.warning(f"Could not load rollups for {table_path}: {str(e)}")
+        return []
+
+def build_data_analyst_agent(table_path, sample=None):
+    """
+    Build a data analyst agent whose DuckDB connection already exposes the sales_data table and its rollups
+
+    Given the dataset's sample metadata (see app.data.sample), sales_data is the sample
+    and is described as one; the full table isn't exposed, and neither are the analytics
+    tools that read it. Its instructions only mention the rollups it actually has.
+    """
+    with span('agent_build'):
+        from phi.agent.duckdb import DuckDbAgent
+        from app.agent.instrumented import TracedOpenAIChat, SalesDuckDbTools
+        from app.agent.tools import SalesAnalyticsTools
+
+        sales_table = sales_table_model(table_path)
+        if sample:
+            sales_table.update(describe_sample_for_semantic_model(sample))
+        rollups = rollup_table_models(table_path)
+        tables = [sales_table] + rollups
+        connection = open_dataset_connection(table_path, sample=sample)
+        # Same tools DuckDbAgent would add itself, instrumented for telemetry
+        tools = [SalesDuckDbTools(
+            table_rows={table['name']: table['row_count'] for table in tables if 'row_count' in table},
+            dataset=table_path if is_materialized(table_path) else None,
+            connection=connection,
+            inspect_queries=True,
+            export_tables=True,
+        )]
+        if has_analytics_tools(table_path, sample):
+            tools.append(SalesAnalyticsTools(table_path))
+        return DuckDbAgent(
+            model=TracedOpenAIChat(model="gpt-4o"),
+            semantic_model=json.dumps({"tables": tables}),
+            connection=connection,
+            tools=tools,
+            # The same for every agent of a kind, so the system prompt stays cacheable; see scope_question
+            instructions=analyst_instructions(rollups=bool(rollups)),
+            markdown=True,
+            show_sql=False,
+        )
+    
+def run_analysis(user_input, agent):
+    """Run the agent on a question and return the formatted answer (errors propagate)"""
+    response = agent.run(user_input)
+    response_text = extract_response_content(response)
+    # Apply formatting enhancements
+    return format_analysis_response(response_text)
+
+def stream_analysis(user_input, agent):
+    """Yield formatted analysis text as the agent streams it (errors propagate)"""
+    formatter = StreamingResponseFormatter()
+    start = time.perf_counter()
+    formatting = 0.0
+    for chunk in agent.run(user_input, stream=True):
+        content = getattr(chunk, 'content', None)
+        if isinstance(content, str) and content:
+            before = time.perf_counter()
+            text = formatter.feed(content)
+            formatting += time.perf_counter() - before
+            if text:
+                yield text
+    before = time.perf_counter()
+    text = formatter.flush()
+    observe('format', start, formatting + time.perf_counter() - before)
+    if text:
+        yield text
+
+def analysis_error_message(user_input):
+    """Provide a more specific error based on the query type"""
+    if "profit margin" in user_input.lower():
+        return "I'm sorry, I couldn't calculate the profit margins you requested. This might be because the dataset doesn't include cost information needed for profit calculations."
+    elif "forecast" in user_input.lower() or "predict" in user_input.lower():
+        return "I'm sorry, I couldn't generate the forecast you requested. This might require more historical data than is currently available in your dataset."
+    elif "customer" in user_input.lower():
+        return "I'm sorry, I couldn't retrieve the customer data you requested. Your dataset might not contain sufficient customer information for this analysis."
+    else:
+        return "I'm sorry, I encountered an error while analyzing that data. This might be due to missing fields in your dataset or an unsupported query type. Could you try asking a different question about your sales?"
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -394,21 +476,94 @@ def main():
         
         print("-" * 120)
 
+@timed('format')
 def remove_sql_queries(text):
     """Remove SQL query blocks from the response text"""
     # Remove code blocks with SQL
-    text = re.sub(r'```sql[\s\S]*?```', '', text)
+    text = SQL_BLOCK_PATTERN.sub('', text)
     
     # Remove references to SQL queries
-    text = re.sub(r'Here is the SQL query used.*', '', text)
-    text = re.sub(r'The SQL query.*', '', text)
-    text = re.sub(r'Using the following SQL.*', '', text)
+    for pattern in SQL_REFERENCE_PATTERNS:
+        text = pattern.sub('', text)
     
     # Clean up any double newlines created
     text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
     
     return text
 
+class StreamingResponseFormatter:
+    """
+    Incremental version of remove_sql_queries + format_analysis_response for streamed text
+
+    Text is released a line at a time, since every rule works within a line: only
+    the unfinished last line is held back, and a ```sql fence swallows everything
+    up to its closing fence.
+    """
+
+    def __init__(self):
+        self._pending = ''
+        self._in_sql_block = False
+        self._blank_lines = 0
+        self._emitted_length = 0
+        self._divider_added = False
+
+    def feed(self, chunk):
+        """Add a chunk of model output and return the text that is ready to send"""
+        self._pending += chunk
+        if '\n' not in self._pending:
+            return ''
+        complete, self._pending = self._pending.rsplit('\n', 1)
+        return ''.join(self._process_line(line + '\n') for line in complete.split('\n'))
+
+    def flush(self):
+        """Return whatever is still buffered once the stream has ended"""
+        pending, self._pending = self._pending, ''
+        if not pending or self._in_sql_block:
+            return ''
+        return self._process_line(pending)
+
+    def _process_line(self, line):
+        if self._in_sql_block:
+            if '```' in line:
+                self._in_sql_block = False
+                line = line.split('```', 1)[1]
+            else:
+                return ''
+        if '```sql' in line:
+            before, after = line.split('```sql', 1)
+            if '```' in after:
+                line = before + after.split('```', 1)[1]
+            else:
+                self._in_sql_block = True
+                line = before
+
+        for pattern in SQL_REFERENCE_PATTERNS:
+            line = pattern.sub('', line)
+
+        # Collapse runs of blank lines the same way remove_sql_queries does
+        if not line.strip():
+            self._blank_lines += 1
+            if self._blank_lines > 1 or not line:
+                return ''
+            line = '\n'
+        else:
+            self._blank_lines = 0
+
+        for pattern, replacement in FORMAT_RULES:
+            line = pattern.sub(replacement, line)
+
+        if '---' in line:
+            self._divider_added = True
+        elif not self._divider_added and self._emitted_length > DIVIDER_MIN_LENGTH:
+            for section in DIVIDER_SECTIONS:
+                if section in line:
+                    line = line.replace(section, f"\n---\n### {section}", 1)
+                    self._divider_added = True
+                    break
+
+        self._emitted_length += len(line)
+        return line
+
 def format_as_tables(text):
     """Format lists of data as markdown tables when appropriate"""
     
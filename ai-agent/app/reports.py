@@ -0,0 +1,304 @@
+"""
+Full performance reports as background jobs
+
+A report asks the analyst for every section in app.agent.prompts.REPORT_SECTIONS. In
+one call that takes longer than clients wait, so a report is a job instead: each
+section is a separate agent run against the same dataset, the sections run in
+parallel, and an executive summary is written from them at the end. Clients poll the
+job or follow its events. Finished reports are stored under DATA_DIR/reports, keyed by
+the dataset's content and the prompt version, so asking again serves the stored copy.
+
+Section and summary runs go through the agent worker pool that serves chat requests
+(app.api.workers), so reports are admitted against the same limits instead of running
+agents of their own; where a chat request would be turned away, a report run waits
+for the pool to have room. At most REPORT_JOBS + REPORT_QUEUE_DEPTH unfinished jobs
+are accepted, further ones are rejected with WorkerPoolFull.
+
+Job state is written to disk on every change, so any worker process can answer for a
+job; the job itself only runs in the process that accepted it.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from app.api.workers import agent_workers, WorkerPoolFull
+from app.agent.pool import agent_pool
+from app.main import PROMPT_VERSION, build_data_analyst_agent, has_analytics_tools, run_analysis, remove_sql_queries
+from app.agent.prompts import REPORT_SECTIONS, SUMMARY_BULLETS, section_bullets
+from app.data.kpi import get_dataset_kpis, kpi_context
+from app.data.ingest import DATA_DIR
+import contextvars
+import threading
+import hashlib
+import logging
+import json
+import time
+import uuid
+import os
+import re
+
+REPORTS_DIR = os.environ.get('REPORTS_DIR', os.path.join(DATA_DIR, 'reports'))
+# Reports generated at once, reports waiting to start, and sections admitted to the agent
+# worker pool at once across all reports (the rest of the pool stays free for chat requests)
+REPORT_JOBS = int(os.environ.get('REPORT_JOBS', '2'))
+REPORT_QUEUE_DEPTH = int(os.environ.get('REPORT_QUEUE_DEPTH', '4'))
+REPORT_SECTION_PARALLELISM = int(os.environ.get('REPORT_SECTION_PARALLELISM', '4'))
+REPORT_RETRY_AFTER_SECONDS = int(os.environ.get('REPORT_RETRY_AFTER_SECONDS', '30'))
+# How long finished jobs can still be looked up (stored reports themselves are kept)
+REPORT_JOB_TTL_SECONDS = float(os.environ.get('REPORT_JOB_TTL_SECONDS', str(24 * 3600)))
+
+logger = logging.getLogger("Reports")
+
+
+def report_sections(tools=False):
+    """The report sections to generate: number, title, heading and bullets (for an agent with the analytics tools)"""
+    sections = []
+    for section in REPORT_SECTIONS:
+        # Conditions like "(if customer data is available)" belong in the prompt, not the heading
+        short_title = re.sub(r'\s*\(.*\)$', '', section.title)
+        sections.append({
+            'number': section.number,
+            'title': section.title,
+            'heading': f"## {section.number}. {short_title}",
+            'bullets': section_bullets(section, tools),
+        })
+    return sections
+
+
+def section_prompt(section):
+    return (
+        f"Write only section {section['number']} of the sales performance report, \"{section['title']}\", "
+        f"covering:\n" + '\n'.join(section['bullets']) + "\n\n"
+        f"Start with the heading \"{section['heading']}\". Do not write an executive summary or any other "
+        "section. If the data this section needs isn't available, say so in a sentence or two instead of guessing."
+    )
+
+
+def summary_prompt(section_texts):
+    return (
+        "These are the sections of a sales performance report on this dataset. Write only its executive "
+        "summary, starting with the heading \"## EXECUTIVE SUMMARY\":\n" + '\n'.join(SUMMARY_BULLETS) + "\n\n"
+        + '\n\n'.join(section_texts)
+    )
+
+
+def report_key(dataset):
+    raw = f"{dataset['content_hash']}\x1freport\x1f{PROMPT_VERSION}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _write_json(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _report_path(key):
+    return os.path.join(REPORTS_DIR, f'{key}.json')
+
+
+def _job_path(job_id):
+    return os.path.join(REPORTS_DIR, 'jobs', f'{job_id}.json')
+
+
+class ReportJobs:
+    """
+    Runs report jobs and keeps their state
+
+    At most `jobs` reports run at once, each on its own coordinator thread, and at
+    most `queue_depth` more wait for one. Their sections run on the agent worker pool,
+    at most `section_parallelism` of them admitted at a time.
+    """
+
+    def __init__(self, jobs=REPORT_JOBS, queue_depth=REPORT_QUEUE_DEPTH,
+                 section_parallelism=REPORT_SECTION_PARALLELISM, workers=agent_workers):
+        self.jobs = jobs
+        self.queue_depth = queue_depth
+        self.workers = workers
+        self._coordinators = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="report-job")
+        self._section_slots = threading.BoundedSemaphore(section_parallelism)
+        self._jobs = {}  # job ID -> state of the jobs this process runs
+        self._lock = threading.Lock()
+
+    def submit(self, load_dataset, refresh=False):
+        """
+        Start a report job and return its ID
+
+        load_dataset() is called on the job's thread and returns the materialized
+        dataset to report on (or None); refresh regenerates a report that is stored.
+        Raises WorkerPoolFull when `jobs + queue_depth` jobs are already unfinished.
+        """
+        now = time.time()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'status': 'queued',
+            'created_at': now,
+            'updated_at': now,
+            'cached': False,
+            'dataset_key': None,
+            'sections': [{'number': section['number'], 'title': section['title'], 'status': 'pending', 'ms': None}
+                         for section in report_sections()],
+            'events': [],
+            'report': None,
+            'error': None,
+        }
+        with self._lock:
+            self._prune(now)
+            unfinished = sum(other['status'] in ('queued', 'running') for other in self._jobs.values())
+            if unfinished >= self.jobs + self.queue_depth:
+                raise WorkerPoolFull(REPORT_RETRY_AFTER_SECONDS)
+            self._jobs[job['job_id']] = job
+            self._save(job)
+        self._coordinators.submit(contextvars.copy_context().run, self._run, job, load_dataset, refresh)
+        return job['job_id']
+
+    def get(self, job_id):
+        """A snapshot of a job's state, from this process or from disk, or None for an unknown job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return json.loads(json.dumps(job))
+        return _read_json(_job_path(job_id)) if re.fullmatch(r'[0-9a-f]{32}', job_id) else None
+
+    def _prune(self, now):
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in ('done', 'failed') and job['updated_at'] < now - REPORT_JOB_TTL_SECONDS]:
+            del self._jobs[job_id]
+        jobs_dir = os.path.dirname(_job_path('0' * 32))
+        if not os.path.isdir(jobs_dir):
+            return
+        for name in os.listdir(jobs_dir):
+            path = os.path.join(jobs_dir, name)
+            try:
+                if os.path.getmtime(path) < now - REPORT_JOB_TTL_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _update(self, job, event=None, **changes):
+        with self._lock:
+            job.update(changes)
+            job['updated_at'] = time.time()
+            if event:
+                job['events'].append(dict(event, seq=len(job['events'])))
+            self._save(job)
+
+    def _save(self, job):
+        try:
+            _write_json(_job_path(job['job_id']), job)
+        except OSError as e:
+            logger.warning(f"Could not save report job {job['job_id']}: {e}")
+
+    def _run(self, job, load_dataset, refresh):
+        started = time.perf_counter()
+        self._update(job, {'type': 'status', 'status': 'running'}, status='running')
+        try:
+            dataset = load_dataset()
+            if not dataset:
+                raise ValueError("The data file could not be loaded")
+            key = report_key(dataset)
+            self._update(job, dataset_key=dataset['key'])
+
+            report = None if refresh else _read_json(_report_path(key))
+            if report is not None:
+                logger.info(f"Serving stored report {key[:12]} for dataset {dataset['key']}")
+                self._update(job, {'type': 'done', 'cached': True}, status='done', cached=True, report=report,
+                             sections=[dict(section, status='done') for section in job['sections']])
+                return
+
+            report = self._generate(job, dataset)
+            report['ms'] = round((time.perf_counter() - started) * 1000, 1)
+            if not report['failed_sections']:
+                _write_json(_report_path(key), report)
+            self._update(job, {'type': 'done', 'cached': False}, status='done', report=report)
+        except Exception as e:
+            logger.error(f"Report job {job['job_id']} failed: {str(e)}", exc_info=True)
+            self._update(job, {'type': 'error', 'detail': str(e)}, status='failed', error=str(e))
+
+    def _generate(self, job, dataset):
+        table_path = dataset['path']
+        try:
+            kpis = get_dataset_kpis(table_path)
+        except Exception as e:
+            logger.warning(f"KPI computation failed, leaving metrics to the agent: {str(e)}")
+            kpis = None
+        context = f"\n\n{kpi_context(kpis)}" if kpis else ""
+
+        def ask(prompt):
+            with agent_pool.lease(table_path, lambda: build_data_analyst_agent(table_path)) as agent:
+                return remove_sql_queries(run_analysis(prompt + context, agent))
+
+        def run_section(index, section):
+            self._set_section(job, index, status='running')
+            section_started = time.perf_counter()
+            try:
+                text = ask(section_prompt(section))
+                status, error = 'done', None
+            except Exception as e:
+                logger.error(f"Report section '{section['title']}' failed: {str(e)}", exc_info=True)
+                text = f"{section['heading']}\n\n_This section could not be generated._"
+                status, error = 'failed', str(e)
+            self._set_section(job, index, status=status, error=error,
+                              ms=round((time.perf_counter() - section_started) * 1000, 1))
+            return text
+
+        sections = report_sections(tools=has_analytics_tools(table_path))
+        futures = [self._admit(run_section, i, section) for i, section in enumerate(sections)]
+        texts = [future.result() for future in futures]
+        failed = [section['title'] for section, state in zip(sections, job['sections']) if state['status'] == 'failed']
+        if len(failed) == len(sections):
+            raise RuntimeError("Every report section failed")
+
+        try:
+            summary = self._admit(ask, summary_prompt(texts)).result()
+            self._update(job, {'type': 'summary', 'status': 'done'})
+        except Exception as e:
+            logger.error(f"Report summary failed: {str(e)}", exc_info=True)
+            summary = "## EXECUTIVE SUMMARY\n\n_The summary could not be generated._"
+            failed.append("Executive Summary")
+            self._update(job, {'type': 'summary', 'status': 'failed'})
+        return {
+            'dataset_key': dataset['key'],
+            'content_hash': dataset['content_hash'],
+            'prompt_version': PROMPT_VERSION,
+            'created_at': time.time(),
+            'failed_sections': failed,
+            'markdown': '\n\n'.join(["# Sales Performance Report", summary] + texts),
+        }
+
+    def _admit(self, fn, *args):
+        """
+        Run fn(*args) on the agent worker pool once a section slot is free and the pool
+        has room for it; returns its future (blocks the coordinator until then)
+        """
+        self._section_slots.acquire()
+        try:
+            future = self.workers.start_when_admitted(fn, *args)
+        except BaseException:
+            self._section_slots.release()
+            raise
+        future.add_done_callback(lambda _: self._section_slots.release())
+        return future
+
+    def _set_section(self, job, index, **changes):
+        with self._lock:
+            job['sections'][index].update(changes)
+        section = job['sections'][index]
+        if changes.get('status') in ('done', 'failed'):
+            self._update(job, {'type': 'section', 'number': section['number'], 'title': section['title'],
+                               'status': section['status'], 'ms': section['ms']})
+        else:
+            self._update(job)
+
+    def shutdown(self):
+        self._coordinators.shutdown(wait=False, cancel_futures=True)
+
+
+report_jobs = ReportJobs()
@@ -0,0 +1,169 @@
+from prometheus_client import Histogram
+from contextlib import contextmanager
+import contextvars
+import functools
+import threading
+import logging
+import random
+import json
+import time
+import uuid
+import os
+
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '10'))
+SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', '1.0'))
+
+logger = logging.getLogger("Telemetry")
+
+# Stages a request can spend time in, in the order they usually happen (download is part of ingest)
+STAGES = ('queue_wait', 'resolve_url', 'download', 'ingest', 'plan', 'agent_build', 'llm', 'tool', 'format')
+
+# Per-request counts and the buckets their histograms use
+COUNTERS = {
+    'llm_calls': (0, 1, 2, 3, 5, 8, 13, 21),
+    'tool_calls': (0, 1, 2, 3, 5, 8, 13, 21),
+    'prompt_tokens': (0, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000),
+    # Prompt tokens the provider served from its prompt cache
+    'cached_prompt_tokens': (0, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000),
+    'completion_tokens': (0, 100, 250, 500, 1000, 2000, 4000, 8000),
+    'rows_scanned': (0, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8),
+    # Agent queries answered from the query cache, the time they took the first time, and
+    # result rows left out of the prompt
+    'query_cache_hits': (0, 1, 2, 3, 5, 8, 13, 21),
+    'query_ms_saved': (0, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+    'rows_truncated': (0, 10, 100, 1e3, 1e4, 1e5, 1e6),
+    'bytes_downloaded': (0, 1e5, 1e6, 1e7, 1e8, 1e9),
+}
+
+REQUEST_SECONDS = Histogram(
+    'sales_agent_request_seconds', "Time to answer a request", ['endpoint', 'status'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120),
+)
+STAGE_SECONDS = Histogram(
+    'sales_agent_stage_seconds', "Time spent in each stage of answering a request", ['stage'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40),
+)
+REQUEST_COUNTS = {
+    name: Histogram(f'sales_agent_request_{name}', f"{name.replace('_', ' ').capitalize()} per request",
+                    ['endpoint'], buckets=buckets)
+    for name, buckets in COUNTERS.items()
+}
+
+_current = contextvars.ContextVar('sales_agent_trace', default=None)
+
+
+class Trace:
+    """
+    Timing spans and counters for one request
+
+    The trace lives in a context variable, so it follows the request onto the worker
+    thread (the worker pool runs jobs in a copy of the request's context) and any code
+    on the way can add spans and counts without it being passed around.
+    """
+
+    def __init__(self, endpoint):
+        self.id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []  # (stage, offset seconds, duration seconds)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, start, duration):
+        with self._lock:
+            self.spans.append((stage, start - self.started, duration))
+
+    def add(self, counter, amount=1):
+        with self._lock:
+            self.counts[counter] += amount
+
+    def stage_totals(self):
+        """Seconds per stage, summed over repeated spans (e.g. several LLM calls)"""
+        totals = {}
+        with self._lock:
+            for stage, _, duration in self.spans:
+                totals[stage] = totals.get(stage, 0.0) + duration
+        return totals
+
+    def server_timing(self):
+        """The trace as a Server-Timing header value (durations in milliseconds)"""
+        totals = self.stage_totals()
+        parts = [f"{stage};dur={totals[stage] * 1000:.1f}" for stage in STAGES if stage in totals]
+        elapsed = self.duration if self.duration is not None else time.perf_counter() - self.started
+        parts.append(f"total;dur={elapsed * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self):
+        """Stage timings (ms) and counters, for logs and the end of a stream"""
+        return {
+            'trace_id': self.id,
+            'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in self.stage_totals().items()},
+            'counts': dict(self.counts),
+        }
+
+    def details(self):
+        with self._lock:
+            spans = [{'stage': stage, 'offset_ms': round(offset * 1000, 1), 'ms': round(duration * 1000, 1)}
+                     for stage, offset, duration in self.spans]
+        return dict(self.summary(), endpoint=self.endpoint, total_ms=round((self.duration or 0) * 1000, 1),
+                    spans=spans)
+
+
+def start_trace(endpoint):
+    """Start tracing a request in the current context and return the trace"""
+    trace = Trace(endpoint)
+    _current.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+def finish_trace(trace, status):
+    """Record a finished request's metrics and log it if it was slow (sampled)"""
+    if trace.duration is not None:
+        return
+    trace.duration = time.perf_counter() - trace.started
+    REQUEST_SECONDS.labels(trace.endpoint, str(status)).observe(trace.duration)
+    for name, value in trace.counts.items():
+        REQUEST_COUNTS[name].labels(trace.endpoint).observe(value)
+    if trace.duration >= SLOW_REQUEST_SECONDS and random.random() < SLOW_REQUEST_SAMPLE_RATE:
+        logger.warning(f"Slow request {trace.endpoint} took {trace.duration:.1f}s: {json.dumps(trace.details())}")
+
+
+def observe(stage, start, duration):
+    """Record a stage that has already been timed"""
+    STAGE_SECONDS.labels(stage).observe(duration)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(stage, start, duration)
+
+
+@contextmanager
+def span(stage):
+    """Time a block as one stage of the current request (also counted when there is no request)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, start, time.perf_counter() - start)
+
+
+def timed(stage):
+    """Decorator that times every call of a function as a stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(counter, amount=1):
+    """Add to one of the current request's counters"""
+    trace = _current.get()
+    if trace is not None and amount:
+        trace.add(counter, amount)
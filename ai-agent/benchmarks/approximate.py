@@ -0,0 +1,128 @@
+"""
+Latency and error of approximate answers from the stratified sample
+
+Builds the sample of a large synthetic dataset (see app.data.sample) and runs
+aggregates an analyst typically needs twice, exactly over sales_data and estimated
+with _sample_weight over sales_data as approximate mode exposes it (the sample),
+reporting the time of each and the relative error of the estimates per group. Checks
+that total revenue is within the margin the sample states. No network or OpenAI key needed.
+
+Usage:
+    python benchmarks/approximate.py [--rows 5000000] [--repeat 5] [--json]
+"""
+import statistics
+import tempfile
+import argparse
+import json
+import time
+import sys
+import os
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+os.environ.setdefault('DATA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sales-analysis-prompt-tokens'))
+
+from prompt_tokens import build_dataset
+from app.data.ingest import open_dataset_connection
+from app.data.sample import get_sample
+
+# (name, exact query, estimate over the sample); group columns first, the value last
+QUERIES = [
+    ("total revenue",
+     "SELECT sum(TotalAmount) FROM sales_data",
+     "SELECT sum(TotalAmount * _sample_weight) FROM sales_data"),
+    ("revenue by month",
+     "SELECT date_trunc('month', OrderDate), sum(TotalAmount) FROM sales_data GROUP BY 1",
+     "SELECT date_trunc('month', OrderDate), sum(TotalAmount * _sample_weight) FROM sales_data GROUP BY 1"),
+    ("units by product",
+     "SELECT ProductName, sum(Quantity) FROM sales_data GROUP BY 1",
+     "SELECT ProductName, sum(Quantity * _sample_weight) FROM sales_data GROUP BY 1"),
+    ("revenue by region and product",
+     "SELECT Region, ProductName, sum(TotalAmount) FROM sales_data GROUP BY ALL",
+     "SELECT Region, ProductName, sum(TotalAmount * _sample_weight) FROM sales_data GROUP BY ALL"),
+    ("average line value by region",
+     "SELECT Region, avg(TotalAmount) FROM sales_data GROUP BY 1",
+     "SELECT Region, sum(TotalAmount * _sample_weight) / sum(_sample_weight) FROM sales_data GROUP BY 1"),
+    ("median unit price by region",
+     "SELECT Region, median(UnitPrice) FROM sales_data GROUP BY 1",
+     "SELECT Region, quantile_cont(UnitPrice, 0.5) FROM sales_data GROUP BY 1"),
+]
+
+
+def timed_query(con, sql, repeat):
+    """(median milliseconds over repeat runs, {group: value})"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = con.execute(sql).fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), {tuple(row[:-1]): float(row[-1]) for row in rows}
+
+
+def measure(rows, repeat):
+    table_path = build_dataset(rows)
+    start = time.perf_counter()
+    sample = get_sample(table_path)
+    build_ms = (time.perf_counter() - start) * 1000
+    if not sample['path']:
+        raise SystemExit(f"{rows} rows is below SAMPLE_MIN_ROWS, no sample was built")
+
+    exact_con = open_dataset_connection(table_path)
+    sample_con = open_dataset_connection(table_path, sample=sample)
+    results = []
+    try:
+        for name, exact_sql, sample_sql in QUERIES:
+            exact_ms, exact = timed_query(exact_con, exact_sql, repeat)
+            sample_ms, estimate = timed_query(sample_con, sample_sql, repeat)
+            errors = [abs(estimate.get(group, 0.0) - value) / abs(value) for group, value in exact.items() if value]
+            results.append({
+                'query': name,
+                'groups': len(exact),
+                'exact_ms': round(exact_ms, 2),
+                'sample_ms': round(sample_ms, 2),
+                'speedup': round(exact_ms / sample_ms, 1) if sample_ms else None,
+                'median_error': round(statistics.median(errors), 5) if errors else None,
+                'max_error': round(max(errors), 5) if errors else None,
+            })
+    finally:
+        exact_con.close()
+        sample_con.close()
+
+    total_error = results[0]['max_error']
+    return {
+        'rows': rows,
+        'sample_rows': sample['rows'],
+        'fraction': round(sample['fraction'], 4),
+        'strata': sample['strata'],
+        'build_ms': round(build_ms, 1),
+        'stated_revenue_margin': round(sample['revenue_margin'], 5),
+        'revenue_within_margin': total_error <= sample['revenue_margin'],
+        'queries': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare exact and sampled answers on a large dataset")
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = measure(args.rows, args.repeat)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0 if report['revenue_within_margin'] else 1
+
+    print(f"Sample of {report['sample_rows']} of {report['rows']} rows ({report['fraction']:.2%}) in "
+          f"{report['strata']} strata, built in {report['build_ms']:.0f} ms; total revenue stated within "
+          f"±{report['stated_revenue_margin']:.3%}, {'met' if report['revenue_within_margin'] else 'NOT met'}")
+    print(f"{'query':<32} {'groups':>6} {'exact ms':>9} {'sample ms':>9} {'speedup':>8} {'median err':>10} {'max err':>8}")
+    for result in report['queries']:
+        print(f"{result['query']:<32} {result['groups']:>6} {result['exact_ms']:>9.2f} {result['sample_ms']:>9.2f} "
+              f"{result['speedup']:>7.1f}x {result['median_error']:>10.3%} {result['max_error']:>8.3%}")
+    return 0 if report['revenue_within_margin'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Revalidation, resume and deduplication of dataset downloads
+
+Serves synthetic CSVs from the stub backend, which answers like S3 (ETag,
+Last-Modified, 304, Range), and materializes them through app.data.ingest in a fresh
+DATA_CACHE_DIR:
+
+  - cold: the first download
+  - unchanged: the URL is revalidated, which should transfer no body
+  - re-upload: new content under the same URL, which should be downloaded and
+    reported to the dataset change listeners
+  - interrupted: a download cut off halfway, which should resume with a Range request
+  - concurrent: several requests for new content at once, which should share one download
+
+Usage:
+    python benchmarks/blob_store.py [--rows 200000] [--json]
+"""
+import concurrent.futures
+import tempfile
+import argparse
+import hashlib
+import json
+import time
+import sys
+import os
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+CSV_DIR = os.path.join(tempfile.gettempdir(), 'sales-analysis-blob-store')
+os.environ['DATA_CACHE_DIR'] = tempfile.mkdtemp(prefix='sales-analysis-blobs-')
+
+from synthetic_sales import generate
+from stub_backend import StubBackend
+from app.data import blob_store
+from app.data.ingest import materialize_dataset, add_change_listener
+
+CONCURRENT_REQUESTS = 8
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def measure(rows):
+    versions = [generate(rows + extra, os.path.join(CSV_DIR, f'sales_{rows + extra}.csv')) for extra in range(4)]
+    stub = StubBackend({'sales': versions[0]}).start()
+    url = stub.file_url('sales')
+    changes = []
+    add_change_listener(lambda dataset, previous_path: changes.append(dataset['content_hash']))
+    # Check the URL on every use, as if the revalidation window had passed
+    blob_store.BLOB_REVALIDATE_SECONDS = 0
+
+    def stage(name, version=None, requests=1):
+        if version is not None:
+            stub.add_file('sales', versions[version])
+        before = (stub.downloads, stub.not_modified, stub.bytes_sent, len(changes))
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(requests) as pool:
+            datasets = list(pool.map(lambda _: materialize_dataset(url, 'sales'), range(requests)))
+        return {
+            'stage': name,
+            'ms': round((time.perf_counter() - start) * 1000, 1),
+            'downloads': stub.downloads - before[0],
+            'not_modified': stub.not_modified - before[1],
+            'bytes_sent': stub.bytes_sent - before[2],
+            'file_bytes': os.path.getsize(versions[version if version is not None else 0]),
+            'content_changed': len(changes) > before[3],
+            'content_hash': datasets[0]['content_hash'],
+            'same_dataset': len({dataset['content_hash'] for dataset in datasets}) == 1,
+        }
+
+    try:
+        results = [stage('cold')]
+        results.append(stage('unchanged'))
+        results.append(stage('re-upload', 1))
+        stub.break_next_download(os.path.getsize(versions[2]) // 2)
+        results.append(stage('interrupted', 2))
+        results.append(stage('concurrent', 3, CONCURRENT_REQUESTS))
+    finally:
+        stub.stop()
+
+    cold, unchanged, reupload, interrupted, shared = results
+    blobs = [name for name in os.listdir(blob_store.BLOB_DIR) if name.endswith('.csv')]
+    checks = {
+        'unchanged_transfers_no_body': unchanged['bytes_sent'] == 0 and unchanged['not_modified'] == 1,
+        're_upload_invalidates': reupload['content_changed'] and reupload['content_hash'] != cold['content_hash'],
+        # The chunk being read when the connection broke is fetched again
+        'interrupted_resumes': (interrupted['downloads'] == 2 and
+                                interrupted['bytes_sent'] <= interrupted['file_bytes'] + blob_store.DOWNLOAD_CHUNK_SIZE),
+        'resumed_content_intact': interrupted['content_hash'] == file_hash(versions[2]),
+        'concurrent_share_one_download': shared['downloads'] == 1 and shared['same_dataset'],
+        'superseded_blobs_removed': len(blobs) == 1,
+    }
+    return {'rows': rows, 'stages': results, 'checks': checks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check revalidation, resume and dedupe of dataset downloads")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = measure(args.rows)
+    ok = all(report['checks'].values())
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0 if ok else 1
+
+    print(f"{'stage':<12} {'ms':>8} {'GETs':>5} {'304s':>5} {'bytes sent':>11} {'file bytes':>11}")
+    for result in report['stages']:
+        print(f"{result['stage']:<12} {result['ms']:>8.1f} {result['downloads']:>5} {result['not_modified']:>5} "
+              f"{result['bytes_sent']:>11} {result['file_bytes']:>11}")
+    for check, passed in report['checks'].items():
+        print(f"{'ok  ' if passed else 'FAIL'} {check}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Local stand-in for the OpenAI chat completions API
+
+Answers POST /v1/chat/completions (plain and streamed) from a script instead of a
+model, after a configurable delay, so the agent can be exercised without network
+access. Point the service at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+A script is a JSON file:
+
+    {
+        "latency_ms": 400,          # delay before each response
+        "token_latency_ms": 2,      # delay between streamed chunks
+        "steps": [
+            {"tool_call": {"name": "run_query", "arguments": {"query": "SELECT ..."}}},
+            {"content": "Final answer in markdown"}
+        ]
+    }
+
+Each completion request plays the step after the ones already in the conversation
+(counted by its tool-calling assistant turns), so an agent sees its tool calls
+followed by the final answer.
+
+Usage:
+    python benchmarks/fake_openai.py [--port 8901] [--script script.json]
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import argparse
+import json
+import time
+import uuid
+import sys
+
+DEFAULT_ANSWER = """EXECUTIVE SUMMARY:
+Revenue grew steadily across the period, led by the top three products. Focus promotion on the weekday slump.
+
+1. Sales Performance Metrics:
+- Total Sales Revenue: $1,234,567.89
+- Total Number of Sales: 45,678
+- Average Order Value: $27.03
+- Sales Growth Rate: 4.2 % month-over-month
+
+```sql
+SELECT sum(TotalAmount) FROM sales_data
+```
+
+2. Product Performance & Profitability:
+| Product | Revenue |
+|---|---|
+| Chocolate Cake | $210,000.00 |
+| Red Velvet | $180,500.00 |
+
+8. Strategic Recommendations:
+- Bundle slow movers with best sellers
+- Extend weekend opening hours
+- Review pricing of the bottom five products
+"""
+
+DEFAULT_SCRIPT = {
+    'latency_ms': 400,
+    'token_latency_ms': 2,
+    'steps': [
+        {'tool_call': {'name': 'run_query', 'arguments': {
+            'query': "SELECT strftime(date_trunc('month', OrderDate), '%Y-%m') AS month, sum(TotalAmount) AS revenue "
+                     "FROM sales_data GROUP BY ALL ORDER BY month"
+        }}},
+        {'tool_call': {'name': 'run_query', 'arguments': {
+            'query': "SELECT ProductName, sum(TotalAmount) AS revenue FROM sales_data GROUP BY ALL "
+                     "ORDER BY revenue DESC LIMIT 5"
+        }}},
+        {'content': DEFAULT_ANSWER},
+    ],
+}
+
+
+class FakeOpenAI:
+    """Scripted chat completions server running on a background thread"""
+
+    def __init__(self, script=None, host='127.0.0.1', port=0):
+        self.script = script or DEFAULT_SCRIPT
+        self.requests = 0
+        self.tool_calls = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'tool_calls': self.tool_calls}
+
+    def next_step(self, messages):
+        steps = self.script['steps']
+        # Every tool-calling assistant turn already in the conversation is a step played
+        played = sum(1 for message in messages if message.get('role') == 'assistant' and message.get('tool_calls'))
+        step = steps[min(played, len(steps) - 1)]
+        with self._lock:
+            self.requests += 1
+            if 'tool_call' in step:
+                self.tool_calls += 1
+        return step
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/models'):
+                    self._json(200, {'object': 'list', 'data': [{'id': 'gpt-4o', 'object': 'model'}]})
+                else:
+                    self._json(404, {'error': {'message': 'not found'}})
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._json(404, {'error': {'message': 'not found'}})
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                step = fake.next_step(body.get('messages', []))
+                time.sleep(fake.script.get('latency_ms', 0) / 1000)
+                if body.get('stream'):
+                    self._stream(body, step)
+                else:
+                    self._json(200, completion(body, step))
+
+            def _json(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, body, step):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                delay = fake.script.get('token_latency_ms', 0) / 1000
+                for chunk in stream_chunks(body, step):
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    if delay:
+                        time.sleep(delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def _usage(body, text):
+    prompt_tokens = sum(len(str(message.get('content') or '')) for message in body.get('messages', [])) // 4
+    completion_tokens = len(text) // 4
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens}
+
+
+def _tool_call(step):
+    return {
+        'id': f"call_{uuid.uuid4().hex[:24]}",
+        'type': 'function',
+        'function': {'name': step['tool_call']['name'], 'arguments': json.dumps(step['tool_call']['arguments'])},
+    }
+
+
+def completion(body, step):
+    """A non-streamed chat.completion for one script step"""
+    if 'tool_call' in step:
+        message = {'role': 'assistant', 'content': None, 'tool_calls': [_tool_call(step)]}
+        finish_reason, text = 'tool_calls', json.dumps(step['tool_call'])
+    else:
+        message = {'role': 'assistant', 'content': step['content']}
+        finish_reason, text = 'stop', step['content']
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'gpt-4o'),
+        'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+        'usage': _usage(body, text),
+    }
+
+
+def stream_chunks(body, step, chunk_chars=24):
+    """chat.completion.chunk objects for one script step"""
+    base = {'id': f"chatcmpl-{uuid.uuid4().hex}", 'object': 'chat.completion.chunk',
+            'created': int(time.time()), 'model': body.get('model', 'gpt-4o')}
+
+    def chunk(delta, finish_reason=None):
+        return dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': finish_reason}])
+
+    if 'tool_call' in step:
+        call = _tool_call(step)
+        yield chunk({'role': 'assistant', 'content': None, 'tool_calls': [dict(call, index=0)]})
+        yield chunk({}, 'tool_calls')
+        text = json.dumps(step['tool_call'])
+    else:
+        text = step['content']
+        yield chunk({'role': 'assistant', 'content': ''})
+        for start in range(0, len(text), chunk_chars):
+            yield chunk({'content': text[start:start + chunk_chars]})
+        yield chunk({}, 'stop')
+    if (body.get('stream_options') or {}).get('include_usage'):
+        yield dict(base, choices=[], usage=_usage(body, text))
+
+
+def load_script(path):
+    if not path:
+        return DEFAULT_SCRIPT
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve scripted OpenAI chat completions locally")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--script', help="JSON script of tool calls and answers (see module docstring)")
+    parser.add_argument('--latency-ms', type=float, help="override the script's latency_ms")
+    args = parser.parse_args()
+
+    script = dict(load_script(args.script))
+    if args.latency_ms is not None:
+        script['latency_ms'] = args.latency_ms
+    fake = FakeOpenAI(script, args.host, args.port).start()
+    print(f"Fake OpenAI API on {fake.base_url}", flush=True)
+    try:
+        fake.thread.join()
+    except KeyboardInterrupt:
+        fake.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
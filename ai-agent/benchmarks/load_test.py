@@ -0,0 +1,279 @@
+"""
+Offline load test of the chat API
+
+Starts a fake OpenAI API (benchmarks/fake_openai.py), a stub backend URL service
+(benchmarks/stub_backend.py) and the API itself under uvicorn, all on localhost, then
+for each synthetic dataset size:
+
+  1. makes the dataset the current upload and sends one cold request, which pays for
+     the download, DuckDB ingest, profile, rollups and agent construction
+  2. drives POST /chat at each concurrency level with distinct analysis questions
+     (so the answer cache doesn't short-circuit them)
+
+and reports p50/p95/p99 latency, throughput and the server's peak RSS (VmHWM, reset
+between levels) as JSON. With --baseline, p95 latency and throughput are compared
+against an earlier report and the run fails on regressions beyond --tolerance.
+
+Usage:
+    python benchmarks/load_test.py [--sizes 10000,100000,1000000,10000000] [--concurrency 1,4,16]
+                                   [--requests 32] [--latency-ms 400] [--output report.json]
+                                   [--baseline previous.json --tolerance 0.2]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import statistics
+import tempfile
+import argparse
+import requests
+import socket
+import shutil
+import json
+import time
+import sys
+import os
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+AI_AGENT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_openai import FakeOpenAI, load_script
+from stub_backend import StubBackend
+from synthetic_sales import generate
+
+DEFAULT_SIZES = '10000,100000,1000000,10000000'
+DEFAULT_CONCURRENCY = '1,4,16'
+WORK_DIR = os.path.join(tempfile.gettempdir(), 'sales-analysis-loadtest')
+
+# Analysis questions the router sends to the agent rather than the KPI engine
+QUESTIONS = [
+    "Give me a sales performance report",
+    "Which products should we promote next month and why",
+    "Compare revenue across regions",
+    "Show the monthly sales trend with peak periods",
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def read_status(pid, field):
+    """A field of /proc/<pid>/status in kB, or None where /proc isn't available"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def reset_peak_rss(pid):
+    """Reset VmHWM so the next reading covers only what follows (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def start_api(port, env, log_path):
+    log = open(log_path, 'ab')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.api.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=AI_AGENT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API exited with code {process.returncode}, see {log_path}")
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/health', timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"API did not become healthy within 60s, see {log_path}")
+
+
+def post_chat(session, url, message):
+    start = time.perf_counter()
+    try:
+        response = session.post(url, json={'message': message}, timeout=600)
+        status = response.status_code
+    except requests.RequestException:
+        status = None
+    return status, (time.perf_counter() - start) * 1000
+
+
+def run_level(url, concurrency, count, offset):
+    """Send count requests with concurrency in flight and return their (status, ms) results and wall time"""
+    messages = [f"{QUESTIONS[i % len(QUESTIONS)]} (request {offset + i})" for i in range(count)]
+    sessions = [requests.Session() for _ in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda item: post_chat(sessions[item[0] % concurrency], url, item[1]), enumerate(messages)
+        ))
+    wall = time.perf_counter() - start
+    for session in sessions:
+        session.close()
+    return results, wall
+
+
+def summarize_level(concurrency, results, wall, peak_rss_kb, llm_requests):
+    ok = [ms for status, ms in results if status == 200]
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'ok': len(ok),
+        'rejected': sum(1 for status, _ in results if status == 503),
+        'errors': sum(1 for status, _ in results if status not in (200, 503)),
+        'p50_ms': percentile(ok, 0.50),
+        'p95_ms': percentile(ok, 0.95),
+        'p99_ms': percentile(ok, 0.99),
+        'mean_ms': statistics.fmean(ok) if ok else None,
+        'throughput_rps': len(ok) / wall if wall else None,
+        'peak_rss_mb': peak_rss_kb / 1024 if peak_rss_kb else None,
+        'llm_requests': llm_requests,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of p95 latency or throughput beyond tolerance, matched by dataset size and concurrency"""
+    previous = {(stage['rows'], level['concurrency']): level
+                for stage in baseline.get('stages', []) for level in stage['levels']}
+    regressions = []
+    for stage in report['stages']:
+        for level in stage['levels']:
+            before = previous.get((stage['rows'], level['concurrency']))
+            if not before:
+                continue
+            where = f"{stage['rows']} rows x {level['concurrency']} concurrent"
+            if before.get('p95_ms') and level.get('p95_ms') and level['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{where}: p95 {before['p95_ms']:.0f} -> {level['p95_ms']:.0f} ms")
+            if (before.get('throughput_rps') and level.get('throughput_rps')
+                    and level['throughput_rps'] < before['throughput_rps'] * (1 - tolerance)):
+                regressions.append(f"{where}: throughput {before['throughput_rps']:.2f} -> "
+                                   f"{level['throughput_rps']:.2f} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /chat offline with stub OpenAI and backend servers")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="comma-separated dataset row counts")
+    parser.add_argument('--concurrency', default=DEFAULT_CONCURRENCY, help="comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=32, help="requests per concurrency level")
+    parser.add_argument('--latency-ms', type=float, help="fake OpenAI delay per completion (default from script)")
+    parser.add_argument('--script', help="fake OpenAI script, see benchmarks/fake_openai.py")
+    parser.add_argument('--work-dir', default=WORK_DIR, help="where synthetic CSVs are cached")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    parser.add_argument('--baseline', help="earlier JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    levels = [int(level) for level in args.concurrency.split(',')]
+    script = dict(load_script(args.script))
+    if args.latency_ms is not None:
+        script['latency_ms'] = args.latency_ms
+
+    csv_dir = os.path.join(args.work_dir, 'csv')
+    os.makedirs(args.work_dir, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix='run-', dir=args.work_dir)
+    fake = FakeOpenAI(script).start()
+    stub = StubBackend().start()
+    port = free_port()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='load-test',
+        OPENAI_BASE_URL=fake.base_url,
+        BACKEND_URL=stub.base_url,
+        DATA_CACHE_DIR=os.path.join(run_dir, 'data'),
+        ANSWER_CACHE_PATH=os.path.join(run_dir, 'answers.sqlite3'),
+        # Measure queueing rather than admission control
+        AGENT_QUEUE_DEPTH=str(max(levels) * 4),
+        # The latest upload changes between stages and requests name no file
+        URL_LIST_TTL_SECONDS='0',
+    )
+    log_path = os.path.join(run_dir, 'api.log')
+    api = start_api(port, env, log_path)
+    url = f'http://127.0.0.1:{port}/chat'
+
+    report = {
+        'config': {'sizes': sizes, 'concurrency': levels, 'requests_per_level': args.requests,
+                   'llm_latency_ms': script.get('latency_ms'), 'llm_steps': len(script['steps'])},
+        'stages': [],
+    }
+    offset = 0
+    try:
+        for rows in sizes:
+            csv_path = generate(rows, os.path.join(csv_dir, f'sales_{rows}.csv'))
+            stub.add_file(f'rows-{rows}', csv_path)
+            print(f"{rows} rows ({os.path.getsize(csv_path) / 1e6:.1f} MB)", file=sys.stderr, flush=True)
+
+            reset_peak_rss(api.pid)
+            status, cold_ms = post_chat(requests, url, f"{QUESTIONS[0]} (cold {rows})")
+            cold_rss_kb = read_status(api.pid, 'VmHWM')
+            stage = {
+                'rows': rows,
+                'csv_bytes': os.path.getsize(csv_path),
+                'cold_request_ms': cold_ms,
+                'cold_status': status,
+                'cold_peak_rss_mb': cold_rss_kb / 1024 if cold_rss_kb else None,
+                'levels': [],
+            }
+            for concurrency in levels:
+                reset_peak_rss(api.pid)
+                llm_before = fake.stats()['requests']
+                results, wall = run_level(url, concurrency, args.requests, offset)
+                offset += args.requests
+                level = summarize_level(concurrency, results, wall, read_status(api.pid, 'VmHWM'),
+                                        fake.stats()['requests'] - llm_before)
+                stage['levels'].append(level)
+                print(f"  c={concurrency}: p50 {level['p50_ms'] or 0:.0f} ms, p95 {level['p95_ms'] or 0:.0f} ms, "
+                      f"{level['throughput_rps'] or 0:.2f} req/s, {level['errors']} errors, "
+                      f"{level['rejected']} rejected", file=sys.stderr, flush=True)
+            report['stages'].append(stage)
+    finally:
+        api.terminate()
+        try:
+            api.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            api.kill()
+        fake.stop()
+        stub.stop()
+        if os.path.exists(log_path):
+            shutil.copy(log_path, os.path.join(args.work_dir, 'last-api.log'))
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+        for regression in report['regressions']:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        exit_code = 1 if report['regressions'] else 0
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
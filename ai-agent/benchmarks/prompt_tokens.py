@@ -0,0 +1,131 @@
+"""
+Prompt tokens per analysis request
+
+Builds the data analyst agent over a synthetic dataset (no network, no OpenAI key
+needed) and, for a set of questions, counts the tokens of the system prompt and the
+question the agent is sent, next to the same request with every report section in the
+system prompt as before. Also checks that the system prompt is byte-for-byte the same
+for every question and for a freshly built agent, which the provider's prompt cache
+needs. Tokens are counted with tiktoken when it is installed, else estimated as
+characters / 4.
+
+Usage:
+    python benchmarks/prompt_tokens.py [--rows 20000] [--json]
+"""
+import tempfile
+import argparse
+import hashlib
+import json
+import sys
+import os
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+os.environ.setdefault('DATA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sales-analysis-prompt-tokens'))
+
+from synthetic_sales import generate
+from app.data.columns import sql_literal
+from app.data.engine import DATA_DIR, connect
+from app.agent.prompts import analyst_instructions, full_report_lines, scope_question
+from app.main import build_data_analyst_agent, prepare_analysis_input
+
+QUESTIONS = [
+    "What was revenue in February 2024?",
+    "Which products sold best in December?",
+    "Who are our most loyal customers?",
+    "Forecast sales for the next three months",
+    "Which items should we discount?",
+    "How did this year compare with last year?",
+    "Suggest ways to increase sales",
+    "Give me a full sales performance report",
+]
+
+
+def token_counter():
+    """(name, function counting the tokens of a string)"""
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model('gpt-4o')
+        return 'tiktoken', lambda text: len(encoding.encode(text))
+    except Exception:
+        return 'chars/4', lambda text: (len(text) + 3) // 4
+
+
+def build_dataset(rows):
+    csv_path = generate(rows, os.path.join(DATA_DIR, 'bench', f'sales_{rows}.csv'))
+    parquet_path = csv_path[:-len('.csv')] + '.parquet'
+    if not os.path.exists(parquet_path):
+        con = connect()
+        try:
+            con.execute(f"COPY (SELECT * FROM read_csv({sql_literal(csv_path)})) "
+                        f"TO {sql_literal(parquet_path)} (FORMAT PARQUET)")
+        finally:
+            con.close()
+    return parquet_path
+
+
+def system_prompt(agent):
+    return agent.get_system_message().content
+
+
+def measure(rows):
+    table_path = build_dataset(rows)
+    counter_name, tokens = token_counter()
+
+    agent = build_data_analyst_agent(table_path)
+    system = system_prompt(agent)
+    rebuilt = system_prompt(build_data_analyst_agent(table_path))
+    # Every report section in the system prompt, as before the instructions were split up
+    legacy_agent = build_data_analyst_agent(table_path)
+    legacy_agent.instructions = analyst_instructions(rollups=True) + full_report_lines(tools=True)
+    legacy_system = system_prompt(legacy_agent)
+
+    results = []
+    for question in QUESTIONS:
+        _, agent_input = prepare_analysis_input(question, table_path)
+        # The same question and KPI context, without the scoped sections
+        legacy_input = question + agent_input[len(scope_question(question, tools=True)):]
+        scoped = tokens(system_prompt(agent)) + tokens(agent_input)
+        legacy = tokens(legacy_system) + tokens(legacy_input)
+        results.append({
+            'question': question,
+            'system_sha': hashlib.sha256(system_prompt(agent).encode('utf-8')).hexdigest()[:12],
+            'question_tokens': tokens(agent_input),
+            'prompt_tokens': scoped,
+            'legacy_prompt_tokens': legacy,
+            'saved': round(1 - scoped / legacy, 3),
+        })
+    return {
+        'tokenizer': counter_name,
+        'rows': rows,
+        'system_tokens': tokens(system),
+        'legacy_system_tokens': tokens(legacy_system),
+        'system_prompt_stable': len({result['system_sha'] for result in results}) == 1 and rebuilt == system,
+        'questions': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the prompt tokens of analysis requests")
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = measure(args.rows)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0 if report['system_prompt_stable'] else 1
+
+    print(f"Tokens counted with {report['tokenizer']}; system prompt {report['system_tokens']} tokens "
+          f"(was {report['legacy_system_tokens']}), "
+          f"{'byte-stable' if report['system_prompt_stable'] else 'NOT stable'} across requests")
+    print(f"{'question':<45} {'question':>9} {'prompt':>7} {'before':>7} {'saved':>6}")
+    for result in report['questions']:
+        print(f"{result['question'][:45]:<45} {result['question_tokens']:>9} {result['prompt_tokens']:>7} "
+              f"{result['legacy_prompt_tokens']:>7} {result['saved']:>6.1%}")
+    return 0 if report['system_prompt_stable'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
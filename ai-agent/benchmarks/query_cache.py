@@ -0,0 +1,96 @@
+"""
+Query memoization for the agent's DuckDB tool calls
+
+Runs the aggregates the analyst agent typically issues through the instrumented
+DuckDB tools of two agents over the same synthetic dataset, the second time with
+different whitespace, case and comments, and reports the time per query cold and
+from the cache, the cache stats and the rows kept out of the prompt by the row cap.
+No network or OpenAI key needed.
+
+Usage:
+    python benchmarks/query_cache.py [--rows 200000] [--json]
+"""
+import tempfile
+import argparse
+import json
+import time
+import sys
+import os
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+os.environ.setdefault('DATA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sales-analysis-prompt-tokens'))
+
+from prompt_tokens import build_dataset
+from app.data.ingest import open_dataset_connection
+from app.data.query_cache import query_cache
+from app.agent.instrumented import SalesDuckDbTools
+
+QUERIES = [
+    "SELECT sum(TotalAmount) AS total_revenue FROM sales_data",
+    "SELECT date_trunc('month', OrderDate) AS month, sum(TotalAmount) AS revenue FROM sales_data GROUP BY 1 ORDER BY 1",
+    "SELECT ProductName, sum(TotalAmount) AS revenue FROM sales_data GROUP BY ProductName ORDER BY revenue DESC LIMIT 10",
+    "SELECT CustomerName, count(DISTINCT OrderID) AS orders, sum(TotalAmount) AS revenue FROM sales_data "
+    "GROUP BY CustomerName ORDER BY revenue DESC",
+    "SELECT * FROM sales_data WHERE TotalAmount > 100",
+]
+
+
+def restyle(query):
+    """The same query as an agent might write it another time"""
+    return '-- again\n' + query.replace(' FROM ', '\n  from ').replace('SELECT', 'select') + ';'
+
+
+def tools(table_path):
+    return SalesDuckDbTools(connection=open_dataset_connection(table_path), dataset=table_path)
+
+
+def timed_run(duckdb_tools, query):
+    start = time.perf_counter()
+    output = duckdb_tools.run_query(query)
+    return (time.perf_counter() - start) * 1000, output
+
+
+def measure(rows):
+    table_path = build_dataset(rows)
+    query_cache.clear()
+    first, second = tools(table_path), tools(table_path)
+    results = []
+    for query in QUERIES:
+        cold_ms, cold = timed_run(first, query)
+        warm_ms, warm = timed_run(second, restyle(query))
+        results.append({
+            'query': query,
+            'cold_ms': round(cold_ms, 2),
+            'cached_ms': round(warm_ms, 2),
+            'same_output': cold == warm,
+            'prompt_lines': cold.count('\n') + 1,
+        })
+    return {'rows': rows, 'queries': results, 'cache': query_cache.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the DuckDB query cache of the analyst agent")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = measure(args.rows)
+    ok = all(result['same_output'] for result in report['queries']) and report['cache']['hits'] == len(QUERIES)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0 if ok else 1
+
+    print(f"{'query':<60} {'cold ms':>8} {'cached':>8} {'lines':>6}")
+    for result in report['queries']:
+        print(f"{result['query'][:60]:<60} {result['cold_ms']:>8.2f} {result['cached_ms']:>8.2f} "
+              f"{result['prompt_lines']:>6}{'' if result['same_output'] else '  DIFFERENT OUTPUT'}")
+    cache = report['cache']
+    print(f"Cache: {cache['hits']} hits, {cache['misses']} misses, {cache['items']} results in {cache['bytes']} bytes, "
+          f"{cache['seconds_saved'] * 1000:.1f} ms saved, {cache['rows_truncated']} rows kept out of the prompt")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Accuracy and latency of the chat intent router
+
+Routes a labeled set of chat messages (none of them used to train the router) and
+reports accuracy, the misrouted messages and per-decision latency in microseconds.
+The substring checks the router replaced are scored on the same set for comparison.
+
+Usage:
+    python benchmarks/router_bench.py [--repeat 200] [--json]
+"""
+from collections import Counter
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.agent.router import route_message
+
+LABELED_QUERIES = [
+    ('greeting', "hi"), ('greeting', "Hello!"), ('greeting', "hey there"), ('greeting', "Good afternoon"),
+    ('greeting', "hi again"), ('greeting', "thank you!"), ('greeting', "thanks, that's great"),
+    ('greeting', "who are you?"), ('greeting', "what can you do"), ('greeting', "Howdy team"),
+    ('greeting', "good evening"), ('greeting', "hey, how's it going"),
+    ('upload', "I just uploaded a new file"), ('upload', "new file uploaded"),
+    ('upload', "I uploaded my csv file, what do you need?"), ('upload', "uploading a new dataset now"),
+    ('upload', "Can I upload sales data?"), ('upload', "here is a new csv"),
+    ('kpi', "What is the total revenue?"), ('kpi', "total sales"), ('kpi', "How many orders do we have?"),
+    ('kpi', "what's our average order value"), ('kpi', "What is the month-over-month growth?"),
+    ('kpi', "top selling products"), ('kpi', "Show me the best selling items"),
+    ('kpi', "which are the worst selling products"), ('kpi', "what is the yoy growth"),
+    ('kpi', "number of transactions"), ('kpi', "AOV?"), ('kpi', "top 5 products by revenue"),
+    ('analysis', "this month's shipping costs"), ('analysis', "Which products sold best in December?"),
+    ('analysis', "why did revenue fall last month"), ('analysis', "give me a complete sales performance report"),
+    ('analysis', "compare revenue across regions"), ('analysis', "who are our most loyal customers"),
+    ('analysis', "forecast next quarter's sales"), ('analysis', "what share of customers came back"),
+    ('analysis', "hi, can you help me understand my sales data"), ('analysis', "What are the peak sales hours?"),
+    ('analysis', "show the weekly trend for chocolate cake"), ('analysis', "which items should we discount"),
+    ('analysis', "top 10 customers by spend"), ('analysis', "revenue by weekday"),
+    ('analysis', "how did this year compare with 2023"), ('analysis', "what's the profit per product"),
+    ('analysis', "list products that haven't sold in 30 days"), ('analysis', "suggest ways to increase sales"),
+    ('analysis', "sales in the shipping region this week"), ('analysis', "which cakes are trending"),
+    ('analysis', "total revenue for product X"), ('analysis', "total sales by store"),
+    ('analysis', "top 5 products by profit"), ('analysis', "how many orders in the west region"),
+    ('web_search', "what are the latest market trends for bakeries"),
+    ('web_search', "search the web for cupcake price benchmarks"),
+    ('web_search', "what are our competitors doing this season"),
+    ('web_search', "any industry news about dessert consumption"),
+    ('web_search', "look up consumer preferences for vegan cakes online"),
+    ('web_search', "search online for wedding cake trends"),
+    ('web_search', "what does market research say about gluten free demand"),
+    ('web_search', "find news on flour prices on the internet"),
+]
+
+
+def legacy_intent(message):
+    """The substring checks the router replaced (greeting/upload only, everything else analysis)"""
+    lower = message.lower()
+    if "upload" in lower or "new file" in lower or "csv file" in lower:
+        return 'upload'
+    greetings = ["hi", "hello", "hey", "greetings", "good morning", "good afternoon", "howdy"]
+    if any(phrase in lower for phrase in greetings) and len(message.strip().split()) < 3:
+        return 'greeting'
+    return 'analysis'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(repeat):
+    latencies = []
+    for _ in range(repeat):
+        for _, message in LABELED_QUERIES:
+            start = time.perf_counter_ns()
+            route_message(message)
+            latencies.append((time.perf_counter_ns() - start) / 1000)
+
+    confusion = Counter()
+    misrouted = []
+    legacy_correct = 0
+    for expected, message in LABELED_QUERIES:
+        route = route_message(message)
+        confusion[(expected, route.intent)] += 1
+        if route.intent != expected:
+            misrouted.append({'message': message, 'expected': expected, 'routed': route.intent,
+                              'reason': route.reason, 'confidence': round(route.confidence, 3)})
+        # The old checks never told KPI lookups from analysis, so either counts for them
+        legacy = legacy_intent(message)
+        if legacy == expected or (expected == 'kpi' and legacy == 'analysis'):
+            legacy_correct += 1
+
+    total = len(LABELED_QUERIES)
+    return {
+        'queries': total,
+        'accuracy': (total - len(misrouted)) / total,
+        'legacy_accuracy': legacy_correct / total,
+        'per_intent_accuracy': {
+            intent: confusion[(intent, intent)] / count
+            for intent, count in Counter(expected for expected, _ in LABELED_QUERIES).items()
+        },
+        'latency_us': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies),
+        },
+        'decisions': len(latencies),
+        'misrouted': misrouted,
+        'confusion': {f"{expected}->{routed}": count for (expected, routed), count in sorted(confusion.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure intent router accuracy and decision latency")
+    parser.add_argument('--repeat', type=int, default=200, help="passes over the query set for latency")
+    parser.add_argument('--json', action='store_true', help="print the full report as JSON")
+    args = parser.parse_args()
+
+    report = run(args.repeat)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    latency = report['latency_us']
+    print(f"accuracy: {report['accuracy']:.1%} on {report['queries']} queries "
+          f"(substring checks: {report['legacy_accuracy']:.1%})")
+    for intent, accuracy in sorted(report['per_intent_accuracy'].items()):
+        print(f"  {intent:<11} {accuracy:.1%}")
+    print(f"latency: p50 {latency['p50']:.1f} us, p95 {latency['p95']:.1f} us, "
+          f"p99 {latency['p99']:.1f} us over {report['decisions']} decisions")
+    for miss in report['misrouted']:
+        print(f"  misrouted: {miss['message']!r} expected {miss['expected']}, got {miss['routed']} ({miss['reason']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Startup-time budget check for the API module
+
+Imports app.api.main in a fresh interpreter, fails if the import takes longer than
+the budget or tries to open a network connection (e.g. to the backend or OpenAI).
+
+Usage:
+    python benchmarks/startup_budget.py [--budget-ms 1500]
+"""
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+AI_AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import socket
+import json
+import time
+
+attempts = []
+
+def guarded_connect(self, address):
+    attempts.append(repr(address))
+    raise OSError("network access during import")
+
+socket.socket.connect = guarded_connect
+socket.socket.connect_ex = guarded_connect
+
+start = time.perf_counter()
+import app.api.main
+elapsed_ms = (time.perf_counter() - start) * 1000
+
+import sys
+print(json.dumps({
+    "elapsed_ms": elapsed_ms,
+    "network_attempts": attempts,
+    "phi_imported": any(name == "phi" or name.startswith("phi.") for name in sys.modules),
+}))
+'''
+
+
+def measure_import():
+    """Import app.api.main in a clean subprocess and return its timing report"""
+    env = dict(os.environ)
+    env.setdefault('OPENAI_API_KEY', 'startup-budget-check')
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=AI_AGENT_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app.api.main failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that importing the API stays fast and offline")
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', '1500')))
+    args = parser.parse_args()
+
+    report = measure_import()
+    print(f"import app.api.main: {report['elapsed_ms']:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    failures = []
+    if report['elapsed_ms'] > args.budget_ms:
+        failures.append(f"import took {report['elapsed_ms']:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    if report['network_attempts']:
+        failures.append(f"import attempted network connections: {', '.join(report['network_attempts'])}")
+    if report['phi_imported']:
+        failures.append("import pulled in phi; agent construction should be lazy")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Local stand-in for the Node backend's file URL service
+
+Serves the routes the agent uses, GET /api/urls, GET /api/url/latest, GET /api/url/:id and
+GET /api/files/browser/:browserId, for a set of local CSV files, and serves the files themselves from /files/:id, so datasets can
+be "uploaded" without S3. The current file is the latest upload (and the last URL of
+/api/urls), which the load test switches between stages with set_current().
+
+Files are served like S3 serves objects: with an ETag and Last-Modified, answering
+conditional requests with 304 and Range requests with 206. Adding a file under an
+existing ID replaces what its URL serves, like a re-upload under the same name, and
+break_next_download(n) cuts the next download off after n bytes.
+
+Usage:
+    python benchmarks/stub_backend.py [--port 8902] sales.csv [more.csv ...]
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+import threading
+import argparse
+import hashlib
+import json
+import sys
+import os
+
+
+class StubBackend:
+    """File URL service and file server running on a background thread"""
+
+    def __init__(self, files=None, host='127.0.0.1', port=0):
+        self.files = dict(files or {})  # file ID -> local CSV path
+        self.current = next(iter(self.files), None)
+        self.browsers = {}  # file ID -> browser ID that uploaded it
+        self.downloads = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.break_after = None
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def file_url(self, file_id):
+        return f"{self.base_url}/files/{file_id}"
+
+    def add_file(self, file_id, path, current=True, browser_id=None):
+        with self._lock:
+            self.files[file_id] = path
+            if browser_id:
+                self.browsers[file_id] = browser_id
+            if current or self.current is None:
+                self.current = file_id
+
+    def break_next_download(self, after_bytes):
+        with self._lock:
+            self.break_after = after_bytes
+
+    def set_current(self, file_id):
+        with self._lock:
+            self.current = file_id
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                parts = self.path.split('?')[0].strip('/').split('/')
+                with stub._lock:
+                    files = dict(stub.files)
+                    current = stub.current
+                    browsers = dict(stub.browsers)
+                if parts == ['api', 'urls']:
+                    ordered = [file_id for file_id in files if file_id != current] + [current] if current else []
+                    self._json(200, {'urls': [stub.file_url(file_id) for file_id in ordered]})
+                elif parts == ['api', 'url', 'latest']:
+                    if current:
+                        self._json(200, {'id': current, 'url': stub.file_url(current)})
+                    else:
+                        self._json(404, {'error': 'No files uploaded'})
+                elif len(parts) == 3 and parts[:2] == ['api', 'url'] and parts[2] in files:
+                    self._json(200, {'url': stub.file_url(parts[2])})
+                elif len(parts) == 4 and parts[:3] == ['api', 'files', 'browser']:
+                    # Newest upload first, like the backend
+                    uploads = [file_id for file_id in reversed(list(files)) if browsers.get(file_id) == parts[3]]
+                    self._json(200, {'files': [
+                        {'_id': file_id, 'file_name': os.path.basename(files[file_id]),
+                         'file_url': stub.file_url(file_id), 'file_type': 'text/csv'}
+                        for file_id in uploads
+                    ]})
+                elif len(parts) == 2 and parts[0] == 'files' and parts[1] in files:
+                    self._file(files[parts[1]])
+                else:
+                    self._json(404, {'message': 'File not found'})
+
+            def _json(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _file(self, path):
+                stat = os.stat(path)
+                size = stat.st_size
+                etag = '"' + hashlib.md5(f'{path}:{size}:{stat.st_mtime_ns}'.encode('utf-8')).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    with stub._lock:
+                        stub.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                start = 0
+                range_header = self.headers.get('Range', '')
+                if range_header.startswith('bytes=') and self.headers.get('If-Range') in (None, etag):
+                    start = int(range_header[len('bytes='):].split('-')[0])
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                with stub._lock:
+                    stub.downloads += 1
+                    cut, stub.break_after = stub.break_after, None
+                self.send_response(206 if start else 200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', formatdate(stat.st_mtime, usegmt=True))
+                self.send_header('Accept-Ranges', 'bytes')
+                if start:
+                    self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+                self.send_header('Content-Length', str(size - start))
+                self.end_headers()
+                remaining = size - start if cut is None else min(cut, size - start)
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    while remaining:
+                        chunk = f.read(min(remaining, 1024 * 1024))
+                        self.wfile.write(chunk)
+                        remaining -= len(chunk)
+                        with stub._lock:
+                            stub.bytes_sent += len(chunk)
+                if cut is not None:
+                    self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local CSV files through the backend's URL routes")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8902)
+    parser.add_argument('files', nargs='+', help="CSV files; the file ID is the file name without extension")
+    args = parser.parse_args()
+
+    files = {os.path.splitext(os.path.basename(path))[0]: os.path.abspath(path) for path in args.files}
+    stub = StubBackend(files, args.host, args.port).start()
+    print(f"Stub backend on {stub.base_url} (BACKEND_URL), files: {', '.join(files)}", flush=True)
+    try:
+        stub.thread.join()
+    except KeyboardInterrupt:
+        stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Synthetic sales CSVs for benchmarking
+
+Generates a deterministic sales file of any size with DuckDB (10M rows take a few
+seconds), using the column names the analyst and the fake OpenAI script expect:
+OrderID, OrderDate, ProductName, CustomerName, Region, Quantity, UnitPrice, TotalAmount.
+Every order has two lines and the orders span two years.
+
+Usage:
+    python benchmarks/synthetic_sales.py --rows 1000000 --output sales_1m.csv
+"""
+import argparse
+import duckdb
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.data.columns import sql_literal
+
+PRODUCTS = 60
+CUSTOMERS = 5000
+REGIONS = ['North', 'South', 'East', 'West', 'Central']
+
+
+def generate(rows, output):
+    """Write a synthetic sales CSV with the given number of rows, reusing it if it already exists"""
+    if os.path.exists(output):
+        return output
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    regions = '[' + ', '.join(sql_literal(region) for region in REGIONS) + ']'
+    tmp_path = output + '.tmp'
+    con = duckdb.connect()
+    try:
+        con.execute(
+            f"""
+            COPY (
+                SELECT
+                    i // 2 + 1 AS OrderID,
+                    DATE '2023-01-01' + CAST(floor((i // 2) * 730.0 / {max(rows // 2, 1)}) AS INTEGER) AS OrderDate,
+                    'Product ' || lpad(CAST(hash(i * 7919) % {PRODUCTS} + 1 AS VARCHAR), 2, '0') AS ProductName,
+                    'Customer ' || CAST(hash(i // 2 + 17) % {CUSTOMERS} + 1 AS VARCHAR) AS CustomerName,
+                    list_extract({regions}, CAST(hash(i // 2 + 31) % {len(REGIONS)} + 1 AS INTEGER)) AS Region,
+                    CAST(hash(i + 101) % 5 + 1 AS INTEGER) AS Quantity,
+                    round(4.5 + (hash(i * 7919) % {PRODUCTS}) * 0.75, 2) AS UnitPrice,
+                    round(Quantity * UnitPrice, 2) AS TotalAmount
+                FROM range({rows}) t(i)
+            ) TO {sql_literal(tmp_path)} (FORMAT CSV, HEADER)
+            """
+        )
+    finally:
+        con.close()
+    os.replace(tmp_path, output)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic sales CSV")
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+    generate(args.rows, args.output)
+    print(f"{args.output}: {args.rows} rows, {os.path.getsize(args.output)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
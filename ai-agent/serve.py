@@ -0,0 +1,135 @@
+"""
+Production entry point for the AI agent API
+
+Runs the API under gunicorn with uvicorn worker processes. The app and phi are
+imported once in the master process before the workers are forked, so their code and
+data pages are shared instead of being loaded per worker. Datasets, profiles, rollups,
+samples and answers live on disk under DATA_CACHE_DIR, guarded by file locks, so every
+worker reuses what any of them built.
+
+What is cached in memory is not shared: every worker has its own agent pool (up to
+AGENT_POOL_MAX_SIZE agents, each with a DuckDB connection), query cache (up to
+QUERY_CACHE_MAX_BYTES) and front tier of the answer cache (ANSWER_CACHE_MEMORY_ITEMS),
+so memory grows with the worker count, and each worker builds its own agents and
+misses on queries another worker already ran. Answering is mostly waiting on OpenAI,
+which the AGENT_WORKERS threads of a single worker already overlap, so by default no
+more than MAX_DEFAULT_WORKERS workers are started; raise WEB_CONCURRENCY when CPU
+rather than memory is the limit.
+
+Environment:
+    HOST / PORT            bind address (default 0.0.0.0:8000)
+    WEB_CONCURRENCY        worker processes (default: CPUs available, at most MAX_DEFAULT_WORKERS)
+    MAX_DEFAULT_WORKERS    cap on the default worker count (default 2)
+    WORKER_TIMEOUT         seconds before a silent worker is restarted (default 120)
+    PROMETHEUS_MULTIPROC_DIR  where workers share metrics (default: a fresh temp dir)
+
+Use run_api.py for development (single process with auto-reload). gunicorn does not
+run on Windows; there the workers are started by uvicorn itself, without preloading.
+"""
+import tempfile
+import logging
+import shutil
+import os
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', '8000'))
+WORKER_TIMEOUT = int(os.environ.get('WORKER_TIMEOUT', '120'))
+MAX_DEFAULT_WORKERS = int(os.environ.get('MAX_DEFAULT_WORKERS', '2'))
+APP = "app.api.main:app"
+
+
+def default_workers():
+    """Worker processes: WEB_CONCURRENCY, or the CPUs this process may run on up to MAX_DEFAULT_WORKERS"""
+    if os.environ.get('WEB_CONCURRENCY'):
+        return max(1, int(os.environ['WEB_CONCURRENCY']))
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, MAX_DEFAULT_WORKERS))
+
+
+def log_worker_caches(workers):
+    """Log what the in-memory caches can take up across all workers (once the app has set up logging)"""
+    from app.agent.pool import AGENT_POOL_MAX_SIZE
+    from app.data.query_cache import QUERY_CACHE_MAX_BYTES
+    from app.answer_cache import ANSWER_CACHE_MEMORY_ITEMS
+
+    logging.getLogger("Serve").info(
+        f"Starting {workers} worker processes, each caching up to {AGENT_POOL_MAX_SIZE} agents, "
+        f"{QUERY_CACHE_MAX_BYTES // 2**20} MiB of query results and {ANSWER_CACHE_MEMORY_ITEMS} answers "
+        f"in memory (up to {workers * QUERY_CACHE_MAX_BYTES // 2**20} MiB of query results in total)"
+    )
+
+
+def prepare_metrics_dir():
+    """
+    Point prometheus_client at a shared directory so /metrics aggregates every worker
+
+    Must run before anything imports prometheus_client. Stale files from an earlier run
+    are cleared, since they would be added to this run's totals.
+    """
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.path.join(tempfile.gettempdir(), 'sales-agent-metrics')
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = path
+    return path
+
+
+def preload():
+    """Import what every worker needs before forking; none of it opens files, sockets or threads"""
+    import app.api.main  # noqa: F401
+    import phi.agent.duckdb  # noqa: F401
+    import app.agent.instrumented  # noqa: F401
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def run_gunicorn(workers):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': f"{HOST}:{PORT}",
+                'workers': workers,
+                'worker_class': 'uvicorn.workers.UvicornWorker',
+                'preload_app': True,
+                'timeout': WORKER_TIMEOUT,
+                'graceful_timeout': WORKER_TIMEOUT,
+                'keepalive': 5,
+                'child_exit': child_exit,
+                'accesslog': '-',
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            preload()
+            log_worker_caches(workers)
+            from app.api.main import app
+            return app
+
+    Server().run()
+
+
+def main():
+    workers = default_workers()
+    prepare_metrics_dir()
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        gunicorn = None
+
+    if gunicorn is None or os.name == 'nt':
+        import uvicorn
+        uvicorn.run(APP, host=HOST, port=PORT, workers=workers)
+    else:
+        run_gunicorn(workers)
+
+
+if __name__ == "__main__":
+    main()
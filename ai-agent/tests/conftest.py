@@ -0,0 +1,38 @@
+import tempfile
+import duckdb
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Datasets, profiles and caches written during the tests stay out of the real data directory
+os.environ['DATA_CACHE_DIR'] = tempfile.mkdtemp(prefix='sales-analysis-tests-')
+
+
+def write_sales(path, rows=400):
+    """Write a small sales parquet: 4 products, 3 regions, 2 lines per order over a year"""
+    con = duckdb.connect()
+    try:
+        con.execute(
+            f"""
+            COPY (
+                SELECT i // 2 + 1 AS OrderID,
+                       DATE '2024-01-01' + CAST(i * 365 // {rows} AS INTEGER) AS OrderDate,
+                       'Product ' || (i % 4 + 1) AS ProductName,
+                       'Customer ' || (i % 25 + 1) AS CustomerName,
+                       ['North', 'South', 'East'][i % 3 + 1] AS Region,
+                       i % 5 + 1 AS Quantity,
+                       2.5 * (i % 4 + 1) AS UnitPrice,
+                       (i % 5 + 1) * 2.5 * (i % 4 + 1) AS TotalAmount
+                FROM range({rows}) t(i)
+            ) TO '{path}' (FORMAT PARQUET)
+            """
+        )
+    finally:
+        con.close()
+    return path
+
+
+@pytest.fixture
+def sales_parquet(tmp_path):
+    return write_sales(str(tmp_path / 'sales.parquet'))
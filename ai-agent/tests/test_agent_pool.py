@@ -0,0 +1,146 @@
+from app.agent.pool import AgentPool, agent_pool
+from app.data import blob_store, ingest
+from app.data.ingest import materialize_dataset, notify_dataset_changed
+from app.main import open_dataset_connection
+from conftest import write_sales
+import duckdb
+import pytest
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from stub_backend import StubBackend
+
+
+class FakeAgent:
+    def __init__(self, key=None):
+        self.key = key
+        self.memory = None
+        self.connection = duckdb.connect()
+
+    @property
+    def closed(self):
+        try:
+            self.connection.execute("SELECT 1")
+            return False
+        except duckdb.ConnectionException:
+            return True
+
+
+@pytest.fixture
+def pool():
+    return AgentPool(max_size=8, idle_seconds=60)
+
+
+def test_idle_agent_is_reused(pool):
+    with pool.lease('a', FakeAgent) as first:
+        pass
+    with pool.lease('a', FakeAgent) as second:
+        pass
+    assert second is first and not first.closed
+    assert pool.stats()['hits'] == 1
+
+
+def test_evict_closes_matching_idle_agents(pool):
+    for key in ('old', ('old', 'approximate'), 'new'):
+        with pool.lease(key, FakeAgent):
+            pass
+    assert pool.evict(lambda key: key in ('old', ('old', 'approximate'))) == 2
+    assert pool.stats()['idle'] == 1
+    with pool.lease('new', FakeAgent) as agent:
+        assert not agent.closed
+    assert pool.stats()['hits'] == 1
+
+
+def test_agent_leased_during_evict_is_closed_on_return(pool):
+    with pool.lease('old', FakeAgent) as agent:
+        assert pool.evict(lambda key: key == 'old') == 1
+        assert not agent.closed
+    assert agent.closed
+    assert pool.stats()['idle'] == 0 and pool.stats()['leased'] == 0
+    # Agents built after the eviction are pooled as usual
+    with pool.lease('old', FakeAgent) as rebuilt:
+        pass
+    assert not rebuilt.closed and pool.stats()['idle'] == 1
+
+
+def test_failed_run_closes_agent(pool):
+    with pytest.raises(RuntimeError):
+        with pool.lease('a', FakeAgent) as agent:
+            raise RuntimeError("model error")
+    assert agent.closed and pool.stats()['idle'] == 0 and pool.stats()['leased'] == 0
+
+
+def test_dataset_change_evicts_agents_reading_the_old_version(tmp_path):
+    old_path = write_sales(str(tmp_path / 'old.parquet'))
+    other_path = write_sales(str(tmp_path / 'other.parquet'))
+    collection_path = str(tmp_path / 'set.collection.json')
+    with open(collection_path, 'w') as f:
+        json.dump({'partitions': [{'path': old_path}, {'path': other_path}]}, f)
+
+    agents = {}
+    for key in (old_path, (old_path, 'approximate'), collection_path, other_path):
+        with agent_pool.lease(key, FakeAgent) as agent:
+            agents[key] = agent
+    notify_dataset_changed({'key': 'sales', 'content_hash': 'new'}, old_path)
+
+    assert [key for key, agent in agents.items() if agent.closed] == [old_path, (old_path, 'approximate'),
+                                                                      collection_path]
+    assert agent_pool.evict(lambda key: key == other_path) == 1
+
+
+def test_reupload_evicts_pooled_agents_and_retires_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, 'BLOB_REVALIDATE_SECONDS', 0)
+    still_there = []
+    monkeypatch.setattr(ingest, '_change_listeners', ingest._change_listeners + [
+        lambda dataset, previous_path: still_there.append(os.path.exists(previous_path))])
+    first_csv, second_csv = str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv')
+    for path, rows in ((first_csv, 200), (second_csv, 300)):
+        con = duckdb.connect()
+        con.execute(f"COPY (SELECT * FROM read_parquet('{write_sales(path + '.parquet', rows)}')) TO '{path}' (HEADER)")
+        con.close()
+    stub = StubBackend({'upload': first_csv}).start()
+    try:
+        url = stub.file_url('upload')
+        old = materialize_dataset(url, 'reupload-test')
+        with agent_pool.lease(old['path'], lambda: FakeAgent(old['path'])) as agent:
+            agent.connection = open_dataset_connection(old['path'])
+        stub.add_file('upload', second_csv)
+        new = materialize_dataset(url, 'reupload-test')
+
+        # Other worker processes may still be answering from the old version
+        assert new['path'] != old['path'] and os.path.exists(old['path'])
+        connection = open_dataset_connection(old['path'])
+        assert connection.execute('SELECT count(*) FROM sales_data').fetchone() == (200,)
+        connection.close()
+
+        # The next ingest after the grace period removes it
+        monkeypatch.setattr(ingest, 'DATASET_VERSION_GRACE_SECONDS', 0)
+        assert materialize_dataset(url, 'reupload-test')['path'] == new['path']
+    finally:
+        stub.stop()
+
+    assert not os.path.exists(old['path']) and os.path.exists(new['path'])
+    assert not [name for name in os.listdir(os.path.dirname(old['path']))
+                if name.startswith(os.path.splitext(os.path.basename(old['path']))[0])]
+    assert still_there == [True]
+    assert agent.closed
+    with agent_pool.lease(new['path'], lambda: FakeAgent(new['path'])) as agent:
+        assert agent.key == new['path']
+
+
+def test_version_that_becomes_current_again_is_not_pruned(tmp_path, monkeypatch):
+    old, back = str(tmp_path / 'old.parquet'), str(tmp_path / 'back.parquet')
+    for path in (old, back, str(tmp_path / 'old.profile.json')):
+        open(path, 'w').close()
+    ingest.retire_version(old)
+    ingest.retire_version(back)
+    ingest.restore_version(back)
+
+    ingest.prune_retired_versions(str(tmp_path))
+    assert os.path.exists(old)
+    monkeypatch.setattr(ingest, 'DATASET_VERSION_GRACE_SECONDS', 0)
+    ingest.prune_retired_versions(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ['back.parquet']
@@ -0,0 +1,73 @@
+from app import answer_cache as answer_cache_module
+from app.answer_cache import AnswerCache, answer_key
+from app.data.ingest import notify_dataset_changed
+import pytest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.time for the answer cache"""
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache_module.time, 'time', lambda: now[0])
+    return now
+
+
+def cache_at(tmp_path, **kwargs):
+    return AnswerCache(path=str(tmp_path / 'answers.sqlite3'), **kwargs)
+
+
+def test_trivially_different_questions_share_a_key():
+    assert answer_key('h', "What was total revenue?", '7') == answer_key('h', "  what was TOTAL revenue ", '7')
+    assert answer_key('h', "What was total revenue?", '7') != answer_key('h', "What was total revenue?", '8')
+
+
+def test_answers_expire_after_the_ttl_in_both_tiers(tmp_path, clock):
+    cache = cache_at(tmp_path, ttl_seconds=60)
+    cache.put('k', 'sales', 'h1', 'answer')
+    clock[0] += 59
+    assert cache.get('k') == 'answer'
+
+    clock[0] += 2
+    assert cache.get('k') is None
+    # Nor is it served from disk by a fresh process
+    assert cache_at(tmp_path, ttl_seconds=60).get('k') is None
+
+
+def test_memory_tier_evicts_least_recently_used_and_falls_back_to_disk(tmp_path, clock):
+    cache = cache_at(tmp_path, memory_items=2)
+    cache.put('a', 'sales', 'h1', 'A')
+    cache.put('b', 'sales', 'h1', 'B')
+    assert cache.get('a') == 'A'
+    cache.put('c', 'sales', 'h1', 'C')
+
+    assert cache.stats()['memory_items'] == 2
+    assert list(cache._memory) == ['a', 'c']
+    assert cache.get('b') == 'B'
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_disk_tier_drops_least_recently_used_beyond_its_cap(tmp_path, clock):
+    cache = cache_at(tmp_path, memory_items=0, disk_items=2)
+    cache.put('a', 'sales', 'h1', 'A')
+    clock[0] += 1
+    cache.put('b', 'sales', 'h1', 'B')
+    clock[0] += 1
+    assert cache.get('a') == 'A'
+    clock[0] += 1
+    cache.put('c', 'sales', 'h1', 'C')
+
+    assert [cache.get(key) for key in 'abc'] == ['A', None, 'C']
+
+
+def test_changed_dataset_invalidates_only_its_stale_answers(tmp_path, monkeypatch):
+    cache = cache_at(tmp_path)
+    monkeypatch.setattr(answer_cache_module, 'answer_cache', cache)
+    cache.put('old', 'sales', 'h1', 'stale')
+    cache.put('new', 'sales', 'h2', 'fresh')
+    cache.put('other', 'costs', 'h1', 'unrelated')
+
+    notify_dataset_changed({'key': 'sales', 'content_hash': 'h2'}, str(tmp_path / 'gone.parquet'))
+
+    assert [cache.get(key) for key in ('old', 'new', 'other')] == [None, 'fresh', 'unrelated']
+    # The disk tier was invalidated too
+    assert [cache_at(tmp_path).get(key) for key in ('old', 'new', 'other')] == [None, 'fresh', 'unrelated']
@@ -0,0 +1,99 @@
+from app.data import blob_store
+from app.data.blob_store import blob_lock, fetch_blob
+import requests
+import hashlib
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from stub_backend import StubBackend  # noqa: E402
+
+import pytest  # noqa: E402
+
+CHUNK = 1024
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    """A stub backend and a blob store of its own, revalidating on every fetch"""
+    monkeypatch.setattr(blob_store, 'BLOB_DIR', str(tmp_path / 'blobs'))
+    monkeypatch.setattr(blob_store, 'BLOB_REVALIDATE_SECONDS', 0)
+    monkeypatch.setattr(blob_store, '_records', {})
+    # Small chunks, so a download cut off at a chunk boundary leaves what it got on disk
+    monkeypatch.setattr(blob_store, 'DOWNLOAD_CHUNK_SIZE', CHUNK)
+    backend = StubBackend().start()
+    yield backend
+    backend.stop()
+
+
+def write_csv(path, rows):
+    with open(path, 'w') as f:
+        f.write('OrderID,TotalAmount\n')
+        f.writelines(f'{i},{i * 2.5}\n' for i in range(rows))
+    return str(path)
+
+
+def fetch(url):
+    with blob_lock(url):
+        return fetch_blob(url)
+
+
+def sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_unchanged_url_is_revalidated_without_a_download(stub, tmp_path):
+    stub.add_file('sales', write_csv(tmp_path / 'sales.csv', 500))
+    url = stub.file_url('sales')
+    first = fetch(url)
+    assert first['bytes_downloaded'] == os.path.getsize(tmp_path / 'sales.csv')
+
+    second = fetch(url)
+    assert stub.downloads == 1 and stub.not_modified == 1
+    assert second['bytes_downloaded'] == 0 and second['sha256'] == first['sha256']
+
+
+def test_broken_download_resumes_where_it_stopped(stub, tmp_path):
+    path = write_csv(tmp_path / 'sales.csv', 5000)
+    size = os.path.getsize(path)
+    stub.add_file('sales', path)
+    stub.break_next_download(16 * CHUNK)
+
+    blob = fetch(stub.file_url('sales'))
+    # The retry asked for the rest with Range / If-Range and got a 206
+    assert stub.downloads == 2 and stub.bytes_sent == size
+    assert blob['size'] == size and blob['sha256'] == sha256(path) == sha256(blob['path'])
+    assert not [name for name in os.listdir(os.path.join(blob_store.BLOB_DIR, 'urls')) if '.part' in name]
+
+
+def test_partial_download_of_a_changed_file_starts_over(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, 'BLOB_DOWNLOAD_ATTEMPTS', 1)
+    path = write_csv(tmp_path / 'sales.csv', 5000)
+    stub.add_file('sales', path)
+    stub.break_next_download(8 * CHUNK)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        fetch(stub.file_url('sales'))
+
+    # The If-Range validator no longer matches, so the whole new file is sent
+    stub.add_file('sales', write_csv(tmp_path / 'changed.csv', 4000))
+    blob = fetch(stub.file_url('sales'))
+    assert blob['sha256'] == sha256(tmp_path / 'changed.csv')
+    assert stub.bytes_sent == 8 * CHUNK + os.path.getsize(tmp_path / 'changed.csv')
+
+
+def test_replaced_blob_is_pruned_unless_another_url_serves_it(stub, tmp_path):
+    first, second = write_csv(tmp_path / 'first.csv', 100), write_csv(tmp_path / 'second.csv', 200)
+    stub.add_file('a', first)
+    stub.add_file('b', first)
+    shared = fetch(stub.file_url('a'))
+    assert fetch(stub.file_url('b'))['path'] == shared['path']
+
+    # b still refers to the first version when a moves on
+    stub.add_file('a', second)
+    assert fetch(stub.file_url('a'))['sha256'] == sha256(second)
+    assert os.path.exists(shared['path'])
+
+    stub.add_file('b', second)
+    assert fetch(stub.file_url('b'))['sha256'] == sha256(second)
+    assert not os.path.exists(shared['path'])
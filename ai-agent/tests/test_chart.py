@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+from app.api import main as api
+
+
+def lookup(result):
+    async def aget_csv_url(file_id=None):
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return aget_csv_url
+
+
+def test_chart_lookup_failure_is_a_bad_gateway(monkeypatch):
+    monkeypatch.setattr(api, 'aget_csv_url', lookup(RuntimeError("backend unavailable")))
+    response = TestClient(api.app).get("/chart", params={"fileId": "abc"})
+    assert response.status_code == 502
+
+
+def test_chart_without_a_file_is_not_found(monkeypatch):
+    monkeypatch.setattr(api, 'aget_csv_url', lookup(None))
+    response = TestClient(api.app).get("/chart", params={"fileId": "abc"})
+    assert response.status_code == 404
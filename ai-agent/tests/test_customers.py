@@ -0,0 +1,90 @@
+from app.data.customers import MAX_LIFETIME_MONTHS, compute_customer_analytics, get_customer_analytics
+import numpy as np
+import duckdb
+
+JAN = 2024 * 12  # 2024-01 as months since year 0
+
+
+def customer_months(rows):
+    """load_customer_months-style arrays from (customer, month, revenue, orders, first_day, last_day) rows"""
+    columns = list(zip(*rows))
+    return {
+        'customer': np.array(columns[0], dtype=object),
+        'month': np.array(columns[1]),
+        'revenue': np.array(columns[2], dtype=float),
+        'orders': np.array(columns[3]),
+        'first_day': np.array(columns[4]),
+        'last_day': np.array(columns[5]),
+    }
+
+
+# Five customers over January to March; the data ends on day 90
+#   A buys every month (3 orders, 300), B in January and February (2 orders, 100), C twice in
+#   January (400), D once in February (20), E once in March (30)
+ROWS = customer_months([
+    ('A', JAN, 100, 1, 5, 5), ('A', JAN + 1, 100, 1, 35, 35), ('A', JAN + 2, 100, 1, 90, 90),
+    ('B', JAN, 50, 1, 8, 8), ('B', JAN + 1, 50, 1, 60, 60),
+    ('C', JAN, 400, 2, 3, 10),
+    ('D', JAN + 1, 20, 1, 40, 40),
+    ('E', JAN + 2, 30, 1, 80, 80),
+])
+
+
+def test_rfm_scores_are_quintiles():
+    analytics = compute_customer_analytics(ROWS)
+    assert analytics['names'].tolist() == ['A', 'B', 'C', 'D', 'E']
+    assert analytics['recency_days'].tolist() == [0, 30, 80, 50, 10]
+    assert analytics['frequency'].tolist() == [3, 2, 2, 1, 1]
+    assert analytics['monetary'].tolist() == [300, 100, 400, 20, 30]
+    # Recency quintile edges 8, 22, 38, 56 (lower is better); frequency 1, 1.6, 2, 2.2; monetary 28, 72, 180, 320
+    assert analytics['r_score'].tolist() == [5, 3, 1, 2, 4]
+    assert analytics['f_score'].tolist() == [5, 3, 3, 1, 1]
+    assert analytics['m_score'].tolist() == [4, 3, 5, 1, 2]
+    assert analytics['segment'].tolist() == ['Champions', 'Loyal', 'At risk', 'Needs attention', 'New']
+    assert analytics['segments']['At risk'] == {'customers': 1, 'revenue': 400.0}
+
+
+def test_cohort_retention_matrix():
+    analytics = compute_customer_analytics(ROWS)
+    assert analytics['cohort_months'] == ['2024-01', '2024-02', '2024-03']
+    assert analytics['cohort_sizes'].tolist() == [3, 1, 1]
+    retention = analytics['retention']
+    # Of January's three customers A and B buy in February, A alone in March; later months aren't observed
+    np.testing.assert_allclose(retention[0, :3], [1, 2 / 3, 1 / 3])
+    np.testing.assert_allclose(retention[1, :2], [1, 0])
+    assert retention[2, 0] == 1
+    assert np.isnan(retention[0, 3:]).all() and np.isnan(retention[1, 2:]).all() and np.isnan(retention[2, 1:]).all()
+
+
+def test_summary_and_lifetime_value():
+    summary = compute_customer_analytics(ROWS)['summary']
+    assert summary['customers'] == 5
+    assert summary['total_revenue'] == 850 and summary['total_orders'] == 9
+    assert summary['repeat_customer_rate'] == 0.6
+    assert summary['average_purchase_frequency'] == 1.8
+    assert summary['average_order_value'] == 850 / 9
+    # Of the 6 customer-months before March, 3 are followed by a purchase the next month
+    assert summary['monthly_retention_rate'] == 0.5
+    assert summary['expected_lifetime_months'] == 2
+    # 850 over 8 active customer-months, for 2 months
+    assert summary['customer_lifetime_value'] == 212.5
+    assert summary['as_of'] == '1970-04-01'
+
+
+def test_lifetime_is_capped_when_every_customer_stays():
+    summary = compute_customer_analytics(customer_months([
+        ('A', JAN, 10, 1, 0, 0), ('A', JAN + 1, 20, 1, 31, 31), ('A', JAN + 2, 30, 1, 60, 60),
+    ]))['summary']
+    assert summary['monthly_retention_rate'] == 1
+    assert summary['expected_lifetime_months'] == MAX_LIFETIME_MONTHS
+    assert summary['customer_lifetime_value'] == 20 * MAX_LIFETIME_MONTHS
+
+
+def test_analytics_of_a_dataset_match_its_totals(sales_parquet):
+    analytics = get_customer_analytics(sales_parquet)
+    customers, revenue = duckdb.sql(
+        f"SELECT count(DISTINCT CustomerName), sum(TotalAmount) FROM read_parquet('{sales_parquet}')"
+    ).fetchone()
+    assert analytics['summary']['customers'] == customers
+    assert abs(analytics['summary']['total_revenue'] - float(revenue)) < 1e-6
+    assert sum(segment['customers'] for segment in analytics['segments'].values()) == customers
@@ -0,0 +1,59 @@
+from app.data.forecast import (FORECAST_MAX_HORIZON, seasonal_naive, linear_trend, holt_winters, fit_forecasts,
+                               get_forecasts, describe_forecast)
+import numpy as np
+
+# A repeating 12-month pattern without trend, and a straight line
+PATTERN = np.array([5, 3, 4, 6, 9, 12, 14, 13, 10, 7, 6, 8], dtype=float)
+SEASONAL = np.tile(PATTERN, 3)
+LINE = 5 + 2 * np.arange(36, dtype=float)
+
+
+def test_seasonal_naive_repeats_the_last_season():
+    y = np.arange(24, dtype=float)[None, :]
+    forecasts, sigma, widths = seasonal_naive(y, 14, 12)
+    assert forecasts[0].tolist() == list(range(12, 24)) + [12, 13]
+    # Every value is 12 more than a season earlier
+    assert sigma.tolist() == [0.0]
+    assert widths.tolist() == [1.0] * 12 + [np.sqrt(2)] * 2
+
+
+def test_linear_trend_extends_the_line():
+    forecasts, sigma, widths = linear_trend(LINE[None, :], 3)
+    np.testing.assert_allclose(forecasts[0], [77, 79, 81])
+    np.testing.assert_allclose(sigma, [0], atol=1e-9)
+    assert (np.diff(widths) > 0).all()
+
+
+def test_holt_winters_follows_trend_and_season():
+    # Holt's linear method with less than two seasons of history: exact on a line
+    forecasts, sigma, _ = holt_winters(LINE[None, :20], 3, 12)
+    np.testing.assert_allclose(forecasts[0], [45, 47, 49])
+    np.testing.assert_allclose(sigma, [0], atol=1e-9)
+
+    # A repeating season is learned from the first one
+    forecasts, sigma, widths = holt_winters(SEASONAL[None, :], 12, 12)
+    np.testing.assert_allclose(forecasts[0], PATTERN, atol=1e-9)
+    assert widths.shape == (1, 12) and widths[0, 0] == 1.0
+
+
+def test_backtest_keeps_the_most_accurate_model_per_series():
+    fitted = fit_forecasts(np.stack([LINE, SEASONAL]), 12, 12)
+    assert fitted['model'] == ['linear_trend', 'seasonal_naive']
+    assert fitted['holdout'] == 9
+    mae = {name: metrics[0] for name, metrics in fitted['backtest'].items()}
+    assert mae['linear_trend'][0] < 1e-9 and mae['seasonal_naive'][0] == 24
+    assert mae['seasonal_naive'][1] == 0 and mae['linear_trend'][1] > 0
+    np.testing.assert_allclose(fitted['forecast'][0, :2], [77, 79])
+    np.testing.assert_allclose(fitted['forecast'][1], PATTERN)
+    assert (fitted['lower'] <= fitted['forecast']).all() and (fitted['forecast'] <= fitted['upper']).all()
+
+
+def test_forecasts_are_fitted_once_for_every_horizon(sales_parquet):
+    get_forecasts.cache_clear()
+    forecasts = get_forecasts(sales_parquet)
+    assert len(forecasts['future_periods']) == forecasts['forecast'].shape[1] == FORECAST_MAX_HORIZON
+
+    three = describe_forecast(get_forecasts(sales_parquet), 0, 3)['forecast']
+    twelve = describe_forecast(get_forecasts(sales_parquet), 0, 12)['forecast']
+    assert len(three) == 3 and three == twelve[:3]
+    assert get_forecasts.cache_info().misses == 1
@@ -0,0 +1,53 @@
+from app.data.kpi import kpi_sections_for_question, wants_kpi_context, answer_kpi_question, get_dataset_kpis
+from app.main import prepare_analysis_input
+import pytest
+
+
+@pytest.mark.parametrize('question, sections', [
+    ("What is our total revenue?", ['totals']),
+    ("what's the total revenue", ['totals']),
+    ("How many orders do we have?", ['totals']),
+    ("total number of orders and average order value", ['totals']),
+    ("what is the month-over-month growth", ['growth']),
+    ("top 5 products", ['top_products']),
+    ("top 5 products by revenue", ['top_products']),
+    ("best selling products by quantity", ['top_products']),
+    ("Show me the worst selling items", ['bottom_products']),
+])
+def test_plain_metric_questions_are_answered_directly(question, sections):
+    assert kpi_sections_for_question(question) == sections
+
+
+@pytest.mark.parametrize('question', [
+    "total revenue for product X",
+    "total revenue of Product 3",
+    "total sales by store",
+    "top 5 products by profit",
+    "top products in the north region",
+    "total revenue per customer",
+    "top 10 products",
+    "total revenue in 2023",
+    "total revenue last month",
+    "why did total revenue drop",
+])
+def test_filtered_or_grouped_questions_go_to_the_agent(question):
+    assert kpi_sections_for_question(question) == []
+    assert wants_kpi_context(question)
+
+
+def test_unrelated_questions_get_no_kpis():
+    assert kpi_sections_for_question("which customers buy the most") == []
+    assert not wants_kpi_context("which customers buy the most")
+
+
+def test_qualified_question_gets_kpi_context(sales_parquet):
+    direct_answer, agent_input = prepare_analysis_input("total revenue for Product 3", sales_parquet)
+    assert direct_answer is None
+    assert "Precomputed metrics for the whole dataset" in agent_input
+
+
+def test_plain_question_answered_from_kpis(sales_parquet):
+    kpis = get_dataset_kpis(sales_parquet)
+    direct_answer, _ = prepare_analysis_input("total revenue", sales_parquet)
+    assert direct_answer == answer_kpi_question("total revenue", kpis)
+    assert "Total Sales Revenue" in direct_answer
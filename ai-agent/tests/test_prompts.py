@@ -0,0 +1,31 @@
+from app.agent.prompts import analyst_instructions, approximate_question, scope_question
+from app.main import prepare_analysis_input
+
+TOOL_NAMES = ('customer_insights', 'forecast_sales')
+QUESTION = "Forecast next month's revenue and our customer retention"
+
+
+def test_rollup_instructions_only_for_agents_with_rollups():
+    assert any('sales_by_' in line for line in analyst_instructions(rollups=True))
+    assert not any('sales_by_' in line for line in analyst_instructions(rollups=False))
+    assert 'sales_by_' in approximate_question(QUESTION, rollups=True)
+    assert 'sales_by_' not in approximate_question(QUESTION, rollups=False)
+
+
+def test_tool_bullets_only_for_agents_with_the_tools():
+    for question in (QUESTION, "Give me a full report"):
+        assert all(name in scope_question(question, tools=True) for name in TOOL_NAMES)
+        assert not any(name in scope_question(question, tools=False) for name in TOOL_NAMES)
+
+
+def test_agent_input_matches_the_agent_it_goes_to(sales_parquet):
+    _, exact = prepare_analysis_input(QUESTION, sales_parquet)
+    assert all(name in exact for name in TOOL_NAMES)
+
+    # Approximate agents don't get the tools, remote CSVs get neither tools nor rollups
+    sample = {'path': sales_parquet}
+    _, approximate = prepare_analysis_input(QUESTION, sales_parquet, sample)
+    assert not any(name in approximate for name in TOOL_NAMES) and 'sales_by_' in approximate
+
+    _, remote = prepare_analysis_input(QUESTION, "https://example.com/sales.csv")
+    assert not any(name in remote for name in TOOL_NAMES) and 'sales_by_' not in remote
@@ -0,0 +1,113 @@
+from app.data.query_cache import query_cache, normalize_query, is_cacheable, fetch_result, format_result
+from app.agent.instrumented import SalesDuckDbTools
+from conftest import write_sales
+import duckdb
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    query_cache.clear()
+    yield
+    query_cache.clear()
+
+
+def counted(stat, run):
+    """How much a query cache stat grew while run() ran"""
+    before = query_cache.stats()[stat]
+    run()
+    return query_cache.stats()[stat] - before
+
+
+def tools(path, *views):
+    """Tools over a connection exposing the parquet at path as sales_data, and any other views given"""
+    con = duckdb.connect()
+    con.execute(f"CREATE VIEW sales_data AS SELECT * FROM read_parquet('{path}')")
+    for view in views:
+        con.execute(view)
+    return SalesDuckDbTools(connection=con, dataset='sales')
+
+
+def test_restyled_queries_share_a_key():
+    _, key = normalize_query("SELECT sum(TotalAmount) FROM sales_data")
+    _, restyled = normalize_query("-- again\nselect  sum(TotalAmount)\n  from sales_data;")
+    assert key == restyled
+    # Quoted text keeps its case
+    assert normalize_query("SELECT 'A'")[1] != normalize_query("SELECT 'a'")[1]
+
+
+@pytest.mark.parametrize('query, cacheable', [
+    ("select * from sales_data", True),
+    ("with t as (select 1) select * from t", True),
+    ("show tables", True),
+    ("create table t as select 1", False),
+    ("insert into t values (1)", False),
+    ("select random()", False),
+    ("select * from sales_data where orderdate < current_date", False),
+])
+def test_only_repeatable_reads_are_cacheable(query, cacheable):
+    assert is_cacheable(normalize_query(query)[1]) == cacheable
+
+
+def test_fetch_result_keeps_only_the_first_rows():
+    con = duckdb.connect()
+    table, total = fetch_result(con.sql("SELECT * FROM range(100000) t(i)"), max_rows=10)
+    assert (table.num_rows, total) == (10, 100000)
+    assert table.column('i').to_pylist() == list(range(10))
+    text, left_out = format_result(table, total, max_rows=10)
+    assert left_out == 99990
+    assert len(text.splitlines()) == 12
+    assert "99990 more rows not shown (100000 in total)" in text
+
+
+def test_small_results_are_not_truncated():
+    con = duckdb.connect()
+    table, total = fetch_result(con.sql("SELECT 1 AS a, 2 AS b"))
+    assert format_result(table, total) == ("a,b\n1,2", 0)
+
+
+def test_repeated_query_is_served_from_cache(tmp_path):
+    path = write_sales(str(tmp_path / 'sales.parquet'))
+    first, second = tools(path), tools(path)
+    answer = first.run_query("SELECT ProductName, sum(TotalAmount) FROM sales_data GROUP BY 1 ORDER BY 1")
+    restyled = "select ProductName, sum(TotalAmount) from sales_data group by 1 order by 1;"
+    assert counted('hits', lambda: second.run_query(restyled)) == 1
+    assert second.run_query(restyled) == answer
+
+
+def test_large_result_cached_truncated(tmp_path):
+    path = write_sales(str(tmp_path / 'sales.parquet'), rows=1000)
+    first, second = tools(path), tools(path)
+    answer = first.run_query("SELECT * FROM sales_data")
+    assert "900 more rows not shown (1000 in total)" in answer
+    assert query_cache._entries and all(table.num_rows == 100 for table, _, _ in query_cache._entries.values())
+    assert counted('rows_truncated', lambda: second.run_query("SELECT * FROM sales_data")) == 900
+    assert second.run_query("SELECT * FROM sales_data") == answer
+
+
+def test_connections_exposing_other_files_do_not_share_results(tmp_path):
+    full = tools(write_sales(str(tmp_path / 'sales.parquet'), rows=400))
+    sample = tools(write_sales(str(tmp_path / 'sample.parquet'), rows=40))
+    assert full.cache_scope() != sample.cache_scope()
+    assert full.run_query("SELECT count(*) FROM sales_data") == "count_star()\n400"
+    assert counted('hits', lambda: sample.run_query("SELECT count(*) FROM sales_data")) == 0
+    assert sample.run_query("SELECT count(*) FROM sales_data") == "count_star()\n40"
+
+
+def test_connections_with_other_views_do_not_share_catalog_results(tmp_path):
+    path = write_sales(str(tmp_path / 'sales.parquet'))
+    plain, extended = tools(path), tools(path, "CREATE VIEW sales_extra AS SELECT 1")
+    assert 'sales_extra' not in plain.run_query("SHOW TABLES")
+    assert 'sales_extra' in extended.run_query("SHOW TABLES")
+
+
+def test_writes_stop_caching_for_the_connection(tmp_path):
+    path = write_sales(str(tmp_path / 'sales.parquet'))
+    agent_tools, other = tools(path), tools(path)
+    assert agent_tools.run_query("CREATE TABLE big AS SELECT * FROM sales_data WHERE Quantity > 3") == "No output"
+    agent_tools.run_query("SELECT count(*) FROM sales_data")
+    assert counted('hits', lambda: other.run_query("SELECT count(*) FROM sales_data")) == 0
+
+
+def test_errors_are_returned_to_the_agent(tmp_path):
+    assert 'missing_table' in tools(write_sales(str(tmp_path / 'sales.parquet'))).run_query("SELECT * FROM missing_table")
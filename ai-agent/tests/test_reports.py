@@ -0,0 +1,55 @@
+from app.api.workers import AgentWorkerPool, WorkerPoolFull
+from app.reports import ReportJobs
+import threading
+import pytest
+import time
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+def test_full_job_queue_rejects_further_reports(gate):
+    jobs = ReportJobs(jobs=1, queue_depth=1, workers=AgentWorkerPool(workers=1, queue_depth=0))
+    # The dataset never loads while the gate is closed, so the first job runs and the second waits
+    load_dataset = lambda: gate.wait(5) and None
+    first = jobs.submit(load_dataset)
+    second = jobs.submit(load_dataset)
+    with pytest.raises(WorkerPoolFull):
+        jobs.submit(load_dataset)
+    assert jobs.get(second)['status'] == 'queued'
+
+    gate.set()
+    wait_for(lambda: all(jobs.get(job_id)['status'] == 'failed' for job_id in (first, second)))
+    jobs.submit(lambda: None)
+    jobs.shutdown()
+
+
+def test_report_work_waits_for_room_in_the_worker_pool(gate):
+    workers = AgentWorkerPool(workers=1, queue_depth=0)
+    jobs = ReportJobs(jobs=1, queue_depth=0, section_parallelism=2, workers=workers)
+    chat = workers.start(gate.wait, 5)
+    # A chat request would be turned away now, report work waits instead
+    with pytest.raises(WorkerPoolFull):
+        workers.start(lambda: None)
+    admitted = []
+    waiting = threading.Thread(target=lambda: admitted.append(jobs._admit(lambda: 'section')))
+    waiting.start()
+    time.sleep(0.1)
+    assert not admitted
+
+    gate.set()
+    waiting.join(5)
+    assert chat.result() is True
+    assert admitted[0].result(5) == 'section'
+    wait_for(lambda: workers.stats()['queued'] == 0 and workers.stats()['running'] == 0)
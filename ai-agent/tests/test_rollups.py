@@ -0,0 +1,43 @@
+from app.data import rollups
+from app.data.rollups import build_rollups, get_rollups, refresh_rollups
+from conftest import write_sales
+import duckdb
+import shutil
+
+
+def table_rows(path):
+    con = duckdb.connect()
+    try:
+        return sorted(con.execute(f"SELECT * FROM read_parquet('{path}')").fetchall(), key=repr)
+    finally:
+        con.close()
+
+
+def test_refresh_after_an_append_equals_a_full_rebuild(tmp_path, monkeypatch):
+    extended = write_sales(str(tmp_path / 'v2.parquet'), rows=600)
+    # The earlier version is the first 400 rows (200 whole orders) of the extended one
+    original = str(tmp_path / 'v1.parquet')
+    con = duckdb.connect()
+    con.execute(f"COPY (SELECT * FROM read_parquet('{extended}') LIMIT 400) TO '{original}' (FORMAT PARQUET)")
+    con.close()
+    rebuilt = str(tmp_path / 'full.parquet')
+    shutil.copy(extended, rebuilt)
+
+    before = get_rollups(original)
+    merges = []
+    merge_sql = rollups._merge_sql
+    monkeypatch.setattr(rollups, '_merge_sql', lambda sources, measures: merges.append(sources) or
+                        merge_sql(sources, measures))
+    refreshed = refresh_rollups(extended, {'path': original, 'row_count': 400})
+    # Every table was merged from the earlier rollup and the appended rows only
+    assert len(merges) == len(before['tables'])
+    assert all('file_row_number >= 400' in sources[1] for sources in merges)
+    full = build_rollups(rebuilt)
+
+    assert sorted(refreshed['tables']) == sorted(full['tables']) == sorted(before['tables'])
+    for name, table in full['tables'].items():
+        assert table_rows(refreshed['tables'][name]['path']) == table_rows(table['path']), name
+        assert refreshed['tables'][name]['row_count'] == table['row_count']
+    # The earlier version's rollups are left as they were
+    assert table_rows(before['tables']['sales_by_month_product']['path']) != \
+        table_rows(full['tables']['sales_by_month_product']['path'])
@@ -0,0 +1,45 @@
+from app.agent.router import route_message, needs_dataset
+import pytest
+
+
+@pytest.mark.parametrize('message, intent', [
+    ("", 'greeting'),
+    ("hi", 'greeting'),
+    ("thank you so much", 'greeting'),
+    ("I just uploaded a new file", 'upload'),
+    ("search the web for wedding cake trends", 'web_search'),
+    ("what are our competitors charging", 'web_search'),
+    ("which customers buy the most", 'analysis'),
+    ("hi, can you help me understand my sales data", 'analysis'),
+    ("forecast sales for the next three months", 'analysis'),
+])
+def test_intents(message, intent):
+    assert route_message(message).intent == intent
+
+
+@pytest.mark.parametrize('message', [
+    "What is the total revenue?",
+    "How many orders do we have?",
+    "top 5 products by revenue",
+    "what is the yoy growth",
+])
+def test_plain_metric_questions_route_to_kpi(message):
+    route = route_message(message)
+    assert route == ('kpi', 1.0, 'kpi rule')
+    assert needs_dataset(route.intent)
+
+
+@pytest.mark.parametrize('message', [
+    "total revenue for product X",
+    "total sales by store",
+    "top 5 products by profit",
+    "top 10 products",
+    "how many orders in the west region",
+    "total revenue in March",
+])
+def test_qualified_metric_questions_route_to_analysis(message):
+    assert route_message(message).intent == 'analysis'
+
+
+def test_web_search_wins_over_metric_words():
+    assert route_message("search the web for total revenue of bakeries").intent == 'web_search'
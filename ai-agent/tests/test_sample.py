@@ -0,0 +1,26 @@
+from app.data.ingest import open_dataset_connection
+from app.data import sample as sample_module
+from conftest import write_sales
+
+
+def test_approximate_connection_exposes_only_the_sample(tmp_path, monkeypatch):
+    monkeypatch.setattr(sample_module, 'SAMPLE_MIN_ROWS', 1000)
+    path = write_sales(str(tmp_path / 'sales.parquet'), rows=4000)
+    sample = sample_module.get_sample(path)
+    assert sample['path'] and sample['rows'] < 4000
+
+    con = open_dataset_connection(path, sample=sample)
+    try:
+        rows, weighted = con.execute("SELECT count(*), round(sum(_sample_weight)) FROM sales_data").fetchone()
+        assert (rows, weighted) == (sample['rows'], 4000)
+        # No view reads the full dataset
+        definitions = [sql for sql, in con.execute("SELECT sql FROM duckdb_views() WHERE NOT internal").fetchall()]
+        assert definitions and not any(f"'{path}'" in sql for sql in definitions)
+    finally:
+        con.close()
+
+    con = open_dataset_connection(path)
+    try:
+        assert con.execute("SELECT count(*) FROM sales_data").fetchone()[0] == 4000
+    finally:
+        con.close()
@@ -0,0 +1,15 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from startup_budget import measure_import
+
+STARTUP_BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS', '1500'))
+
+
+def test_api_import_is_fast_offline_and_lazy():
+    report = measure_import()
+    assert report['elapsed_ms'] <= STARTUP_BUDGET_MS, f"import took {report['elapsed_ms']:.0f} ms"
+    assert report['network_attempts'] == []
+    assert not report['phi_imported']
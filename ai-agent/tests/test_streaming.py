@@ -0,0 +1,41 @@
+from fastapi.testclient import TestClient
+from app.main import StreamingResponseFormatter, remove_sql_queries, format_analysis_response
+from app.api import main as api
+import pytest
+
+ANSWER = (
+    "## Revenue\n\nTotal revenue was **$12,345**.\n\n\n\n"
+    "```sql\nSELECT sum(TotalAmount)\nFROM sales_data\n```\n"
+    "Product 1 led with 40%.\n\nRecommendations: push Product 2 in the North region.\n"
+)
+
+
+def stream(chunks):
+    formatter = StreamingResponseFormatter()
+    return ''.join(formatter.feed(chunk) for chunk in chunks) + formatter.flush()
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 16])
+def test_chunk_boundaries_dont_change_the_output(size):
+    chunks = [ANSWER[i:i + size] for i in range(0, len(ANSWER), size)]
+    assert stream(chunks) == stream([ANSWER]) == format_analysis_response(remove_sql_queries(ANSWER))
+
+
+def test_sql_fence_split_mid_token_is_removed():
+    text = stream(["Total: 5\n`", "``s", "ql\nSELECT 1\n`", "``\nDone"])
+    assert "SELECT" not in text and "`" not in text
+    assert text == "Total: 5\nDone"
+
+
+def test_unclosed_sql_fence_is_dropped_at_the_end():
+    assert stream(["Answer\n```sql\nSELECT", " 1"]) == "Answer\n"
+
+
+def test_stream_lookup_failure_is_an_http_error(monkeypatch):
+    async def failing_lookup(request, route):
+        raise RuntimeError("backend unavailable")
+    monkeypatch.setattr(api, 'resolve_chat_files', failing_lookup)
+
+    response = TestClient(api.app).post("/chat/stream", json={"message": "What was total revenue?"})
+    assert response.status_code == 500
+    assert "backend unavailable" in response.json()["detail"]
@@ -0,0 +1,97 @@
+from app.api import get_csv_url as urls
+from app.api.get_csv_url import UrlCache
+import threading
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.monotonic for the URL cache"""
+    now = [1000.0]
+    monkeypatch.setattr(urls.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Answers for backend paths, and the paths requested"""
+    answers, requested = {}, []
+
+    def get(path):
+        requested.append(path)
+        return answers.get(path, (None, None))
+    monkeypatch.setattr(urls, 'url_cache', UrlCache())
+    monkeypatch.setattr(urls, '_get', get)
+    return answers, requested
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = UrlCache()
+    cache.put('a', 'url', 10)
+    cache.put('missing', None, 2)
+    assert cache.get('a') == (True, 'url')
+    assert cache.get('missing') == (True, None)
+
+    clock[0] += 5
+    assert cache.get('missing') == (False, None)
+    assert cache.get('a') == (True, 'url')
+    clock[0] += 6
+    assert cache.get('a') == (False, None)
+    assert cache.stats() == {'items': 0, 'hits': 3, 'misses': 2}
+
+
+def test_oldest_entries_are_dropped_beyond_max_items(clock):
+    cache = UrlCache(max_items=2)
+    for key in 'abc':
+        cache.put(key, key, 10)
+    assert [cache.get(key)[0] for key in 'abc'] == [False, True, True]
+
+
+def test_missing_files_are_remembered_briefly_and_errors_not_at_all(backend, clock):
+    answers, requested = backend
+    path = urls._file_path('gone')
+    answers[path] = (404, {'error': 'File not found'})
+    assert urls.get_file_url_by_id('gone') is None
+    assert urls.get_file_url_by_id('gone') is None
+    assert requested == [path]
+
+    clock[0] += urls.URL_NEGATIVE_TTL_SECONDS + 1
+    answers[path] = (200, {'url': 'https://files/gone.csv'})
+    assert urls.get_file_url_by_id('gone') == 'https://files/gone.csv'
+
+    # A backend that can't be reached is asked again next time
+    down = urls._file_path('down')
+    assert urls.get_file_url_by_id('down') is None
+    assert urls.get_file_url_by_id('down') is None
+    assert requested.count(down) == 2
+
+
+def test_latest_file_comes_from_the_latest_route(backend, clock):
+    answers, requested = backend
+    answers['/api/url/latest'] = (200, {'id': 'f2', 'url': 'https://files/2.csv'})
+    assert urls.get_latest_file_url() == 'https://files/2.csv'
+    # The file's own ID is resolved from the same answer
+    assert urls.get_file_url_by_id('f2') == 'https://files/2.csv'
+    assert requested == ['/api/url/latest']
+
+
+def test_client_of_another_event_loop_is_closed():
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=other_loop.run_forever)
+    thread.start()
+    try:
+        async def client():
+            return urls.get_async_client()
+        old = asyncio.run_coroutine_threadsafe(client(), other_loop).result(5)
+        assert asyncio.run(client()) is not old
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), other_loop).result(5)
+        assert old.is_closed
+    finally:
+        other_loop.call_soon_threadsafe(other_loop.stop)
+        thread.join(5)
+        other_loop.close()
+
+    # A client whose loop is gone is dropped without error
+    new = urls._async_client[1]
+    assert asyncio.run(client()) is not new
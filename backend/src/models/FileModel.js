@@ -8,4 +8,8 @@ const fileSchema = new mongoose.Schema({
     uploaded_at: { type: Date, default: Date.now },
 });
 
+// Newest-first lookups: the latest upload and a browser's uploads
+fileSchema.index({ uploaded_at: -1 });
+fileSchema.index({ browser_id: 1, uploaded_at: -1 });
+
 module.exports = mongoose.model('File', fileSchema);
\ No newline at end of file
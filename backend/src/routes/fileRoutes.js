@@ -4,6 +4,7 @@ const { uploadFile } = require('../controllers/fileController');
 const { 
     getFileUrls, 
     getFileUrlById, 
+    getLatestFile, 
     getFilesByBrowserId, 
     deleteFileById 
 } = require('../services/fileService');
@@ -24,6 +25,20 @@ router.get('/urls', async (req, res) => {
     }
 });
 
+// Registered before /url/:id so "latest" isn't taken for a file ID
+router.get('/url/latest', async (req, res) => {
+    try {
+        const file = await getLatestFile();
+        if (!file) {
+            return res.status(404).json({ error: 'No files uploaded' });
+        }
+        res.json(file);
+    } catch (error) {
+        console.error('Error in /url/latest route:', error);
+        res.status(500).json({ error: 'Failed to fetch latest file URL', details: error.message });
+    }
+});
+
 router.get('/url/:id', async (req, res) => {
     try {
         const fileId = req.params.id;
@@ -1,3 +1,4 @@
+const mongoose = require('mongoose');
 const File = require('../models/FileModel');
 
 /**
@@ -48,6 +49,10 @@ const deleteFileById = async (fileId) => {
  */
 const getFileUrlById = async (fileId) => {
     try {
+        // An ID that can't be an ObjectId can't name a file either
+        if (!mongoose.isValidObjectId(fileId)) {
+            throw new Error('File not found');
+        }
         const file = await File.findById(fileId);
         
         if (!file) {
@@ -62,12 +67,26 @@ const getFileUrlById = async (fileId) => {
 };
 
 /**
- * Get URLs of files from MongoDB
+ * Get the most recently uploaded file
+ * @returns {Promise<Object|null>} - The file's ID and URL, or null when nothing has been uploaded
+ */
+const getLatestFile = async () => {
+    try {
+        const file = await File.findOne({}, { file_url: 1 }).sort({ uploaded_at: -1 }).lean();
+        return file ? { id: String(file._id), url: file.file_url } : null;
+    } catch (error) {
+        console.error('Error fetching latest file:', error);
+        throw error;
+    }
+};
+
+/**
+ * Get URLs of files from MongoDB, oldest upload first
  */
 const getFileUrls = async () => {
     try {
         // Using proper projection syntax - empty filter object followed by projection
-        const files = await File.find({}, { file_url: 1, _id: 0 });
+        const files = await File.find({}, { file_url: 1, _id: 0 }).sort({ uploaded_at: 1, _id: 1 });
         return files.map(file => file.file_url);
     } catch (error) {
         console.error('Error fetching file URLs:', error);
@@ -78,6 +97,7 @@ const getFileUrls = async () => {
 module.exports = { 
     getFileUrls, 
     getFileUrlById, 
+    getLatestFile, 
     getFilesByBrowserId, 
     deleteFileById 
 };
\ No newline at end of file